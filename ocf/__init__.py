@@ -40,6 +40,11 @@ In addition to the members declared below, the following aliases are available:
 .. py:class:: ocf.Action
 
    Alias for :class:`ocf.ra.Action`.
+
+.. py:function:: ocf.register
+
+   Alias for :func:`ocf.agents.register`. :mod:`ocf.agents` is only
+   imported when this is first called.
 """
 
 from __future__ import absolute_import
@@ -106,6 +111,14 @@ OCF_FAILED_MASTER = 9
 #: :class:`logging.Logger` instance
 log = logging.getLogger(__name__)
 
+
+def register(agent=None, name=None):
+    # Most agents never register themselves, so don't import ocf.agents
+    # for them
+    from ocf.agents import register
+    return register(agent, name)
+
+
 # Import these at the end so that the circular references don't go haywire
 import ocf.environment  # noqa
 from ocf.ra import ResourceAgent, Parameter, Action  # noqa
@@ -0,0 +1,236 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Running many agents from a single executable.
+
+Rather than installing one script per agent, each importing the library on
+its own, the ``ocf-agent`` executable can be symlinked into
+``resource.d/<provider>/`` under the name of every agent. When run, it looks
+up the agent named by :attr:`ocf.environment.Environment.script_name`, imports
+only the module defining that agent, and calls its
+:meth:`~ocf.ra.ResourceAgent.main`.
+
+Agents are found in the ``ocf.agents`` entry point group of installed
+packages, so that nothing has to be imported to find them::
+
+    setup(
+        ...
+        entry_points={
+            'ocf.agents': [
+                'foo = mypackage.foo:FooAgent',
+            ],
+        },
+    )
+
+They can also be registered with :func:`register`, for example in a
+site-specific dispatcher script::
+
+    import ocf.agents
+
+    ocf.agents.register('mypackage.foo:FooAgent', name='foo')
+    ocf.agents.main()
+
+``ocf-agent`` can also be run directly, as ``ocf-agent <agent> <action>``,
+and has two options of its own: ``ocf-agent --list`` lists the known agents,
+and ``ocf-agent --link <directory>`` creates the symlinks for all of them.
+"""
+
+from __future__ import absolute_import, print_function
+
+import importlib
+import ocf
+import os
+import sys
+
+import six
+
+#: Name of the entry point group in which agents are looked up.
+ENTRY_POINT_GROUP = 'ocf.agents'
+
+_registry = {}
+
+# Entry points found by _entry_points(), once looked for
+_entry_point_cache = None
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    global _entry_point_cache
+    _entry_point_cache = None
+
+
+def register(agent=None, name=None):
+    """
+    Registers an agent to be run by :func:`main`.
+
+    :param agent: A :class:`~ocf.ra.ResourceAgent` sub-class, or a string of
+      the form ``'module:Class'`` naming one, which is only imported when the
+      agent is run.
+    :param str name: Name under which to register the agent. Optional for a
+      class; defaults to its ``NAME`` attribute, or else its class name.
+
+    This is also available as :func:`ocf.register`, and can be used as a
+    class decorator, with or without arguments::
+
+        @ocf.register
+        class FooAgent(ocf.ResourceAgent):
+            NAME = 'foo'
+            ...
+    """
+    if agent is None:
+        return lambda agent: register(agent, name)
+
+    if name is None:
+        if isinstance(agent, six.string_types):
+            raise ValueError("a name is needed to register {0}".format(agent))
+        name = getattr(agent, 'NAME', None) or agent.__name__
+
+    _registry[name] = agent
+    return agent
+
+
+def _entry_points():
+    """
+    Returns a dictionary mapping names to entry points in the
+    :data:`ENTRY_POINT_GROUP` group. Installed packages are only looked
+    through once per invocation.
+    """
+    global _entry_point_cache
+    if _entry_point_cache is None:
+        _entry_point_cache = dict((ep.name, ep) for ep in _find_entry_points())
+    return _entry_point_cache
+
+
+def _find_entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return ()
+        return pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)
+
+    try:
+        # Python 3.10 and later only read the group asked for
+        return metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        return metadata.entry_points().get(ENTRY_POINT_GROUP, ())
+
+
+def lookup(name):
+    """
+    Returns the agent class registered as ``name``, importing its module if
+    necessary, or ``None`` if there is no such agent. Agents registered with
+    :func:`register` are found without looking through installed packages.
+
+    :raises ImportError: or :exc:`AttributeError`, if the agent's module or
+      class can't be found.
+    """
+    agent = _registry.get(name)
+    if agent is None:
+        ep = _entry_points().get(name)
+        if ep is None:
+            return None
+        agent = ep.load()
+    elif isinstance(agent, six.string_types):
+        module, _, attr = agent.partition(':')
+        agent = getattr(importlib.import_module(module), attr)
+
+    _registry[name] = agent
+    return agent
+
+
+def names():
+    """
+    Returns the sorted names of all the known agents.
+    """
+    return sorted(set(_registry) | set(_entry_points()))
+
+
+def link(directory, target=None):
+    """
+    Creates a symlink to ``target`` (by default, this executable) in
+    ``directory`` for each known agent which doesn't already have one.
+    Returns the names of the links created.
+    """
+    if target is None:
+        target = os.path.abspath(sys.argv[0])
+
+    created = []
+    for name in names():
+        path = os.path.join(directory, name)
+        if not os.path.lexists(path):
+            os.symlink(target, path)
+            created.append(name)
+    return created
+
+
+def _usage():
+    print("Usage: {prog} <agent> <action> | --list | --link <directory>"
+          .format(prog=ocf.env.script_name), file=sys.stderr)
+
+
+def main():
+    """
+    Runs the agent named by the script name, or by the first argument if the
+    script name isn't one. This is the entry point of ``ocf-agent``.
+    """
+    agent = _load(ocf.env.script_name)
+
+    if agent is None:
+        args = sys.argv[1:]
+        if args[:1] == ['--list']:
+            print("\n".join(names()))
+            sys.exit(0)
+        if args[:1] == ['--link'] and len(args) == 2:
+            for name in link(args[1]):
+                print(name)
+            sys.exit(0)
+        if not args or args[0].startswith('-'):
+            _usage()
+            sys.exit(ocf.OCF_ERR_ARGS)
+
+        # Run as "ocf-agent <agent> <action>": the agent takes the place of
+        # the script, so forget what was worked out from the command line
+        sys.argv = args
+        ocf.env.__dict__.pop('script_name', None)
+        ocf.env.__dict__.pop('action', None)
+        agent = _load(ocf.env.script_name)
+
+    if agent is None:
+        ocf.log.error("{name}: no such agent".format(
+            name=ocf.env.script_name))
+        sys.exit(ocf.OCF_ERR_INSTALLED)
+
+    agent.main()
+
+
+def _load(name):
+    try:
+        return lookup(name)
+    except (ImportError, AttributeError) as e:
+        ocf.log.error("{name}: unable to load agent: {e}".format(
+            name=name, e=e))
+        sys.exit(ocf.OCF_ERR_INSTALLED)
+
+
+if __name__ == '__main__':
+    main()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
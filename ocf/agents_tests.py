@@ -0,0 +1,131 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf
+import ocf.agents
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+AGENT = '''
+import ocf
+
+
+class LazyAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Registered by name only.
+    """
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def monitor(self):
+        return ocf.OCF_SUCCESS
+'''
+
+DISPATCHER = '''
+import ocf.agents
+
+ocf.agents.register('lazyagent:LazyAgent', name='lazy')
+ocf.agents.register('nosuchmodule:Agent', name='broken')
+ocf.agents.main()
+'''
+
+
+class RegisterTests(unittest.TestCase):
+    def test_decorator(self):
+        @ocf.register
+        class Agent(ocf.ResourceAgent):
+            NAME = 'decorated'
+        self.addCleanup(ocf.agents._registry.pop, 'decorated')
+
+        @ocf.register(name='other')
+        class OtherAgent(ocf.ResourceAgent):
+            pass
+        self.addCleanup(ocf.agents._registry.pop, 'other')
+
+        assert ocf.agents.lookup('decorated') is Agent
+        assert ocf.agents.lookup('other') is OtherAgent
+        assert ocf.agents.lookup('nonexistent') is None
+
+    def test_name_needed(self):
+        with self.assertRaises(ValueError):
+            ocf.register('module:Agent')
+
+
+class DispatchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tmpdir, 'ocf-agent')
+        with open(os.path.join(self.tmpdir, 'lazyagent.py'), 'w') as f:
+            f.write(AGENT)
+        with open(self.script, 'w') as f:
+            f.write(DISPATCHER)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_script(self, script, *args):
+        proc = subprocess.Popen(
+            [sys.executable, script] + list(args), stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, stdin=subprocess.PIPE, env=dict(
+                os.environ, HA_LOGFACILITY='none', PYTHONPATH=os.pathsep.join(
+                    [self.tmpdir, os.path.dirname(os.path.dirname(
+                        os.path.abspath(__file__)))])))
+        out, _ = proc.communicate()
+        return proc.returncode, out.decode('utf-8')
+
+    def test_symlink(self):
+        link = os.path.join(self.tmpdir, 'lazy')
+        os.symlink(self.script, link)
+        code, out = self.run_script(link, 'meta-data')
+        assert code == ocf.OCF_SUCCESS
+        assert '<resource-agent name="lazy"' in out
+
+    def test_arguments(self):
+        code, out = self.run_script(self.script, 'lazy', 'monitor')
+        assert code == ocf.OCF_SUCCESS
+
+        code, out = self.run_script(self.script, 'missing', 'monitor')
+        assert code == ocf.OCF_ERR_INSTALLED
+
+    def test_broken(self):
+        code, out = self.run_script(self.script, 'broken', 'monitor')
+        assert code == ocf.OCF_ERR_INSTALLED
+
+        link = os.path.join(self.tmpdir, 'broken')
+        os.symlink(self.script, link)
+        code, out = self.run_script(link, 'monitor')
+        assert code == ocf.OCF_ERR_INSTALLED
+
+    def test_link(self):
+        directory = os.path.join(self.tmpdir, 'provider')
+        os.mkdir(directory)
+        code, out = self.run_script(self.script, '--link', directory)
+        assert code == 0
+        assert sorted(os.listdir(directory)) == ['broken', 'lazy']
+        assert os.readlink(os.path.join(directory, 'lazy')) == self.script
@@ -17,9 +17,10 @@
 
 import ocf
 import os
+import random
 import sys
 
-from ocf.util import cached_property
+from ocf.util import cached_property, monotonic
 
 
 class Environment(object):
@@ -43,6 +44,10 @@ class Environment(object):
     """
 
     def __init__(self):
+        #: Time at which the action started, according to
+        #: :func:`ocf.util.monotonic`.
+        self.started = monotonic()
+
         # Try to use a neutral locale (ocf-shellfuncs do this)
         os.environ['LC_ALL'] = 'C'
         try:
@@ -200,6 +205,80 @@ class Environment(object):
         return self.action == 'monitor' and \
             int(self.reskey.get('CRM_meta_interval', 0)) == 0
 
+    @cached_property
+    def timeout(self):
+        """
+        The timeout of the current action, in seconds.
+
+        Obtained from the ``CRM_meta_timeout`` parameter, which the CRM passes
+        in milliseconds. Returns ``None`` if no timeout was given, for example
+        when the agent is run by hand.
+        """
+        try:
+            timeout = int(self.reskey['CRM_meta_timeout'])
+        except (KeyError, ValueError):
+            return None
+
+        return timeout / 1000.0 if timeout > 0 else None
+
+    @cached_property
+    def deadline(self):
+        """
+        The time by which the current action must be complete.
+
+        Expressed in terms of :func:`ocf.util.monotonic`, this is
+        :attr:`timeout` seconds after the action started. Returns ``None`` if
+        there is no timeout.
+        """
+        if self.timeout is None:
+            return None
+        return self.started + self.timeout
+
+    @property
+    def time_left(self):
+        """
+        Number of seconds left until :attr:`deadline`, or ``None``.
+
+        This may be negative if the deadline has already passed.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - monotonic()
+
+    @cached_property
+    def watchdog(self):
+        """
+        When to dump the agent's stacks if an action is running slowly, as a
+        fraction of :attr:`timeout`.
+
+        Extracted from the ``HA_WATCHDOG`` environment variable, which should
+        be a number between 0 and 1 such as ``0.8``. Returns ``None``, meaning
+        that there is no watchdog, if the variable is not set or not valid.
+        See :mod:`ocf.watchdog`.
+        """
+        try:
+            value = float(os.environ.get('HA_WATCHDOG', ''))
+        except ValueError:
+            return None
+
+        return value if 0 < value < 1 else None
+
+    @cached_property
+    def watchdog_interval(self):
+        """
+        Seconds between further stack dumps once the watchdog has fired.
+
+        Extracted from the ``HA_WATCHDOG_INTERVAL`` environment variable.
+        Returns ``None``, meaning that the stacks are only dumped once, if the
+        variable is not set or not a positive number.
+        """
+        try:
+            value = float(os.environ.get('HA_WATCHDOG_INTERVAL', ''))
+        except ValueError:
+            return None
+
+        return value if value > 0 else None
+
     @cached_property
     def is_clone(self):
         """
@@ -228,18 +307,64 @@ class Environment(object):
         """
         return os.environ.get('HA_RSCTMP', '/var/run/resource-agents')
 
+    @property
+    def state_dir(self):
+        """
+        Path to the directory in which *python-ocf* keeps its own state.
+
+        This is a ``python-ocf`` sub-directory of :attr:`rsctmp`, and is
+        therefore also emptied on system startup. It is used to carry small
+        amounts of information (see :class:`ocf.state.State`) from one
+        invocation of a resource agent to the next.
+        """
+        return os.path.join(self.rsctmp, 'python-ocf')
+
     @cached_property
     def debug(self):
         """
         Whether to output log messages at debug log level.
 
         This value defaults to True but this can be overridden by setting
-        HA_debug=0 in the environment
+        HA_debug=0 in the environment. If :attr:`debug_sample` is a number
+        ``N``, ``monitor`` actions only enable debug output at random on one in
+        every ``N`` runs.
         """
         if os.environ.get('HA_debug') == '0':
             return False
-        else:
-            return True
+
+        sample = self.debug_sample
+        if isinstance(sample, int) and self.action == 'monitor':
+            return random.randrange(sample) == 0
+
+        return True
+
+    @cached_property
+    def debug_sample(self):
+        """
+        How to sample debug output of ``monitor`` actions.
+
+        Extracted from the ``HA_DEBUG_SAMPLE`` environment variable, which may
+        take one of the following values:
+
+        - A number ``N`` greater than one, which is returned as an integer:
+          debug output is only enabled for one in every ``N`` ``monitor``
+          actions (see :attr:`debug`).
+        - ``failure``: debug messages of ``monitor`` actions are held back and
+          only logged if the action does not return :data:`ocf.OCF_SUCCESS`.
+
+        Any other value, or no value at all, results in ``None``, meaning that
+        debug output is not sampled.
+        """
+        value = os.environ.get('HA_DEBUG_SAMPLE')
+        if value == 'failure':
+            return value
+
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+
+        return value if value > 1 else None
 
     @cached_property
     def logtag(self):
@@ -273,6 +398,20 @@ class Environment(object):
         else:
             return value
 
+    @property
+    def log_dedup_interval(self):
+        """
+        Interval in seconds over which repeated log messages are suppressed.
+
+        Extracted from the ``HA_LOGDEDUP`` environment variable. A value of
+        ``0`` (the default) or an invalid value disables log message
+        de-duplication. See :class:`ocf.logging.DedupFilter`.
+        """
+        try:
+            return max(0, int(os.environ.get('HA_LOGDEDUP', 0)))
+        except ValueError:
+            return 0
+
     @property
     def use_logd(self):
         """
@@ -292,6 +431,26 @@ class Environment(object):
         """
         return os.environ.get('HA_LOGFILE')
 
+    @property
+    def log_batch(self):
+        """
+        Whether to batch up lines written to log files until exit.
+
+        Returns True if ``HA_LOGBATCH=yes`` is set in the environment, else
+        returns False. See :class:`ocf.logging.AppendFileHandler`.
+        """
+        return os.environ.get('HA_LOGBATCH') == 'yes'
+
+    @property
+    def fast_exit(self):
+        """
+        Whether to exit without the interpreter's usual clean-up.
+
+        Returns True if ``HA_FASTEXIT=yes`` is set in the environment, else
+        returns False. See :mod:`ocf.lifecycle`.
+        """
+        return os.environ.get('HA_FASTEXIT') == 'yes'
+
     @property
     def debuglog(self):
         """
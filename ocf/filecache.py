@@ -0,0 +1,217 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Cache of parsed configuration files, kept until the file changes.
+
+Agents often parse a large configuration file on every ``monitor`` just to
+find a port number or a data directory. :func:`load` keeps the parsed result
+in :attr:`ocf.environment.Environment.state_dir`, tagged with the file's
+device, inode, size and modification time (in nanoseconds). Later invocations
+which find the file unchanged use the stored result, without reading or
+parsing the file at all.
+
+Results are stored using :mod:`marshal`, so they must be made up only of the
+core Python types (``None``, numbers, strings, bytes, tuples, lists, sets and
+dictionaries); anything else is simply not cached. The cache files are read
+through :mod:`mmap`, and the tag is checked before anything is unmarshalled.
+
+Usage::
+
+    def parse(path):
+        with open(path) as f:
+            return dict(line.split('=', 1) for line in f if '=' in line)
+
+    @ocf.Action()
+    def monitor(self):
+        config = ocf.filecache.load('/etc/food/food.conf', parse)
+        ...
+
+The cache is limited to :data:`MAX_SIZE` bytes; when it grows beyond that,
+the entries written longest ago are removed.
+"""
+
+from __future__ import absolute_import
+
+import hashlib
+import marshal
+import mmap
+import ocf
+import os
+import struct
+import time
+
+from ocf.util import atomic_write
+
+import six
+
+#: Maximum total size in bytes of the cache files.
+MAX_SIZE = 8 * 1024 * 1024
+
+# Files modified less than this many seconds ago are not cached: they could
+# change again without their size or modification time changing
+_RACY = 1.0
+
+# Device, inode, size and modification time of the source file
+_HEADER = struct.Struct('<QQQq')
+
+# Results already obtained by this process
+_memo = {}
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    _memo.clear()
+
+
+def _cache_dir():
+    return os.path.join(ocf.env.state_dir, 'filecache')
+
+
+def _tag(st):
+    mtime_ns = getattr(st, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(st.st_mtime * 1000000000)
+    return (st.st_dev, st.st_ino, st.st_size, mtime_ns)
+
+
+def _read(path, tag):
+    """
+    Returns ``(True, value)`` from the cache file ``path`` if it was stored
+    for the source file with ``tag``, or ``(False, None)``.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False, None
+
+    try:
+        size = os.fstat(fd).st_size
+        if size < _HEADER.size:
+            return False, None
+
+        mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        try:
+            if _HEADER.unpack_from(mm) != tag:
+                return False, None
+            if six.PY2:
+                return True, marshal.loads(mm[_HEADER.size:])
+            # Unmarshal straight from the mapping, without a copy
+            view = memoryview(mm)[_HEADER.size:]
+            try:
+                return True, marshal.loads(view)
+            finally:
+                view.release()
+        finally:
+            mm.close()
+    except (EnvironmentError, EOFError, ValueError, TypeError, struct.error):
+        return False, None
+    finally:
+        os.close(fd)
+
+
+def _evict(directory, keep):
+    """
+    Removes the oldest cache files until those left fit in :data:`MAX_SIZE`,
+    except ``keep``.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(directory):
+        if not name.endswith('.fc'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+        total += st.st_size
+
+    for _, size, path in sorted(entries):
+        if total <= MAX_SIZE:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def load(path, parser, key=None):
+    """
+    Returns ``parser(path)``, from the cache if ``path`` has not changed since
+    it was last parsed.
+
+    :param str path: Path to the file to parse.
+    :param parser: Function taking the path and returning the parsed result.
+    :param str key: Name for the parser, so that different parsers of the same
+      file are cached separately. Optional; defaults to the parser's module
+      and name. Change it if the parser changes what it returns.
+    :raises: whatever :func:`os.stat` raises if ``path`` does not exist, and
+      whatever ``parser`` raises.
+    """
+    if key is None:
+        key = "{0}.{1}".format(parser.__module__, parser.__name__)
+
+    tag = _tag(os.stat(path))
+    memo_key = (os.path.abspath(path), key)
+
+    # Fast path: parsed or read once already by this process
+    entry = _memo.get(memo_key)
+    if entry is not None and entry[0] == tag:
+        return entry[1]
+
+    directory = _cache_dir()
+    name = hashlib.sha1("{0}\0{1}".format(*memo_key).encode('utf-8'))
+    cache = os.path.join(directory, name.hexdigest() + '.fc')
+
+    found, value = _read(cache, tag)
+    if found:
+        _memo[memo_key] = (tag, value)
+        return value
+
+    value = parser(path)
+    _memo[memo_key] = (tag, value)
+
+    # Only cache what is known to have come from this version of the file
+    st = os.stat(path)
+    if _tag(st) != tag or time.time() - st.st_mtime < _RACY:
+        return value
+
+    try:
+        data = _HEADER.pack(*tag) + marshal.dumps(value)
+    except ValueError:
+        ocf.log.debug("Not caching {path}: unmarshallable result".format(
+            path=path))
+        return value
+
+    if len(data) > MAX_SIZE:
+        return value
+
+    try:
+        atomic_write(cache, data)
+        _evict(directory, cache)
+    except (IOError, OSError) as e:
+        ocf.log.debug("Unable to write file cache {p}: {e}".format(
+            p=cache, e=e))
+
+    return value
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
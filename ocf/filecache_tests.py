@@ -0,0 +1,77 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.filecache
+import ocf.testing
+import os
+import time
+
+
+class FileCacheTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(FileCacheTests, self).setUp()
+        self.path = os.path.join(self.tmpdir, 'food.conf')
+        self.write('port=80\n')
+        self.calls = 0
+
+    def write(self, data, age=10):
+        with open(self.path, 'w') as f:
+            f.write(data)
+        # Old enough to be cached
+        then = time.time() - age
+        os.utime(self.path, (then, then))
+
+    def parse(self, path):
+        self.calls += 1
+        with open(path) as f:
+            return dict(line.strip().split('=', 1) for line in f)
+
+    def load(self):
+        # Forget the in-process copy, as if we were another process
+        ocf.filecache._reset()
+        return ocf.filecache.load(self.path, self.parse)
+
+    def test_unchanged(self):
+        assert self.load() == {'port': '80'}
+        assert self.load() == {'port': '80'}
+        assert self.calls == 1
+
+    def test_changed(self):
+        self.load()
+        self.write('port=8080\n', age=5)
+        assert self.load() == {'port': '8080'}
+        assert self.calls == 2
+
+    def test_recently_modified(self):
+        self.write('port=80\n', age=0)
+        self.load()
+        self.load()
+        assert self.calls == 2
+
+    def test_eviction(self):
+        self.addCleanup(setattr, ocf.filecache, 'MAX_SIZE',
+                        ocf.filecache.MAX_SIZE)
+        ocf.filecache.MAX_SIZE = 100
+
+        self.load()
+        ocf.filecache._reset()
+        ocf.filecache.load(self.path, lambda path: 'x' * 60, key='other')
+
+        directory = os.path.join(self.tmpdir, 'python-ocf', 'filecache')
+        assert len(os.listdir(directory)) == 1
+        self.load()
+        assert self.calls == 2
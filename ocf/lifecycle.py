@@ -0,0 +1,112 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Teardown hooks run at the end of every action, and fast exit.
+
+When an action has finished, :meth:`ocf.ra.ResourceAgent.dispatch` calls
+:func:`teardown`, which runs every registered hook with the action's exit code.
+This is where anything buffered during the action is written out: the log
+handlers are flushed, and :class:`ocf.state.State` objects saved with
+``defer=True`` are written. Agents can register their own hooks with
+:func:`on_teardown`::
+
+    @ocf.lifecycle.on_teardown
+    def close_connection(ret):
+        ...
+
+Hooks run in the reverse order of their registration, like :mod:`atexit`
+handlers. An exception raised by a hook is logged, and the remaining hooks
+still run.
+
+Since the hooks take care of everything that has to be written out,
+:meth:`ocf.ra.ResourceAgent.execute` can skip the interpreter's own clean-up
+when the agent exits, which otherwise takes a good part of the run time of a
+short action. This is enabled by setting ``FAST_EXIT = True`` in the agent
+class, or ``HA_FASTEXIT=yes`` in the environment
+(:attr:`ocf.environment.Environment.fast_exit`). The garbage collector is then
+disabled for the duration of the action, and the process ends with
+:func:`os._exit` straight after the hooks have run.
+
+.. warning::
+
+   With fast exit, :mod:`atexit` handlers are not run, non-daemon threads are
+   not waited for, and files are not flushed unless a hook does it. Agents
+   using fast exit should register teardown hooks instead.
+"""
+
+from __future__ import absolute_import
+
+import ocf
+import os
+import sys
+
+_hooks = []
+
+
+def on_teardown(func):
+    """
+    Registers ``func`` to be called with the exit code at the end of every
+    action. Returns ``func``, so that this can be used as a decorator.
+    """
+    _hooks.append(func)
+    return func
+
+
+def remove_teardown(func):
+    """
+    Unregisters a hook registered with :func:`on_teardown`, if it is
+    registered.
+    """
+    try:
+        _hooks.remove(func)
+    except ValueError:
+        pass
+
+
+def teardown(ret):
+    """
+    Runs all the teardown hooks with the exit code ``ret``.
+    """
+    for func in reversed(_hooks[:]):
+        try:
+            func(ret)
+        except Exception:
+            ocf.log.exception("Teardown hook {func} failed".format(
+                func=getattr(func, '__name__', func)))
+
+
+def exit(ret, fast=False):
+    """
+    Exits with the exit code ``ret``.
+
+    The teardown hooks must already have been run. If ``fast`` is true, the
+    standard streams are flushed and the process ends immediately with
+    :func:`os._exit`; otherwise :func:`sys.exit` is called as usual.
+    """
+    if not fast:
+        sys.exit(ret)
+
+    for stream in (sys.stdout, sys.stderr):
+        try:
+            stream.flush()
+        except (IOError, OSError, ValueError):
+            pass
+
+    os._exit(ret)
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,119 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import ocf
+import ocf.lifecycle
+import ocf.state
+import ocf.testing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+class CountingAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Counts its monitors in a deferred state.
+    """
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def monitor(self):
+        state = ocf.state.State('count')
+        state['runs'] = state.get('runs', 0) + 1
+        state.save(defer=True)
+
+        # Nothing is written until the action has finished
+        on_disk = ocf.state.State('count')
+        assert on_disk.get('runs', 0) == state['runs'] - 1
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def status(self):
+        state = ocf.state.State('count')
+        state['runs'] = state.get('runs', 0) + 1
+        state.save(defer=True)
+        raise RuntimeError('status is broken')
+
+
+class TeardownTests(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+
+    def hook(self, name, fail=False):
+        def func(ret):
+            self.calls.append((name, ret))
+            if fail:
+                raise RuntimeError(name)
+        ocf.lifecycle.on_teardown(func)
+        self.addCleanup(ocf.lifecycle.remove_teardown, func)
+
+    def test_hooks_run_in_reverse_order(self):
+        self.hook('first')
+        self.hook('second', fail=True)
+        ocf.lifecycle.teardown(7)
+        assert self.calls == [('second', 7), ('first', 7)]
+
+    def test_deferred_state_is_saved(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+
+        agent = ocf.testing.AgentRunner(CountingAgent, rsctmp=tmpdir)
+        agent.run('monitor')
+        agent.run('monitor')
+
+        path = os.path.join(tmpdir, 'python-ocf', 'CountingAgent-test.count')
+        with open(path) as f:
+            assert json.load(f) == {'runs': 2}
+
+    def test_action_raises(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.hook('hook')
+
+        agent = ocf.testing.AgentRunner(CountingAgent, rsctmp=tmpdir)
+        result = agent.run('status')
+        assert result.code == ocf.OCF_ERR_GENERIC
+        assert str(result.records[0].exc_info[1]) == 'status is broken'
+        assert self.calls == [('hook', ocf.OCF_ERR_GENERIC)]
+
+        path = os.path.join(tmpdir, 'python-ocf', 'CountingAgent-test.count')
+        with open(path) as f:
+            assert json.load(f) == {'runs': 1}
+
+    def test_fast_exit(self):
+        script = ("import sys; from ocf.lifecycle import exit; "
+                  "sys.stdout.write('out'); exit(3, fast=True); exit(4)")
+        proc = subprocess.Popen(
+            [sys.executable, '-c', script], stdout=subprocess.PIPE,
+            stdin=subprocess.PIPE, env=dict(
+                os.environ, HA_LOGFACILITY='none', PYTHONPATH=os.path.dirname(
+                    os.path.dirname(os.path.abspath(__file__)))))
+        out, _ = proc.communicate()
+        assert proc.returncode == 3
+        assert out == b'out'
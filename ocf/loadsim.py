@@ -0,0 +1,504 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Load simulator, for measuring what a resource agent costs a node.
+
+This runs a resource agent script the way the Pacemaker executor (``lrmd``)
+would: a number of resource instances, each with a recurring ``monitor``
+operation, every invocation a separate process with the ``OCF_RESKEY_*`` and
+``CRM_meta_*`` environment the cluster would give it. As with ``lrmd``, the
+next run of a recurring operation is scheduled ``interval`` seconds after the
+previous one finished, and an operation still running at its timeout is
+killed with ``SIGKILL``.
+
+Each process is reaped with :func:`os.wait4`, so the report shows the CPU time
+and peak memory use of every run as well as its latency::
+
+    python -m ocf.loadsim --instances 50 --interval 10 --duration 300 \\
+        -p 'state={rsctmp}/{instance}.state' --lifecycle \\
+        -e HA_LOGFACILITY=none /usr/lib/ocf/resource.d/heartbeat/pydummy
+
+Parameter values may refer to ``{instance}`` (the resource instance name),
+``{index}`` (its number, from 0) and ``{rsctmp}``. Unless ``--rsctmp`` is
+given, each simulation gets a fresh temporary ``HA_RSCTMP``, which is removed
+afterwards.
+
+The same simulation can be run from Python with :class:`Simulator`.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import argparse
+import collections
+import errno
+import fcntl
+import heapq
+import json
+import os
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+
+from ocf.util import monotonic
+
+#: The outcome of a single operation run by :class:`Simulator`.
+#:
+#: ``code`` is the exit code, or the negated signal number if the agent was
+#: killed. ``latency`` is the time from starting the agent until it exited and
+#: ``delay`` the time it was held back by ``jobs`` after it was due, both in
+#: seconds. ``cpu`` is the user plus system CPU time in seconds and ``maxrss``
+#: the peak resident set size in kilobytes, both from :func:`os.wait4`.
+Sample = collections.namedtuple('Sample', (
+    'action', 'instance', 'code', 'latency', 'delay', 'cpu', 'maxrss',
+    'timed_out'))
+
+# Prefixes of environment variables which belong to the agent's invocation and
+# so are never inherited from our own environment
+_PRIVATE_PREFIXES = ('OCF_RESKEY_', 'OCF_RESOURCE_', 'OCF_CHECK_LEVEL')
+
+
+def percentile(values, pct):
+    """
+    Returns the ``pct`` percentile of ``values`` by the nearest-rank method,
+    or ``None`` if there are no values.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, int(-(-pct * len(values) // 100)))
+    return values[rank - 1]
+
+
+class Simulator(object):
+    """
+    Runs a resource agent on an ``lrmd``-like schedule and collects a
+    :data:`Sample` for every operation.
+
+    :param str agent: Path to the resource agent script.
+    :param int instances: Number of resource instances to simulate.
+    :param float interval: Interval of the recurring operation, in seconds.
+    :param float timeout: Timeout of every operation, in seconds.
+    :param float duration: How long to run recurring operations for, in
+      seconds. Operations still running at the end are waited for.
+    :param dict params: Resource parameters, as templates (see above).
+    :param str action: The recurring action.
+    :param bool lifecycle: Run ``start`` on each instance first, and ``stop``
+      on each instance at the end.
+    :param int jobs: Maximum number of agents to run at once, like the
+      ``node-action-limit`` cluster option. 0 means no limit.
+    :param dict env: Extra environment variables for the agent, such as
+      ``HA_LOGFACILITY``.
+    :param str rsctmp: ``HA_RSCTMP`` directory. A temporary directory is used
+      by default.
+    :param str provider: Value of ``OCF_RESOURCE_PROVIDER``.
+
+    The first run of each instance is staggered across the first ``interval``
+    so that the instances do not all run in lock-step.
+    """
+    def __init__(self, agent, instances=1, interval=10, timeout=20,
+                 duration=60, params=None, action='monitor', lifecycle=False,
+                 jobs=0, env=None, rsctmp=None, provider='heartbeat'):
+        self.agent = os.path.abspath(agent)
+        self.instances = instances
+        self.interval = interval
+        self.timeout = timeout
+        self.duration = duration
+        self.params = dict(params or {})
+        self.action = action
+        self.lifecycle = lifecycle
+        self.jobs = jobs
+        self.env = dict(env or {})
+        self.rsctmp = rsctmp
+        self.provider = provider
+        self.resource_type = os.path.basename(self.agent)
+        self.elapsed = None
+
+    def instance_name(self, index):
+        """
+        Returns the resource instance name of instance number ``index``.
+        """
+        return "{type}-{index}".format(type=self.resource_type, index=index)
+
+    def environ(self, index, action, interval, rsctmp):
+        """
+        Returns the environment for running ``action`` on instance number
+        ``index``.
+        """
+        environ = dict((k, v) for k, v in os.environ.items()
+                       if not k.startswith(_PRIVATE_PREFIXES))
+        environ.setdefault('OCF_ROOT', '/usr/lib/ocf')
+        environ.update(self.env)
+
+        instance = self.instance_name(index)
+        environ.update({
+            'HA_RSCTMP': rsctmp,
+            'OCF_RA_VERSION_MAJOR': '1',
+            'OCF_RA_VERSION_MINOR': '0',
+            'OCF_RESOURCE_INSTANCE': instance,
+            'OCF_RESOURCE_TYPE': self.resource_type,
+            'OCF_RESOURCE_PROVIDER': self.provider,
+            'OCF_EXIT_REASON_PREFIX': 'ocf-exit-reason:',
+            'OCF_RESKEY_CRM_meta_name': action,
+            'OCF_RESKEY_CRM_meta_interval': str(int(interval * 1000)),
+            'OCF_RESKEY_CRM_meta_timeout': str(int(self.timeout * 1000)),
+            'OCF_RESKEY_CRM_meta_on_node': socket.gethostname(),
+        })
+
+        for name, value in self.params.items():
+            environ['OCF_RESKEY_' + name] = value.format(
+                instance=instance, index=index, rsctmp=rsctmp)
+
+        return environ
+
+    def spawn(self, index, action, interval, rsctmp):
+        """
+        Starts the agent for one operation and returns its PID.
+        """
+        environ = self.environ(index, action, interval, rsctmp)
+
+        pid = os.fork()
+        if pid == 0:
+            try:
+                devnull = os.open(os.devnull, os.O_RDWR)
+                for fd in (0, 1, 2):
+                    os.dup2(devnull, fd)
+                os.execve(self.agent, [self.agent, action], environ)
+            finally:
+                os._exit(127)
+
+        return pid
+
+    def run(self):
+        """
+        Runs the simulation and returns the list of :data:`Sample` instances,
+        in the order in which the operations finished.
+
+        The wall-clock duration of the simulation is stored in
+        :attr:`elapsed`.
+        """
+        rsctmp = self.rsctmp
+        if rsctmp is None:
+            rsctmp = tempfile.mkdtemp(prefix='ocf-loadsim-')
+
+        # Wake up as soon as a child exits, rather than polling for it
+        wakeup_r, wakeup_w = os.pipe()
+        for fd in (wakeup_r, wakeup_w):
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        old_handler = signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        old_wakeup = signal.set_wakeup_fd(wakeup_w)
+
+        try:
+            return self._run(rsctmp, wakeup_r)
+        finally:
+            signal.set_wakeup_fd(old_wakeup)
+            signal.signal(signal.SIGCHLD, old_handler)
+            os.close(wakeup_r)
+            os.close(wakeup_w)
+            if self.rsctmp is None:
+                shutil.rmtree(rsctmp, ignore_errors=True)
+
+    def _run(self, rsctmp, wakeup):
+        started = monotonic()
+        end = started + self.duration
+        first = 'start' if self.lifecycle else self.action
+
+        # Operations waiting to run: (due, sequence, index, action)
+        queue = []
+        seq = 0
+        for index in range(self.instances):
+            due = started + self.interval * index / self.instances
+            queue.append((due, seq, index, first))
+            seq += 1
+        heapq.heapify(queue)
+
+        running = {}  # pid -> [index, action, due, spawned, deadline, killed]
+        busy = set()  # instances with an operation running
+        finished = set()  # instances which need no more operations
+        samples = []
+
+        while queue or running:
+            now = monotonic()
+
+            # Once the duration is up, only the lifecycle's stops remain
+            if now >= end:
+                queue = [op for op in queue if op[3] == 'stop']
+                heapq.heapify(queue)
+                if self.lifecycle:
+                    for index in range(self.instances):
+                        if index not in busy and index not in finished:
+                            heapq.heappush(queue, (now, seq, index, 'stop'))
+                            seq += 1
+                            finished.add(index)
+
+            while queue and queue[0][0] <= now and \
+                    not (self.jobs and len(running) >= self.jobs):
+                due, _, index, action = heapq.heappop(queue)
+                interval = self.interval if action == self.action else 0
+                pid = self.spawn(index, action, interval, rsctmp)
+                spawned = monotonic()
+                running[pid] = [index, action, due, spawned,
+                                spawned + self.timeout, False]
+                busy.add(index)
+
+            # Kill anything which has run out of time
+            for pid, op in running.items():
+                if not op[5] and now >= op[4]:
+                    os.kill(pid, signal.SIGKILL)
+                    op[5] = True
+
+            wait = [op[4] for op in running.values() if not op[5]]
+            if queue and not (self.jobs and len(running) >= self.jobs):
+                wait.append(queue[0][0])
+            if now < end:
+                wait.append(end)
+            timeout = max(0, min(wait) - now) if wait else None
+
+            if running:
+                _sleep([wakeup], timeout)
+            elif timeout:
+                _sleep([], timeout)
+            _drain(wakeup)
+
+            for pid, status, rusage in _reap():
+                op = running.pop(pid, None)
+                if op is None:
+                    continue
+                index, action, due, spawned, _, killed = op
+                now = monotonic()
+                busy.discard(index)
+
+                if os.WIFSIGNALED(status):
+                    code = -os.WTERMSIG(status)
+                else:
+                    code = os.WEXITSTATUS(status)
+
+                samples.append(Sample(
+                    action, self.instance_name(index), code, now - spawned,
+                    spawned - due, rusage.ru_utime + rusage.ru_stime,
+                    rusage.ru_maxrss, killed))
+
+                if action == 'stop':
+                    continue
+                if now < end:
+                    # Like lrmd, schedule the next run from the end of this
+                    # one; the first monitor runs straight after start.
+                    due = now if action == 'start' else now + self.interval
+                    heapq.heappush(queue, (due, seq, index, self.action))
+                    seq += 1
+                elif self.lifecycle and index not in finished:
+                    heapq.heappush(queue, (now, seq, index, 'stop'))
+                    seq += 1
+                    finished.add(index)
+
+        self.elapsed = monotonic() - started
+        return samples
+
+
+def _sleep(fds, timeout):
+    # Waits for one of fds to be readable. Being interrupted by SIGCHLD is
+    # just another wake-up: the caller works out how long to wait again. (On
+    # Python 2, select() doesn't retry by itself and raises select.error.)
+    try:
+        select.select(fds, [], [], timeout)
+    except (select.error, OSError) as e:
+        if e.args[0] != errno.EINTR:
+            raise
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+
+
+def _reap():
+    while True:
+        try:
+            pid, status, rusage = os.wait4(-1, os.WNOHANG)
+        except OSError as e:
+            if e.errno == errno.ECHILD:
+                return
+            raise
+        if pid == 0:
+            return
+        yield pid, status, rusage
+
+
+def summarise(samples, elapsed, instances=None):
+    """
+    Summarises the ``samples`` of a simulation that took ``elapsed`` seconds.
+
+    Returns a dictionary with overall figures and a ``actions`` dictionary of
+    per-action figures, suitable for JSON output. Times are in milliseconds.
+    """
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    cpu = sum(s.cpu for s in samples)
+    report = {
+        'elapsed': round(elapsed, 3),
+        'instances': instances,
+        'operations': len(samples),
+        'throughput': round(len(samples) / elapsed, 3) if elapsed else None,
+        'timeouts': sum(1 for s in samples if s.timed_out),
+        'cpu': round(cpu, 3),
+        'cpu_share': round(cpu / elapsed, 5) if elapsed else None,
+        'actions': {},
+    }
+
+    by_action = collections.OrderedDict()
+    for sample in samples:
+        by_action.setdefault(sample.action, []).append(sample)
+
+    for action, group in by_action.items():
+        latencies = [s.latency for s in group]
+        codes = collections.Counter(s.code for s in group)
+        timeouts = sum(1 for s in group if s.timed_out)
+        report['actions'][action] = {
+            'runs': len(group),
+            'codes': dict((str(k), v) for k, v in sorted(codes.items())),
+            'timeouts': timeouts,
+            'timeout_rate': round(timeouts / len(group), 5),
+            'latency_p50': ms(percentile(latencies, 50)),
+            'latency_p90': ms(percentile(latencies, 90)),
+            'latency_p99': ms(percentile(latencies, 99)),
+            'latency_max': ms(max(latencies)),
+            'delay_max': ms(max(s.delay for s in group)),
+            'cpu_mean': ms(sum(s.cpu for s in group) / len(group)),
+            'maxrss_mean': int(sum(s.maxrss for s in group) / len(group)),
+            'maxrss_max': max(s.maxrss for s in group),
+        }
+
+    return report
+
+
+def format_summary(report):
+    """
+    Formats a report from :func:`summarise` as a human-readable table.
+    """
+    lines = [
+        "{operations} operations in {elapsed:.1f}s: {throughput:.1f} op/s, "
+        "{timeouts} timed out".format(**report),
+        "CPU: {cpu:.2f}s in total, {pct:.2f}% of one core".format(
+            cpu=report['cpu'], pct=100 * (report['cpu_share'] or 0)),
+    ]
+    if report['instances'] and report['elapsed']:
+        lines.append("CPU per instance: {ms:.2f} ms/s".format(
+            ms=1000 * report['cpu'] / report['elapsed'] /
+            report['instances']))
+
+    lines.append('')
+    header = ('action', 'runs', 'timeout', 'p50 ms', 'p90 ms', 'p99 ms',
+              'max ms', 'cpu ms', 'rss KB', 'exit codes')
+    rows = [header]
+    for action, a in report['actions'].items():
+        rows.append((
+            action, str(a['runs']), str(a['timeouts']),
+            '{0:.1f}'.format(a['latency_p50']),
+            '{0:.1f}'.format(a['latency_p90']),
+            '{0:.1f}'.format(a['latency_p99']),
+            '{0:.1f}'.format(a['latency_max']),
+            '{0:.1f}'.format(a['cpu_mean']),
+            str(a['maxrss_max']),
+            ' '.join('{0}:{1}'.format(k, v) for k, v in a['codes'].items()),
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+    for row in rows:
+        lines.append('  '.join(
+            cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+
+    return '\n'.join(lines)
+
+
+def _assignment(arg):
+    name, sep, value = arg.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(
+            "expected NAME=VALUE, not {0!r}".format(arg))
+    return name, value
+
+
+def main(argv=None):
+    """
+    Command-line entry point; see the module documentation.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m ocf.loadsim',
+        description='Run a resource agent on an lrmd-like schedule and '
+                    'report its overhead.')
+    parser.add_argument('agent', help='path to the resource agent script')
+    parser.add_argument('-n', '--instances', type=int, default=1,
+                        help='number of resource instances (default: 1)')
+    parser.add_argument('-i', '--interval', type=float, default=10,
+                        help='monitor interval in seconds (default: 10)')
+    parser.add_argument('-t', '--timeout', type=float, default=20,
+                        help='operation timeout in seconds (default: 20)')
+    parser.add_argument('-d', '--duration', type=float, default=60,
+                        help='seconds to simulate (default: 60)')
+    parser.add_argument('-a', '--action', default='monitor',
+                        help='recurring action (default: monitor)')
+    parser.add_argument('-p', '--param', type=_assignment, action='append',
+                        default=[], metavar='NAME=VALUE',
+                        help='resource parameter; may be repeated')
+    parser.add_argument('-e', '--env', type=_assignment, action='append',
+                        default=[], metavar='NAME=VALUE',
+                        help='extra environment variable; may be repeated')
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help='maximum concurrent operations (default: no '
+                             'limit)')
+    parser.add_argument('--lifecycle', action='store_true',
+                        help='start each instance first and stop it at '
+                             'the end')
+    parser.add_argument('--rsctmp', help='HA_RSCTMP directory (default: a '
+                                         'temporary directory)')
+    parser.add_argument('--provider', default='heartbeat',
+                        help='OCF_RESOURCE_PROVIDER (default: heartbeat)')
+    parser.add_argument('--json', action='store_true',
+                        help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    simulator = Simulator(
+        args.agent, instances=args.instances, interval=args.interval,
+        timeout=args.timeout, duration=args.duration,
+        params=dict(args.param), action=args.action,
+        lifecycle=args.lifecycle, jobs=args.jobs, env=dict(args.env),
+        rsctmp=args.rsctmp, provider=args.provider)
+    samples = simulator.run()
+    report = summarise(samples, simulator.elapsed, args.instances)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print()
+    else:
+        print(format_summary(report))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
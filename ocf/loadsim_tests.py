@@ -0,0 +1,106 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import errno
+import ocf.loadsim
+import os
+import select
+import shutil
+import tempfile
+import unittest
+
+
+class LoadSimTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def agent(self, body):
+        path = os.path.join(self.tmpdir, 'agent')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n' + body + '\n')
+        os.chmod(path, 0o755)
+        return path
+
+    def test_interrupted_sleep(self):
+        def interrupted(*args):
+            raise select.error(errno.EINTR, 'Interrupted system call')
+
+        def failed(*args):
+            raise select.error(errno.EBADF, 'Bad file descriptor')
+
+        self.addCleanup(setattr, select, 'select', select.select)
+        select.select = interrupted
+        ocf.loadsim._sleep([], 1)
+
+        select.select = failed
+        with self.assertRaises(select.error):
+            ocf.loadsim._sleep([], 1)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert ocf.loadsim.percentile(values, 50) == 50
+        assert ocf.loadsim.percentile(values, 99) == 99
+        assert ocf.loadsim.percentile(values, 100) == 100
+        assert ocf.loadsim.percentile([3], 90) == 3
+        assert ocf.loadsim.percentile([], 50) is None
+
+    def test_lifecycle(self):
+        log = os.path.join(self.tmpdir, 'log')
+        agent = self.agent(
+            'echo "$1 $OCF_RESOURCE_INSTANCE $OCF_RESKEY_CRM_meta_interval '
+            '$OCF_RESKEY_state" >> ' + log)
+        sim = ocf.loadsim.Simulator(
+            agent, instances=2, interval=0.1, duration=0.5, lifecycle=True,
+            params={'state': '{rsctmp}/{instance}'})
+        samples = sim.run()
+
+        actions = [s.action for s in samples]
+        assert actions.count('start') == 2
+        assert actions.count('stop') == 2
+        assert actions.count('monitor') >= 4
+        assert all(s.code == 0 and not s.timed_out for s in samples)
+
+        with open(log) as f:
+            lines = [line.split() for line in f]
+        assert ['start', 'agent-0', '0'] == lines[0][:3]
+        monitor = [line for line in lines if line[0] == 'monitor'][0]
+        assert monitor[2] == '100'
+        assert monitor[3].endswith('/' + monitor[1])
+
+    def test_timeout(self):
+        agent = self.agent('exec sleep 10')
+        sim = ocf.loadsim.Simulator(
+            agent, instances=1, interval=1, timeout=0.2, duration=0.1)
+        sample, = sim.run()
+        assert sample.timed_out
+        assert sample.code == -9
+        assert sample.latency < 5
+
+    def test_summarise(self):
+        agent = self.agent('exit 7')
+        sim = ocf.loadsim.Simulator(
+            agent, instances=3, interval=0.1, duration=0.3)
+        samples = sim.run()
+        report = ocf.loadsim.summarise(samples, sim.elapsed, 3)
+        monitor = report['actions']['monitor']
+        assert monitor['runs'] == len(samples)
+        assert monitor['codes'] == {'7': len(samples)}
+        assert monitor['timeouts'] == 0
+        assert 'monitor' in ocf.loadsim.format_summary(report)
@@ -17,11 +17,18 @@
 
 from __future__ import absolute_import
 
+import hashlib
 import logging
 import ocf
+import ocf.lifecycle
+import ocf.state
 import ocf.syslog
+import os
 import subprocess
 import sys
+import time
+
+from ocf.util import cached_property
 
 
 class HaLogdHandler(logging.Handler):
@@ -49,6 +56,380 @@ class HaLogdHandler(logging.Handler):
         subprocess.check_call(command)
 
 
+class AppendFileHandler(logging.Handler):
+    """
+    Python logger class appending to a log file shared with other processes.
+
+    Many resource agents write to the same ``HA_LOGFILE`` and ``HA_DEBUGLOG``
+    at the same time. :class:`logging.FileHandler` writes through a buffered
+    text stream, which may split a line across several system calls and so
+    interleave it with lines from other processes. This handler instead opens
+    the file with ``O_APPEND`` and writes each complete line, including the
+    log tag prefix, with a single :func:`os.write`.
+
+    :param str filename: Path to the log file.
+    :param str prefix: Text prepended to every line. Rendered to bytes only
+      once, as it never changes during the life of the process.
+    :param bool batch: If true, lines are held in memory and written together
+      in a single :func:`os.writev` when the handler is flushed or closed
+      (normally at exit), or when ``capacity`` lines have accumulated. This
+      saves system calls at the expense of losing the buffered lines if the
+      process is killed.
+    :param int capacity: Maximum number of lines to hold in batch mode.
+    """
+    def __init__(self, filename, prefix='', batch=False, capacity=256):
+        super(AppendFileHandler, self).__init__()
+        self.filename = filename
+        self.prefix = prefix.encode('utf-8')
+        self.batch = batch
+        self.capacity = capacity
+        self.buffer = []
+        self.fd = os.open(
+            filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def emit(self, record):
+        """
+        Emit a log message given a log record.
+        """
+        try:
+            line = self.prefix + self.format(record).encode('utf-8') + b'\n'
+
+            if self.batch:
+                self.buffer.append(line)
+                if len(self.buffer) >= self.capacity:
+                    self.flush()
+            else:
+                os.write(self.fd, line)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """
+        Write out any lines held in batch mode.
+        """
+        self.acquire()
+        try:
+            buffer, self.buffer = self.buffer, []
+            if not buffer or self.fd is None:
+                return
+
+            if hasattr(os, 'writev'):
+                os.writev(self.fd, buffer)
+            else:
+                os.write(self.fd, b''.join(buffer))
+        finally:
+            self.release()
+
+    def close(self):
+        """
+        Flush any batched lines and close the file.
+        """
+        self.acquire()
+        try:
+            try:
+                self.flush()
+            finally:
+                if self.fd is not None:
+                    os.close(self.fd)
+                    self.fd = None
+        finally:
+            self.release()
+        super(AppendFileHandler, self).close()
+
+
+class DedupFilter(logging.Filter):
+    """
+    Logging filter that suppresses repeated messages across invocations.
+
+    A failing dependency can cause every ``monitor`` of every instance to log
+    the same error over and over. This filter fingerprints each log record and
+    remembers, in a :class:`ocf.state.State` belonging to the resource
+    instance, when it was last emitted. A record whose fingerprint was already
+    emitted within the last ``interval`` seconds is dropped and counted; the
+    first occurrence after the interval has elapsed is emitted with a note
+    saying how many times it was repeated in the meantime. If the message
+    stops, the note is logged on its own by :meth:`flush`, which is called
+    at teardown.
+
+    Because the table is persisted under
+    :attr:`ocf.environment.Environment.state_dir`, this works even though each
+    action is run by a separate process.
+
+    :param int interval: Number of seconds during which repeats of a message
+      are suppressed.
+    :param int level: Only records at or above this level are considered;
+      others are always passed through. Defaults to ``WARNING``.
+    :param int max_entries: Maximum number of fingerprints to remember; the
+      oldest are discarded first.
+
+    This filter is installed on every handler by :mod:`ocf.logging` if
+    :attr:`ocf.environment.Environment.log_dedup_interval` is non-zero.
+    """
+    def __init__(self, interval, level=logging.WARNING, max_entries=64):
+        super(DedupFilter, self).__init__()
+        self.interval = interval
+        self.level = level
+        self.max_entries = max_entries
+
+    @cached_property
+    def state(self):
+        """
+        The :class:`ocf.state.State` holding the suppression table.
+
+        Each entry maps a fingerprint to a list containing the time the
+        message was last emitted, the number of times it has been suppressed
+        since, and the record's level, logger name and message.
+        """
+        return ocf.state.State('logdedup')
+
+    def fingerprint(self, record):
+        """
+        Returns a short string identifying the record's level and message.
+        """
+        key = "{lvl}:{name}:{msg}".format(
+            lvl=record.levelno, name=record.name, msg=record.getMessage())
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+    def filter(self, record):
+        # The same filter is attached to several handlers, so make sure a
+        # record is only counted once and gets the same verdict everywhere.
+        try:
+            return record._ocf_dedup
+        except AttributeError:
+            pass
+
+        result = record._ocf_dedup = self._filter(record)
+        return result
+
+    def _filter(self, record):
+        if record.levelno < self.level:
+            return True
+
+        now = time.time()
+        fp = self.fingerprint(record)
+        entry = self.state.get(fp)
+
+        if entry is not None and 0 <= now - entry[0] < self.interval:
+            # Seen recently: suppress it and count it
+            entry[1] += 1
+            self._save()
+            return False
+
+        message = record.getMessage()
+        if entry is not None and entry[1] > 0:
+            record.msg = self._summary(message, entry, now)
+            record.args = ()
+
+        self.state[fp] = [now, 0, record.levelno, record.name, message]
+        self._prune(now)
+        self._save()
+        return True
+
+    def _summary(self, message, entry, now):
+        return "{msg} (repeated {n} times in {secs} seconds)".format(
+            msg=message, n=entry[1], secs=int(now - entry[0]))
+
+    def flush(self):
+        """
+        Logs the number of repeats of each message whose interval has
+        elapsed since it was last emitted, so that they are reported even if
+        the message is not logged again.
+        """
+        now = time.time()
+        expired = [(fp, entry) for fp, entry in self.state.items()
+                   if entry[1] > 0 and len(entry) >= 5 and
+                   not 0 <= now - entry[0] < self.interval]
+        if not expired:
+            return
+
+        for fp, entry in sorted(expired, key=lambda item: item[1][0]):
+            del self.state[fp]
+            levelno, name, message = entry[2:5]
+            record = logging.makeLogRecord(dict(
+                name=name, levelno=levelno,
+                levelname=logging.getLevelName(levelno),
+                msg=self._summary(message, entry, now)))
+            # Already counted; don't let the filter suppress it
+            record._ocf_dedup = True
+            logging.getLogger(name).handle(record)
+
+        self._save()
+
+    def _prune(self, now):
+        # Forget about messages that have expired without being repeated, then
+        # cap the size of the table by discarding the oldest entries.
+        for fp, entry in list(self.state.items()):
+            if entry[1] == 0 and now - entry[0] >= self.interval:
+                del self.state[fp]
+
+        excess = len(self.state) - self.max_entries
+        if excess > 0:
+            oldest = sorted(self.state, key=lambda fp: self.state[fp][0])
+            for fp in oldest[:excess]:
+                del self.state[fp]
+
+    def _save(self):
+        try:
+            self.state.save()
+        except (IOError, OSError):
+            # Never let a problem with the state directory stop us logging
+            pass
+
+
+class lazy(object):
+    """
+    Defers a function call until a log message is actually formatted.
+
+    Log messages are only formatted once they have passed the logger's level
+    check, so passing an instance of this class as a log message argument
+    avoids doing expensive work to produce a debug message that would never be
+    emitted::
+
+        ocf.log.debug("Current state: %s", ocf.logging.lazy(read_state, path))
+
+    :param func: The function to call.
+    :param args: Positional arguments to pass to ``func``.
+    :param kwargs: Keyword arguments to pass to ``func``.
+    """
+    def __init__(self, func, *args, **kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        return str(self.func(*self.args, **self.kwargs))
+
+
+def _evaluate(value):
+    return value() if callable(value) else value
+
+
+class _DeferredMessage(object):
+    def __init__(self, msg, args, kwargs):
+        self.msg = msg
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self):
+        args = [_evaluate(x) for x in self.args]
+        kwargs = dict((k, _evaluate(v)) for k, v in self.kwargs.items())
+        return self.msg.format(*args, **kwargs)
+
+
+def debug(msg, *args, **kwargs):
+    """
+    Log a debug message, formatting it only if it will be emitted.
+
+    The message is a :meth:`str.format` template. If debug logging is disabled
+    nothing at all is done; otherwise formatting happens only once the record
+    reaches a handler. Any ``args`` or ``kwargs`` that are callable are called
+    at that point, and their results used in their place::
+
+        ocf.logging.debug("Found {n} workers: {pids}",
+                          n=len(pids), pids=lambda: ", ".join(pids))
+
+    This is much cheaper than pre-formatting the message before calling
+    ``ocf.log.debug()`` when debug output is disabled or sampled (see
+    :attr:`ocf.environment.Environment.debug_sample`).
+    """
+    if ocf.log.isEnabledFor(logging.DEBUG):
+        ocf.log.debug(_DeferredMessage(msg, args, kwargs))
+
+
+class DebugBufferHandler(logging.Handler):
+    """
+    Holds back debug log records until the outcome of the action is known.
+
+    Used when :attr:`ocf.environment.Environment.debug_sample` is ``failure``.
+    The ``targets`` are the handlers that would normally receive debug records;
+    their level is raised to ``INFO`` and this handler instead keeps the debug
+    records in memory. :meth:`finish` passes them on to the targets only if the
+    action failed. If the process exits without :meth:`finish` having been
+    called, for example because of an unhandled exception, the records are
+    passed on when the handler is closed.
+
+    :param list targets: The handlers to pass debug records on to.
+    """
+    def __init__(self, targets):
+        super(DebugBufferHandler, self).__init__(logging.DEBUG)
+        self.targets = targets
+        self.buffer = []
+        self.finished = False
+
+        for target in targets:
+            target.setLevel(logging.INFO)
+
+    def emit(self, record):
+        if record.levelno < logging.INFO:
+            self.buffer.append(record)
+
+    def finish(self, ret):
+        """
+        Pass on or discard the held debug records given the action's result.
+        """
+        if ret != ocf.OCF_SUCCESS:
+            self.replay()
+        self.buffer = []
+        self.finished = True
+
+    def replay(self):
+        """
+        Pass all held debug records on to the target handlers.
+        """
+        for record in self.buffer:
+            for target in self.targets:
+                # handle() skips the level check which we used to hide debug
+                # records from the target in the first place
+                target.handle(record)
+        self.buffer = []
+
+    def close(self):
+        if not self.finished:
+            self.replay()
+        super(DebugBufferHandler, self).close()
+
+
+@ocf.lifecycle.on_teardown
+def _teardown(ret):
+    # Pass the action's result on to the debug buffer, then make sure that
+    # everything has been written out in case of a fast exit
+    handlers = logging.getLogger().handlers
+
+    # Report repeats of messages which have stopped being logged
+    filters = set(f for handler in handlers for f in handler.filters
+                  if isinstance(f, DedupFilter))
+    for dedup in filters:
+        dedup.flush()
+
+    for handler in handlers:
+        if isinstance(handler, DebugBufferHandler):
+            handler.finish(ret)
+
+    for handler in handlers:
+        handler.flush()
+
+
+def _setup_debug_sample(root):
+    if not ocf.env.debug or ocf.env.debug_sample != 'failure' or \
+            ocf.env.action != 'monitor':
+        return
+
+    # Only hold back records from handlers that would have received them
+    targets = [h for h in root.handlers if h.level < logging.INFO]
+    if targets:
+        root.addHandler(DebugBufferHandler(targets))
+
+
+def _setup_dedup(root):
+    interval = ocf.env.log_dedup_interval
+    if not interval:
+        return
+
+    dedup = DedupFilter(interval)
+    for handler in root.handlers:
+        handler.addFilter(dedup)
+
+
 def _setup_logging():
     root = logging.getLogger()
 
@@ -60,12 +441,12 @@ def _setup_logging():
         logtag=ocf.env.logtag))
 
     # Formatter with a very particular format which matches the format used for
-    # HA_LOGFILE / HA_DEBUGLOG in ocf-shellfuncs, which includes the date and a
-    # tab between the log tag and the date/time.
+    # HA_LOGFILE / HA_DEBUGLOG in ocf-shellfuncs, which includes the date. The
+    # log tag and a tab are prepended by AppendFileHandler.
     fmt_dated = logging.Formatter(
-        "{logtag}:\t%(asctime) %(levelname)s: %(message)s".format(
-            logtag=ocf.env.logtag),
+        "%(asctime)s %(levelname)s: %(message)s",
         datefmt='%Y/%m/%d_%H:%M:%S')
+    prefix_dated = "{logtag}:\t".format(logtag=ocf.env.logtag)
 
     # Set the log level based on our environment settings
     if ocf.env.debug:
@@ -87,6 +468,8 @@ def _setup_logging():
         handler = HaLogdHandler()
         handler.setFormatter(fmt_short)
         root.addHandler(handler)
+        _setup_debug_sample(root)
+        _setup_dedup(root)
         return  # all done
 
     # Add a syslog handler unless syslog has been explicitly disabled
@@ -98,13 +481,15 @@ def _setup_logging():
 
     # This log file receives _all_ log messages, not just debug logs
     if ocf.env.debuglog:
-        handler = logging.FileHandler(ocf.env.debuglog)
+        handler = AppendFileHandler(
+            ocf.env.debuglog, prefix=prefix_dated, batch=ocf.env.log_batch)
         handler.setFormatter(fmt_dated)
         root.addHandler(handler)
 
     # This log file should not receive DEBUG messages
     if ocf.env.logfile:
-        handler = logging.FileHandler(ocf.env.logfile)
+        handler = AppendFileHandler(
+            ocf.env.logfile, prefix=prefix_dated, batch=ocf.env.log_batch)
         handler.setLevel(logging.INFO)
         handler.setFormatter(fmt_dated)
         root.addHandler(handler)
@@ -116,6 +501,9 @@ def _setup_logging():
         handler.setFormatter(fmt_long)
         root.addHandler(handler)
 
+    _setup_debug_sample(root)
+    _setup_dedup(root)
+
 _setup_logging()
 
 # vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,160 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import logging
+import ocf.logging
+import ocf.testing
+import os
+import tempfile
+import unittest
+
+
+def make_record(msg, level=logging.ERROR):
+    return logging.LogRecord('ocf', level, __file__, 1, msg, (), None)
+
+
+class DedupFilterTests(ocf.testing.TestCase):
+    def test_repeats_are_suppressed_across_instances(self):
+        first = ocf.logging.DedupFilter(interval=60)
+        assert first.filter(make_record('disk on fire'))
+
+        # A new filter stands in for the next invocation of the agent
+        second = ocf.logging.DedupFilter(interval=60)
+        assert not second.filter(make_record('disk on fire'))
+        assert second.filter(make_record('something else'))
+
+    def test_debug_is_not_suppressed(self):
+        dedup = ocf.logging.DedupFilter(interval=60)
+        assert dedup.filter(make_record('hello', logging.DEBUG))
+        assert dedup.filter(make_record('hello', logging.DEBUG))
+
+    def test_summary_after_interval(self):
+        dedup = ocf.logging.DedupFilter(interval=60)
+        assert dedup.filter(make_record('disk on fire'))
+        assert not dedup.filter(make_record('disk on fire'))
+        assert not dedup.filter(make_record('disk on fire'))
+
+        # Pretend the interval has elapsed
+        for entry in dedup.state.values():
+            entry[0] -= 61
+
+        record = make_record('disk on fire')
+        assert dedup.filter(record)
+        assert 'repeated 2 times' in record.getMessage()
+
+    def test_summary_when_message_stops(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('ocf.dedup-test')
+        logger.addHandler(handler)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+
+        dedup = ocf.logging.DedupFilter(interval=60)
+        assert dedup.filter(make_record('disk on fire'))
+        assert not dedup.filter(make_record('disk on fire'))
+        for entry in dedup.state.values():
+            entry[3] = logger.name
+
+        # Nothing to report until the interval has elapsed
+        dedup.flush()
+        assert records == []
+
+        for entry in dedup.state.values():
+            entry[0] -= 61
+        dedup.flush()
+        assert [r.getMessage() for r in records] == \
+            ['disk on fire (repeated 1 times in 61 seconds)']
+        assert records[0].levelno == logging.ERROR
+
+        # Reported once only
+        dedup.flush()
+        assert len(records) == 1
+
+    def test_verdict_is_cached_on_record(self):
+        dedup = ocf.logging.DedupFilter(interval=60)
+        record = make_record('disk on fire')
+        assert dedup.filter(record)
+        assert dedup.filter(record)
+
+
+class AppendFileHandlerTests(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.path)
+
+    def read(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def test_prefix_and_lines(self):
+        handler = ocf.logging.AppendFileHandler(self.path, prefix='tag:\t')
+        handler.emit(make_record('one'))
+        handler.emit(make_record('two'))
+        handler.close()
+        assert self.read() == b'tag:\tone\ntag:\ttwo\n'
+
+    def test_batch_written_on_close(self):
+        handler = ocf.logging.AppendFileHandler(self.path, batch=True)
+        handler.emit(make_record('one'))
+        handler.emit(make_record('two'))
+        assert self.read() == b''
+        handler.close()
+        assert self.read() == b'one\ntwo\n'
+
+
+class DeferredDebugTests(unittest.TestCase):
+    def test_lazy_not_called_unless_formatted(self):
+        calls = []
+
+        def expensive():
+            calls.append(1)
+            return 'result'
+
+        value = ocf.logging.lazy(expensive)
+        assert calls == []
+        assert str(value) == 'result'
+        assert calls == [1]
+
+    def test_deferred_message(self):
+        msg = ocf.logging._DeferredMessage(
+            "{0} and {x}", (lambda: 'a',), {'x': 'b'})
+        assert str(msg) == 'a and b'
+
+
+class DebugBufferHandlerTests(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.target = logging.Handler()
+        self.target.emit = self.records.append
+        self.buffer = ocf.logging.DebugBufferHandler([self.target])
+
+    def test_discarded_on_success(self):
+        self.buffer.handle(make_record('hidden', logging.DEBUG))
+        self.buffer.finish(ocf.OCF_SUCCESS)
+        self.buffer.close()
+        assert self.records == []
+
+    def test_replayed_on_failure(self):
+        record = make_record('shown', logging.DEBUG)
+        self.buffer.handle(record)
+        self.buffer.finish(ocf.OCF_ERR_GENERIC)
+        assert self.records == [record]
@@ -0,0 +1,347 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Scanning a log file for patterns, reading each line only once.
+
+A ``monitor`` which greps a service's log for fatal errors re-reads the whole,
+ever-growing file every time. A :class:`LogScanner` instead keeps a cursor
+(the file's device and inode, and the offset reached) in the instance's state
+(see :mod:`ocf.state`), so that each scan only reads what has been written
+since the last one:
+
+* if the file has been rotated (it has a different inode), the rest of the
+  old file is scanned first if it can be found as ``<path>.1``, and then the
+  new file from the start;
+* if the file has been truncated (it is shorter than the offset), it is
+  scanned from the start;
+* an incomplete last line is left for the next scan.
+
+The new part of the file is read with plain reads (not memory-mapped, as a log
+truncated by ``copytruncate`` rotation while mapped would kill the agent with
+``SIGBUS``), and searched with a single regular expression made up of all the
+patterns, unless they contain groups. At most ``budget`` bytes are scanned at
+a time; the rest is left for later scans, so that a burst of logging can't
+make a ``monitor`` time out, nor use much memory.
+
+Usage::
+
+    @ocf.Action()
+    def start(self):
+        ...
+        self.log_scanner.skip()
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(timeout=20, depth=0, interval=10)
+    def monitor(self):
+        for match in self.log_scanner.scan():
+            ocf.log.error("Found in log: {0}".format(match.line))
+            return ocf.OCF_ERR_GENERIC
+        ...
+
+    @ocf.util.cached_property
+    def log_scanner(self):
+        return ocf.logscan.LogScanner(
+            '/var/log/food.log', [r'FATAL', r'out of memory'], context=2)
+"""
+
+from __future__ import absolute_import
+
+import collections
+import hashlib
+import ocf
+import ocf.state
+import os
+import re
+
+#: A line matched by :meth:`LogScanner.scan`: the ``pattern`` it matched (as
+#: given), the ``line`` itself, its ``offset`` in the file, and tuples of the
+#: lines ``before`` and ``after`` it. Lines are decoded as UTF-8 and have no
+#: trailing newline.
+Match = collections.namedtuple('Match', ('pattern', 'line', 'offset',
+                                         'before', 'after'))
+
+#: Default maximum number of bytes read by each scan.
+BUDGET = 16 * 1024 * 1024
+
+
+def _decode(data):
+    return data.decode('utf-8', 'replace')
+
+
+def _read(fd, offset, count):
+    # Up to count bytes from offset; fewer if the file is shorter
+    os.lseek(fd, offset, os.SEEK_SET)
+    chunks = []
+    while count > 0:
+        chunk = os.read(fd, min(count, 1024 * 1024))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        count -= len(chunk)
+    return b''.join(chunks)
+
+
+class LogScanner(object):
+    """
+    Finds lines matching any of ``patterns`` which have been added to the log
+    file ``path`` since the last scan.
+
+    :param str path: Path to the log file.
+    :param patterns: Regular expressions, as strings. ``^`` and ``$`` match
+      at the start and end of each line. Each pattern is compiled on its own,
+      so groups and backreferences such as ``\\1`` work as usual. A line
+      matching several patterns is reported once, for the one which matches
+      first in the line (or first in ``patterns``, for a tie).
+    :param int flags: Further flags for :func:`re.compile`, such as
+      :data:`re.IGNORECASE`.
+    :param int context: Number of lines to give before and after each match.
+    :param int budget: Maximum number of bytes to read in each scan.
+    :param str name: Name of the cursor, to tell apart several scanners of
+      the same file. Optional.
+    :param bool from_start: If there is no cursor yet, scan the file from the
+      start rather than from its current end.
+    """
+    def __init__(self, path, patterns, flags=0, context=0, budget=BUDGET,
+                 name=None, from_start=False):
+        self.path = path
+        self.patterns = list(patterns)
+        self.context = context
+        self.budget = budget
+        self.from_start = from_start
+
+        #: Number of bytes left for later by the last scan, because of the
+        #: budget or an incomplete last line.
+        self.behind = 0
+
+        self._regexes = [re.compile(p.encode('utf-8'), flags | re.MULTILINE)
+                         for p in self.patterns]
+
+        # Search for all the patterns at once where that can't change their
+        # meaning: combining patterns with groups would renumber them, and
+        # break backreferences such as \1
+        self._regex = None
+        if self._regexes and not any(r.groups for r in self._regexes):
+            try:
+                self._regex = re.compile(b'|'.join(
+                    b'(?:' + p.encode('utf-8') + b')'
+                    for p in self.patterns), flags | re.MULTILINE)
+            except re.error:
+                pass
+
+        if name is None:
+            name = hashlib.sha1(os.path.abspath(path).encode('utf-8')) \
+                .hexdigest()[:16]
+        self.state = ocf.state.State('logscan.' + name)
+
+    def _open(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None, None
+        return fd, os.fstat(fd)
+
+    def skip(self):
+        """
+        Moves the cursor to the current end of the file, so that the next
+        scan only finds lines written from now on.
+        """
+        fd, st = self._open(self.path)
+        if fd is None:
+            self.state.clear()
+        else:
+            os.close(fd)
+            self._move(st, st.st_size)
+
+    def _move(self, st, offset):
+        cursor = dict(dev=st.st_dev, ino=st.st_ino, offset=offset)
+        if any(self.state.get(k) != v for k, v in cursor.items()):
+            self.state.update(cursor)
+            self.state.save(defer=True)
+
+    def scan(self):
+        """
+        Returns a list of :data:`Match` for the lines which have been added
+        since the last scan, and moves the cursor past them.
+        """
+        fd, st = self._open(self.path)
+        if fd is None:
+            return []
+
+        try:
+            if 'offset' not in self.state:
+                if not self.from_start:
+                    self._move(st, st.st_size)
+                    return []
+                self._move(st, 0)
+
+            matches = []
+            budget = self.budget
+            offset = self.state['offset']
+
+            if (self.state['dev'], self.state['ino']) != \
+                    (st.st_dev, st.st_ino):
+                # Rotated: finish the old file first, if it's still there
+                old_fd, old_st = self._open(self.path + '.1')
+                if old_fd is not None:
+                    try:
+                        if (old_st.st_dev, old_st.st_ino) == \
+                                (self.state['dev'], self.state['ino']):
+                            end = self._scan(old_fd, old_st.st_size, offset,
+                                             budget, matches, final=True)
+                            budget -= end - offset
+                            if end < old_st.st_size:
+                                self._move(old_st, end)
+                                self.behind = old_st.st_size - end + \
+                                    st.st_size
+                                return matches
+                    finally:
+                        os.close(old_fd)
+                offset = 0
+            elif st.st_size < offset:
+                ocf.log.debug("{path} was truncated; scanning from the "
+                              "start".format(path=self.path))
+                offset = 0
+
+            end = self._scan(fd, st.st_size, offset, budget, matches)
+            self._move(st, end)
+            self.behind = st.st_size - end
+            if self.behind:
+                ocf.log.debug("{n} bytes of {path} left for the next "
+                              "scan".format(n=self.behind, path=self.path))
+            return matches
+        finally:
+            os.close(fd)
+
+    def _scan(self, fd, size, offset, budget, matches, final=False):
+        """
+        Adds the matches in lines from ``offset`` to ``matches``, reading at
+        most ``budget`` bytes. Returns the offset reached, which is the start
+        of the first line not scanned. An incomplete last line is only
+        scanned if ``final`` is true.
+        """
+        end = min(size, offset + max(budget, 0))
+        if end <= offset:
+            return offset
+
+        # The lines before the first match may be needed for context
+        head = self._head(fd, offset)
+        base = offset - len(head)
+        data = head + _read(fd, offset, end - offset)
+        if base + len(data) < end:
+            # Truncated while we were reading it: take what we got
+            size = end = base + len(data)
+        lo, hi = offset - base, end - base
+
+        if end < size or not final:
+            # Stop after the last complete line
+            last = data.rfind(b'\n', lo, hi)
+            if last >= 0:
+                hi = last + 1
+            elif end == size:
+                return offset
+            # Otherwise a single line is longer than the budget, and is
+            # scanned in pieces
+
+        for start, pattern in self._search(data, lo, hi):
+            stop = data.find(b'\n', start, hi)
+            if stop < 0:
+                stop = hi
+            matches.append(Match(
+                pattern, _decode(data[start:stop]), base + start,
+                self._before(data, start), self._after(data, stop, hi)))
+        return base + hi
+
+    def _head(self, fd, offset):
+        # Enough of the file before offset for the context of a match on the
+        # first line, or nothing if it shrank while being read
+        head = b''
+        start = offset
+        while self.context and start > 0 and \
+                head.count(b'\n') <= self.context:
+            count = min(start, 4096)
+            start -= count
+            chunk = _read(fd, start, count)
+            if len(chunk) < count:
+                return b''
+            head = chunk + head
+        return head
+
+    def _search(self, data, pos, end):
+        """
+        Yields the start of each line between ``pos`` and ``end`` containing
+        a match, with the pattern it matched.
+        """
+        if self._regex is None:
+            # Search for each pattern separately, and merge the results as
+            # the combined expression would have found them
+            found = {}
+            for i, regex in enumerate(self._regexes):
+                for start, at in self._lines(regex, data, pos, end):
+                    found[start] = min(found.get(start, (at, i)), (at, i))
+            for start in sorted(found):
+                yield start, self.patterns[found[start][1]]
+            return
+
+        for start, at in self._lines(self._regex, data, pos, end):
+            yield start, self._pattern(data, at, end)
+
+    def _lines(self, regex, data, pos, end):
+        # The start of each line with a match, and where the match starts
+        while pos < end:
+            m = regex.search(data, pos, end)
+            if m is None:
+                return
+            yield data.rfind(b'\n', 0, m.start()) + 1, m.start()
+            pos = data.find(b'\n', m.start(), end) + 1
+            if pos == 0:
+                return
+
+    def _pattern(self, data, pos, end):
+        # The alternative the combined expression took: the first pattern
+        # which matches where it matched
+        for pattern, regex in zip(self.patterns, self._regexes):
+            if regex.match(data, pos, end):
+                return pattern
+
+    def _before(self, data, start):
+        lines = []
+        while start > 0 and len(lines) < self.context:
+            begin = data.rfind(b'\n', 0, start - 1) + 1
+            lines.append(_decode(data[begin:start - 1]))
+            start = begin
+        return tuple(reversed(lines))
+
+    def _after(self, data, stop, end):
+        lines = []
+        pos = stop + 1
+        while pos < end and len(lines) < self.context:
+            nl = data.find(b'\n', pos, end)
+            if nl < 0:
+                nl = end
+            lines.append(_decode(data[pos:nl]))
+            pos = nl + 1
+        return tuple(lines)
+
+
+def scan(path, patterns, **kwargs):
+    """
+    Shortcut for ``LogScanner(path, patterns, **kwargs).scan()``.
+    """
+    return LogScanner(path, patterns, **kwargs).scan()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
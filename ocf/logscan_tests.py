@@ -0,0 +1,123 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.lifecycle
+import ocf.logscan
+import ocf.testing
+import os
+
+
+class LogScanTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(LogScanTests, self).setUp()
+        self.path = os.path.join(self.tmpdir, 'food.log')
+        self.write('old FATAL error\n')
+
+    def write(self, data, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def scan(self, **kwargs):
+        # A fresh scanner each time, as in a new invocation
+        matches = ocf.logscan.scan(self.path, ['FATAL', '^panic'], **kwargs)
+        ocf.lifecycle.teardown(0)
+        return [m.line for m in matches]
+
+    def test_only_new_lines(self):
+        assert self.scan() == []
+        self.write('ok\nFATAL one\npanic: two\nnot a panic\n')
+        assert self.scan() == ['FATAL one', 'panic: two']
+        assert self.scan() == []
+
+    def test_from_start(self):
+        assert self.scan(from_start=True) == ['old FATAL error']
+
+    def test_incomplete_line(self):
+        self.scan()
+        self.write('FATAL incompl')
+        assert self.scan() == []
+        self.write('ete\n')
+        assert self.scan() == ['FATAL incomplete']
+
+    def test_truncated(self):
+        self.scan()
+        self.write('FATAL new\n', mode='w')
+        assert self.scan() == ['FATAL new']
+
+    def test_rotated(self):
+        self.scan()
+        self.write('FATAL before rotation\n')
+        os.rename(self.path, self.path + '.1')
+        self.write('FATAL after rotation\n')
+        assert self.scan() == ['FATAL before rotation',
+                               'FATAL after rotation']
+
+    def test_budget(self):
+        self.scan()
+        self.write('FATAL 1\nFATAL 2\nFATAL 3\n')
+        assert self.scan(budget=10) == ['FATAL 1']
+        assert self.scan(budget=10) == ['FATAL 2']
+        assert self.scan() == ['FATAL 3']
+
+    def test_context(self):
+        self.scan()
+        self.write('a\nb\nFATAL\nc\n')
+        matches = ocf.logscan.scan(self.path, ['FATAL'], context=2)
+        assert len(matches) == 1
+        assert matches[0].pattern == 'FATAL'
+        assert matches[0].before == ('a', 'b')
+        assert matches[0].after == ('c',)
+
+    def test_context_before_cursor(self):
+        self.scan()
+        self.write('a\nb\n')
+        self.scan()
+        self.write('FATAL\n')
+        matches = ocf.logscan.scan(self.path, ['FATAL'], context=2)
+        assert matches[0].before == ('a', 'b')
+
+    def test_truncated_while_reading(self):
+        self.scan()
+        self.write('FATAL 1\nFATAL 2\n')
+        read = ocf.logscan._read
+
+        def truncate(fd, offset, count):
+            # copytruncate rotation between fstat() and read()
+            self.write('', mode='w')
+            return read(fd, offset, count)
+
+        ocf.logscan._read = truncate
+        self.addCleanup(setattr, ocf.logscan, '_read', read)
+        assert self.scan() == []
+
+        ocf.logscan._read = read
+        self.write('FATAL 3\n')
+        assert self.scan() == ['FATAL 3']
+
+    def test_backreferences(self):
+        self.scan()
+        self.write('a b\nerror: x x\nerror: x y\nFATAL\n')
+        matches = ocf.logscan.scan(self.path, ['FATAL', r'(\w) \1$'])
+        assert [(m.pattern, m.line) for m in matches] == [
+            (r'(\w) \1$', 'error: x x'), ('FATAL', 'FATAL')]
+
+    def test_first_match_wins(self):
+        self.write('panic: FATAL\n', mode='w')
+        for patterns in (['FATAL', 'panic'], ['FATAL', '(p)anic']):
+            matches = ocf.logscan.scan(self.path, patterns, from_start=True,
+                                       name='test')
+            assert [m.pattern for m in matches] == [patterns[1]]
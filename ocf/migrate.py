@@ -0,0 +1,446 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Handing a resource instance's state over during live migration.
+
+When the CRM migrates a resource, it runs ``migrate_to`` on the node the
+resource is leaving and then ``migrate_from`` on the node it is moving to. An
+agent which implements these as a plain ``stop`` and ``start`` turns a live
+migration into a cold restart, losing whatever the instance kept locally. A
+:class:`Migration` instead lets ``migrate_to`` take a checkpoint of the
+instance's state and data files into a transfer area, from which
+``migrate_from`` restores them on the target.
+
+The checkpoint includes the instance's :class:`ocf.state.State` files (unless
+``state=False``) and any data ``files`` the agent names. Files are compared in
+chunks by their SHA-1, and only the chunks that differ are copied, using
+:func:`os.copy_file_range` or :func:`os.sendfile` where possible. Migrating
+back and forth, or restoring onto a node which still has an older copy, only
+moves what has changed.
+
+The transfer area is provided by a transport. :class:`DirectoryTransport`
+keeps it in a directory, which should be on storage shared by the nodes; other
+transports need only implement the same methods.
+
+Usage::
+
+    class FooAgent(ocf.ResourceAgent):
+        transfer_dir = ocf.Parameter(
+            shortdesc='Transfer directory', longdesc='Shared directory '
+            'through which state is handed over during migration.')
+
+        @property
+        def migration(self):
+            return ocf.migrate.Migration(
+                ocf.migrate.DirectoryTransport(self.transfer_dir),
+                files=[self.datafile])
+
+        @ocf.Action()
+        def migrate_to(self):
+            self.pause_service()
+            self.migration.checkpoint()
+            return self.stop()
+
+        @ocf.Action()
+        def migrate_from(self):
+            if not self.migration.restore():
+                return ocf.OCF_ERR_GENERIC
+            return self.start()
+"""
+
+from __future__ import absolute_import
+
+import collections
+import errno
+import hashlib
+import json
+import ocf
+import os
+import socket
+import time
+
+from ocf.util import atomic_write, makedirs
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+#: Default size of the chunks in which files are compared.
+CHUNK_SIZE = 1024 * 1024
+
+_MANIFEST_VERSION = 1
+
+#: What :meth:`Migration.checkpoint` and :meth:`Migration.restore` did: the
+#: number of files, of chunks in those files, of chunks which had to be copied,
+#: and of bytes copied.
+Stats = collections.namedtuple(
+    'Stats', ('files', 'chunks', 'copied_chunks', 'copied_bytes'))
+
+
+class DirectoryTransport(object):
+    """
+    Keeps the transfer area of a resource instance in a directory.
+
+    :param str root: Directory holding the transfer areas of all instances,
+      normally on shared storage such as NFS. For testing, any local directory
+      will do.
+    :param str instance: The resource instance. Defaults to
+      :attr:`ocf.environment.Environment.resource_instance`.
+    """
+    def __init__(self, root, instance=None):
+        if instance is None:
+            instance = ocf.env.resource_instance
+        self.path = os.path.join(root, instance)
+
+    def read_manifest(self):
+        """
+        Returns the manifest of the last complete checkpoint, or ``None``.
+        """
+        try:
+            with open(os.path.join(self.path, 'manifest.json'), 'rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return None
+
+    def write_manifest(self, manifest):
+        """
+        Saves the ``manifest`` (a dictionary), or removes it if ``None``.
+        """
+        path = os.path.join(self.path, 'manifest.json')
+        if manifest is None:
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+            return
+
+        data = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+        atomic_write(path, data.encode('utf-8'))
+
+    def open(self, name, write=False):
+        """
+        Opens the copy of file ``name`` in binary mode, for reading and writing
+        if ``write`` is true (creating it if necessary) or else read-only.
+        Returns ``None`` if it is to be read but does not exist.
+        """
+        path = os.path.join(self.path, 'files', name)
+        if not write:
+            try:
+                return open(path, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:
+                    return None
+                raise
+
+        makedirs(os.path.dirname(path))
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        return os.fdopen(fd, 'r+b')
+
+    def remove(self):
+        """
+        Removes the transfer area.
+        """
+        self.write_manifest(None)
+        files = os.path.join(self.path, 'files')
+        if os.path.isdir(files):
+            for name in os.listdir(files):
+                os.unlink(os.path.join(files, name))
+            os.rmdir(files)
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+def _chunk_hashes(f, chunk_size):
+    hashes = []
+    f.seek(0)
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            return hashes
+        hashes.append(hashlib.sha1(data).hexdigest())
+
+
+def _size(f):
+    f.seek(0, os.SEEK_END)
+    return f.tell()
+
+
+def _short_copy(src, offset, count, done):
+    raise IOError("{name}: expected {count} bytes at offset {offset}, "
+                  "found only {done}".format(
+                      name=getattr(src, 'name', src), count=count,
+                      offset=offset, done=done))
+
+
+def _copy_range(src, dst, offset, count):
+    """
+    Copies ``count`` bytes at ``offset`` from file object ``src`` to the same
+    offset in ``dst``, in the kernel where possible. Raises :exc:`IOError` if
+    ``src`` ends early, e.g. because it was truncated while being copied.
+    """
+    try:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+    except (AttributeError, IOError, ValueError):
+        src_fd = dst_fd = None
+
+    if src_fd is not None:
+        copy_file_range = getattr(os, 'copy_file_range', None)
+        try:
+            if copy_file_range is not None:
+                done = 0
+                while done < count:
+                    n = copy_file_range(src_fd, dst_fd, count - done,
+                                        offset + done, offset + done)
+                    if n == 0:
+                        _short_copy(src, offset, count, done)
+                    done += n
+                return
+        except OSError as e:
+            # Different file systems on old kernels, or not supported at all
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                               errno.EOPNOTSUPP):
+                raise
+
+        sendfile = getattr(os, 'sendfile', None)
+        try:
+            if sendfile is not None:
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+                done = 0
+                while done < count:
+                    n = sendfile(dst_fd, src_fd, offset + done, count - done)
+                    if n == 0:
+                        _short_copy(src, offset, count, done)
+                    done += n
+                return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.ENOSYS):
+                raise
+
+    src.seek(offset)
+    data = src.read(count)
+    if len(data) < count:
+        _short_copy(src, offset, count, len(data))
+    dst.seek(offset)
+    dst.write(data)
+    dst.flush()
+
+
+def _sync(src, dst, hashes, have, chunk_size):
+    """
+    Copies the chunks of ``src`` whose ``hashes`` differ from those the
+    destination ``have`` to ``dst``, and truncates ``dst`` to size. Returns the
+    number of chunks and bytes copied. Raises :exc:`IOError` if ``src`` is no
+    longer the size ``hashes`` describe.
+    """
+    size = _size(src)
+    if len(hashes) != (size + chunk_size - 1) // chunk_size:
+        raise IOError("{name}: size changed while being copied".format(
+            name=getattr(src, 'name', src)))
+
+    chunks = copied = 0
+    for index, digest in enumerate(hashes):
+        if index < len(have) and have[index] == digest:
+            continue
+        offset = index * chunk_size
+        count = min(chunk_size, size - offset)
+        _copy_range(src, dst, offset, count)
+        chunks += 1
+        copied += count
+
+    dst.flush()
+    dst.truncate(size)
+    return chunks, copied
+
+
+class Migration(object):
+    """
+    Checkpoints and restores the state and data files of a resource instance.
+
+    :param transport: The transport holding the transfer area, such as a
+      :class:`DirectoryTransport`.
+    :param files: Paths of the data files to hand over. Each is restored to the
+      same path on the target node.
+    :param bool state: Whether to include the instance's
+      :class:`ocf.state.State` files.
+    :param int chunk_size: Size of the chunks in which files are compared.
+    """
+    def __init__(self, transport, files=(), state=True,
+                 chunk_size=CHUNK_SIZE):
+        self.transport = transport
+        self.files = list(files)
+        self.state = state
+        self.chunk_size = chunk_size
+
+    def _sources(self):
+        """
+        Returns a dictionary mapping transfer names to local paths.
+        """
+        sources = {}
+        for path in self.files:
+            path = os.path.abspath(path)
+            sources['data.' + quote(path, safe='')] = path
+
+        if self.state:
+            state_dir = ocf.env.state_dir
+            prefix = "{type}-{instance}.".format(
+                type=ocf.env.resource_type,
+                instance=ocf.env.resource_instance)
+            try:
+                names = os.listdir(state_dir)
+            except OSError:
+                names = []
+            for name in names:
+                # Samplers belong to a running process, not to the instance
+                if name.startswith(prefix) and '.sampler.' not in name:
+                    sources['state.' + name] = os.path.join(state_dir, name)
+
+        return sources
+
+    def checkpoint(self):
+        """
+        Copies the instance's files into the transfer area. Returns
+        :data:`Stats`.
+
+        Run this on the source node, in ``migrate_to``, once the service has
+        been quiesced. Data files which do not exist are skipped. Raises
+        :exc:`IOError` if a file shrinks while it is being copied, in which
+        case the transfer area holds no usable checkpoint.
+        """
+        old = self.transport.read_manifest() or {}
+        if old.get('chunk_size') != self.chunk_size:
+            old = {}
+        old_files = old.get('files', {})
+
+        # Until the new manifest is written, the transfer area is not usable
+        self.transport.write_manifest(None)
+
+        manifest = {
+            'version': _MANIFEST_VERSION,
+            'chunk_size': self.chunk_size,
+            'source': socket.gethostname(),
+            'created': time.time(),
+            'files': {},
+        }
+        stats = [0, 0, 0, 0]
+
+        for name, path in sorted(self._sources().items()):
+            try:
+                src = open(path, 'rb')
+            except (IOError, OSError) as e:
+                if e.errno == errno.ENOENT:
+                    continue
+                raise
+
+            with src:
+                st = os.fstat(src.fileno())
+                hashes = _chunk_hashes(src, self.chunk_size)
+                dst = self.transport.open(name, write=True)
+                with dst:
+                    # The old hashes can only be trusted if the copy is still
+                    # the size they describe
+                    entry = old_files.get(name)
+                    have = []
+                    if entry is not None and entry['size'] == _size(dst):
+                        have = entry['chunks']
+                    chunks, copied = _sync(
+                        src, dst, hashes, have, self.chunk_size)
+
+            manifest['files'][name] = {
+                'path': path,
+                'size': st.st_size,
+                'mode': st.st_mode & 0o7777,
+                'mtime': st.st_mtime,
+                'chunks': hashes,
+            }
+            stats[0] += 1
+            stats[1] += len(hashes)
+            stats[2] += chunks
+            stats[3] += copied
+
+        self.transport.write_manifest(manifest)
+
+        stats = Stats(*stats)
+        ocf.log.info("Checkpointed {files} file(s): copied {copied} of "
+                     "{chunks} chunk(s), {bytes} bytes".format(
+                         files=stats.files, copied=stats.copied_chunks,
+                         chunks=stats.chunks, bytes=stats.copied_bytes))
+        return stats
+
+    def restore(self):
+        """
+        Restores the instance's files from the transfer area. Returns
+        :data:`Stats`, or ``None`` if there is no complete checkpoint.
+
+        Run this on the target node, in ``migrate_from``, before starting the
+        service. Local files are updated in place, so they must not be in use.
+        """
+        manifest = self.transport.read_manifest()
+        if manifest is None or manifest.get('version') != _MANIFEST_VERSION:
+            ocf.log.error("No checkpoint to restore")
+            return None
+
+        chunk_size = manifest['chunk_size']
+        stats = [0, 0, 0, 0]
+
+        for name, entry in sorted(manifest['files'].items()):
+            if name.startswith('state.'):
+                path = os.path.join(ocf.env.state_dir, name[len('state.'):])
+            else:
+                path = entry['path']
+
+            src = self.transport.open(name)
+            if src is None:
+                ocf.log.error("Checkpoint is missing {path}".format(
+                    path=entry['path']))
+                return None
+
+            with src:
+                makedirs(os.path.dirname(path))
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, entry['mode'])
+                with os.fdopen(fd, 'r+b') as dst:
+                    have = _chunk_hashes(dst, chunk_size)
+                    chunks, copied = _sync(
+                        src, dst, entry['chunks'], have, chunk_size)
+
+            os.chmod(path, entry['mode'])
+            os.utime(path, (entry['mtime'], entry['mtime']))
+
+            stats[0] += 1
+            stats[1] += len(entry['chunks'])
+            stats[2] += chunks
+            stats[3] += copied
+
+        stats = Stats(*stats)
+        ocf.log.info("Restored {files} file(s) from {source}: copied {copied} "
+                     "of {chunks} chunk(s), {bytes} bytes".format(
+                         files=stats.files, source=manifest.get('source'),
+                         copied=stats.copied_chunks, chunks=stats.chunks,
+                         bytes=stats.copied_bytes))
+        return stats
+
+    def discard(self):
+        """
+        Removes the transfer area, for example once the migration is complete.
+        """
+        self.transport.remove()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,117 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import io
+import ocf.migrate
+import ocf.state
+import ocf.testing
+import os
+
+
+class MigrationTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(MigrationTests, self).setUp()
+        self.data = os.path.join(self.tmpdir, 'data')
+        self.transfer = os.path.join(self.tmpdir, 'transfer')
+
+    def migration(self):
+        return ocf.migrate.Migration(
+            ocf.migrate.DirectoryTransport(self.transfer, 'test'),
+            files=[self.data], chunk_size=4)
+
+    def write(self, data):
+        with open(self.data, 'wb') as f:
+            f.write(data)
+
+    def read(self):
+        with open(self.data, 'rb') as f:
+            return f.read()
+
+    def test_round_trip(self):
+        self.write(b'aaaabbbbcc')
+        state = ocf.state.State('counters')
+        state['runs'] = 3
+        state.save()
+
+        stats = self.migration().checkpoint()
+        assert stats.files == 2
+        assert stats.copied_bytes == 10 + os.path.getsize(state.path)
+
+        # The target node has neither file
+        os.unlink(self.data)
+        state.remove()
+
+        stats = self.migration().restore()
+        assert stats.files == 2
+        assert self.read() == b'aaaabbbbcc'
+        assert ocf.state.State('counters') == {'runs': 3}
+
+    def test_only_changed_chunks_are_copied(self):
+        self.write(b'aaaabbbbcccc')
+        self.migration().checkpoint()
+
+        self.write(b'aaaaXbbbcccc')
+        stats = self.migration().checkpoint()
+        assert stats.copied_chunks == 1 and stats.copied_bytes == 4
+
+        # The target still has the original version
+        self.write(b'aaaabbbbcccc')
+        stats = self.migration().restore()
+        assert stats.copied_chunks == 1
+        assert self.read() == b'aaaaXbbbcccc'
+
+    def test_shrinking_file(self):
+        self.write(b'aaaabbbbcccc')
+        self.migration().checkpoint()
+        self.write(b'aaaab')
+        self.migration().checkpoint()
+        self.write(b'aaaabbbbcccc')
+        self.migration().restore()
+        assert self.read() == b'aaaab'
+
+    def test_truncated_during_checkpoint(self):
+        self.write(b'aaaabbbbcccc')
+        chunk_hashes = ocf.migrate._chunk_hashes
+
+        def truncate(f, chunk_size):
+            hashes = chunk_hashes(f, chunk_size)
+            self.write(b'aaaab')
+            return hashes
+
+        ocf.migrate._chunk_hashes = truncate
+        self.addCleanup(setattr, ocf.migrate, '_chunk_hashes', chunk_hashes)
+        self.assertRaises(IOError, self.migration().checkpoint)
+        assert self.migration().restore() is None
+
+    def test_short_copy(self):
+        self.write(b'aaaab')
+        out = os.path.join(self.tmpdir, 'out')
+        with open(self.data, 'rb') as src, open(out, 'wb') as dst:
+            self.assertRaises(IOError, ocf.migrate._copy_range,
+                              src, dst, 4, 4)
+        self.assertRaises(IOError, ocf.migrate._copy_range,
+                          io.BytesIO(b'aaaab'), io.BytesIO(), 4, 4)
+
+    def test_no_checkpoint(self):
+        assert self.migration().restore() is None
+
+    def test_discard(self):
+        self.write(b'aaaa')
+        migration = self.migration()
+        migration.checkpoint()
+        migration.discard()
+        assert not os.path.exists(os.path.join(self.transfer, 'test'))
@@ -0,0 +1,355 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Monitoring daemons through their PID files, without running any programs.
+
+The most common way for a resource agent to find out whether its daemon is
+running is to read a PID file and check whether that process is alive. Done
+naively this is unreliable, because the PID may since have been reused by an
+unrelated process. :class:`PidFile` checks liveness with ``kill(pid, 0)`` and
+then verifies the process's identity against its start time (from
+``/proc/<pid>/stat``) and executable, which are recorded in a small ``.ident``
+file next to the PID file. The PID file itself keeps the conventional format
+so that other tools can still use it.
+
+:class:`PidFileMixin` builds ``monitor`` and ``stop`` actions on top of this.
+"""
+
+import errno
+import ocf
+import ocf.wait
+import os
+import signal
+
+from ocf.proc import read_stat
+from ocf.ra import Action, ResourceAgent
+from ocf.util import atomic_write
+
+
+def _exe_path(path):
+    # The kernel appends " (deleted)" if the executable has been replaced, for
+    # example by a package upgrade, since the process was started
+    if path is not None and path.endswith(' (deleted)'):
+        return path[:-10]
+    return path
+
+
+def pid_exists(pid):
+    """
+    Tests whether process ``pid`` exists using ``kill(pid, 0)``.
+    """
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        # EPERM means the process exists but belongs to somebody else
+        return e.errno == errno.EPERM
+    return True
+
+
+class StillRunning(Exception):
+    """
+    Raised by :meth:`PidFile.stop` when the process could not be stopped.
+    """
+
+
+class PidFile(object):
+    """
+    A PID file, along with the identity of the process it refers to.
+
+    :param str path: Path to the PID file.
+    :param str exe: Path to the executable the process is expected to be
+      running. Optional; if given, processes running anything else are not
+      considered to be ours, even if no identity was recorded.
+
+    Usage::
+
+        pidfile = ocf.pidfile.PidFile('/run/food.pid', exe='/usr/sbin/food')
+
+        # After starting the daemon, remember who it is
+        pidfile.record()
+
+        if pidfile.running_pid() is None:
+            return ocf.OCF_NOT_RUNNING
+    """
+    def __init__(self, path, exe=None):
+        self.path = path
+        self.exe = exe
+
+    @property
+    def ident_path(self):
+        """
+        Path to the file recording the identity of the process.
+        """
+        return self.path + '.ident'
+
+    def read_pid(self):
+        """
+        Returns the PID from the PID file, or ``None`` if there is no PID file
+        or it does not contain a valid PID.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                pid = int(f.read(64).split()[0])
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+        return pid if pid > 0 else None
+
+    def read_ident(self):
+        """
+        Returns the ``(pid, starttime, exe)`` recorded by :meth:`record`, or
+        ``None``. ``exe`` may be ``None`` if it could not be determined.
+        """
+        try:
+            with open(self.ident_path, 'rb') as f:
+                fields = f.read(4096).decode('utf-8', 'replace').split(
+                    '\n', 2)
+            pid, starttime = int(fields[0]), int(fields[1])
+        except (IOError, OSError, IndexError, ValueError):
+            return None
+
+        exe = fields[2].rstrip('\n') if len(fields) > 2 else ''
+        return pid, starttime, exe or None
+
+    def write(self, pid):
+        """
+        Writes ``pid`` to the PID file and records the process's identity.
+
+        Use this if the agent starts a process that does not write its own PID
+        file.
+        """
+        atomic_write(self.path, "{pid}\n".format(pid=pid).encode('utf-8'))
+        self.record(pid)
+
+    def record(self, pid=None):
+        """
+        Records the identity of the process named in the PID file.
+
+        Call this once the daemon has been started and has written its PID
+        file, if it does so itself. ``pid`` defaults to the PID in the PID
+        file. Returns ``False`` if the process could not be found.
+        """
+        if pid is None:
+            pid = self.read_pid()
+            if pid is None:
+                return False
+
+        stat = read_stat(pid)
+        if stat is None:
+            return False
+
+        try:
+            exe = _exe_path(os.readlink('/proc/{pid}/exe'.format(pid=pid)))
+        except OSError:
+            exe = ''
+
+        data = "{pid}\n{start}\n{exe}\n".format(
+            pid=pid, start=stat[1], exe=exe)
+        atomic_write(self.ident_path, data.encode('utf-8'))
+        return True
+
+    def remove(self):
+        """
+        Removes the PID file and the recorded identity.
+        """
+        for path in (self.path, self.ident_path):
+            try:
+                os.unlink(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def exists(self):
+        """
+        Tests whether the PID file exists.
+        """
+        return os.path.exists(self.path)
+
+    def running_pid(self):
+        """
+        Returns the PID of the process if it is running, or ``None``.
+
+        The process is only considered to be running if it exists, is not a
+        zombie, and its start time and executable match those recorded by
+        :meth:`record` (or ``exe`` given to the constructor).
+        """
+        pid = self.read_pid()
+        if pid is None or not pid_exists(pid):
+            return None
+
+        stat = read_stat(pid)
+        if stat is None or stat[0] in 'ZX':
+            return None
+
+        exe = self.exe
+        ident = self.read_ident()
+        if ident is not None and ident[0] == pid:
+            if ident[1] != stat[1]:
+                ocf.log.debug("PID {pid} has been reused".format(pid=pid))
+                return None
+            exe = exe or ident[2]
+
+        if exe is not None:
+            try:
+                actual = os.readlink('/proc/{pid}/exe'.format(pid=pid))
+            except OSError:
+                # We can't see the executable of other users' processes
+                # unless we're root; give it the benefit of the doubt
+                actual = None
+
+            # Compare resolved paths, so that /bin/foo matches /usr/bin/foo
+            # where /bin is a link to /usr/bin
+            if actual is not None and os.path.realpath(_exe_path(actual)) != \
+                    os.path.realpath(exe):
+                ocf.log.debug("PID {pid} is running {actual}, not {exe}"
+                              .format(pid=pid, actual=actual, exe=exe))
+                return None
+
+        return pid
+
+    def is_running(self):
+        """
+        Tests whether the process is running. See :meth:`running_pid`.
+        """
+        return self.running_pid() is not None
+
+    def stop(self, timeout=None, sig=signal.SIGTERM, interval=0.1):
+        """
+        Stops the process, if it is running, and removes the PID file.
+
+        ``sig`` is sent to the process, which is then given ``timeout`` seconds
+        to exit before it is sent ``SIGKILL``. Returns ``True`` if the process
+        exited (or was not running) before it had to be killed, and ``False``
+        if it had to be killed.
+
+        :param float timeout: Seconds to wait before sending ``SIGKILL``.
+          Defaults to 80% of the action's timeout
+          (:attr:`ocf.environment.Environment.timeout`), or 10 seconds.
+        :raises StillRunning: if the process survives even ``SIGKILL``. The
+          PID file is kept in that case.
+        """
+        pid = self.running_pid()
+        if pid is None:
+            self.remove()
+            return True
+        started = read_stat(pid)
+
+        if timeout is None:
+            timeout = (ocf.env.timeout or 12.5) * 0.8
+
+        graceful = self._signal_and_wait(pid, sig, timeout, interval)
+        if not graceful:
+            ocf.log.warning("PID {pid} did not exit after {t:.1f}s; "
+                            "killing it".format(pid=pid, t=timeout))
+            self._signal_and_wait(pid, signal.SIGKILL, None, interval)
+
+        # Make sure it's gone, and hasn't just been replaced by a new process
+        stat = read_stat(pid)
+        if started is not None and stat is not None and \
+                stat[0] not in 'ZX' and stat[1] == started[1]:
+            raise StillRunning("PID {pid} is still running".format(pid=pid))
+
+        self.remove()
+        return graceful
+
+    def _signal_and_wait(self, pid, sig, timeout, interval):
+        try:
+            os.kill(pid, sig)
+        except OSError as e:
+            if e.errno == errno.ESRCH:
+                return True
+            raise
+
+        return ocf.wait.wait_for_process_exit(
+            pid, timeout, max_interval=interval)
+
+
+class PidFileMixin(ResourceAgent):
+    """
+    Supplies default ``monitor`` and ``stop`` actions based on a PID file.
+
+    Resource agents managing a single daemon which writes a PID file can use
+    this class as a base class instead of (or as well as)
+    :class:`ocf.ra.ResourceAgent`. The agent must provide a ``pidfile``
+    attribute (usually an :class:`ocf.ra.Parameter`) with the path to the PID
+    file, and may declare an ``EXECUTABLE`` attribute with the path to the
+    daemon's executable. Its ``start`` action should call
+    ``self.pid_file.record()`` once the daemon has written its PID file.
+
+    Usage::
+
+        class FooAgent(ocf.pidfile.PidFileMixin):
+            \"\"\"
+            Foo daemon
+
+            Manages the foo daemon.
+            \"\"\"
+            EXECUTABLE = '/usr/sbin/food'
+
+            pidfile = ocf.Parameter(
+                shortdesc='PID file', longdesc='Path to the PID file.',
+                default='/run/food.pid')
+
+            @ocf.Action(timeout=20)
+            def start(self):
+                ...
+                self.pid_file.record()
+                return ocf.OCF_SUCCESS
+    """
+    @property
+    def pid_file(self):
+        """
+        The :class:`PidFile` for the agent's daemon.
+        """
+        return PidFile(self.pidfile, exe=getattr(self, 'EXECUTABLE', None))
+
+    @Action(timeout=20, depth=0, interval=10)
+    def monitor(self):
+        """
+        Returns :data:`ocf.OCF_SUCCESS` if the daemon is running.
+
+        If it is not, returns :data:`ocf.OCF_NOT_RUNNING` if there is no PID
+        file or during a probe, and :data:`ocf.OCF_ERR_GENERIC` if the PID
+        file is stale (the daemon has died).
+        """
+        pid_file = self.pid_file
+        if pid_file.is_running():
+            return ocf.OCF_SUCCESS
+
+        if not pid_file.exists() or ocf.env.is_probe:
+            return ocf.OCF_NOT_RUNNING
+
+        ocf.log.error("Stale PID file {path}".format(path=pid_file.path))
+        return ocf.OCF_ERR_GENERIC
+
+    @Action(timeout=20)
+    def stop(self):
+        """
+        Stops the daemon, killing it if it does not exit in time.
+
+        Returns :data:`ocf.OCF_ERR_GENERIC` if the daemon is still running
+        even so, so that the CRM doesn't start it anywhere else.
+        """
+        try:
+            self.pid_file.stop()
+        except StillRunning as e:
+            ocf.log.error(str(e))
+            return ocf.OCF_ERR_GENERIC
+        return ocf.OCF_SUCCESS
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
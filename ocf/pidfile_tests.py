@@ -0,0 +1,182 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf
+import ocf.pidfile
+import ocf.proc
+import ocf.testing
+import ocf.wait
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+PYTHON = os.path.realpath(sys.executable)
+
+IGNORE_TERM = ("import signal, time; "
+               "signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+               "print('ready'); time.sleep(30)")
+
+
+class DaemonAgent(ocf.pidfile.PidFileMixin):
+    """
+    Test agent
+
+    Monitors a process through its PID file.
+    """
+    EXECUTABLE = PYTHON
+
+    pidfile = ocf.Parameter(
+        shortdesc='PID file', longdesc='Path to the PID file.', required=True)
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+
+class PidFileTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.pid')
+        self.procs = []
+
+    def tearDown(self):
+        # Undo any stubs before cleaning up the processes
+        self.doCleanups()
+        for proc in self.procs:
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+        shutil.rmtree(self.tmpdir)
+
+    def spawn(self, script='import time; time.sleep(30)'):
+        proc = subprocess.Popen([PYTHON, '-c', script], stdout=subprocess.PIPE)
+        self.procs.append(proc)
+        if 'ready' in script:
+            proc.stdout.readline()
+        return proc
+
+    def test_running_pid(self):
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path, exe=PYTHON)
+        assert pidfile.running_pid() is None
+
+        pidfile.write(proc.pid)
+        assert pidfile.running_pid() == proc.pid
+
+        proc.kill()
+        proc.wait()
+        assert pidfile.running_pid() is None
+
+    def test_exe_through_symlink(self):
+        # As on merged-/usr systems, where /bin links to /usr/bin
+        link = os.path.join(self.tmpdir, 'bin')
+        os.symlink(os.path.dirname(PYTHON), link)
+        exe = os.path.join(link, os.path.basename(PYTHON))
+
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path, exe=exe)
+        pidfile.write(proc.pid)
+        assert pidfile.running_pid() == proc.pid
+
+    def test_wrong_exe(self):
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path, exe='/usr/sbin/food')
+        pidfile.write(proc.pid)
+        assert pidfile.running_pid() is None
+
+    def test_reused_pid(self):
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path)
+        pidfile.write(proc.pid)
+
+        # Pretend the process we recorded started at another time
+        pid, starttime, exe = pidfile.read_ident()
+        with open(pidfile.ident_path, 'w') as f:
+            f.write("{0}\n{1}\n{2}\n".format(pid, starttime + 1, exe))
+        assert pidfile.running_pid() is None
+
+    def test_stop(self):
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path, exe=PYTHON)
+        pidfile.write(proc.pid)
+
+        assert pidfile.stop(timeout=5)
+        assert ocf.proc.exited(proc.pid)
+        assert not pidfile.exists()
+
+    def test_stop_kills(self):
+        proc = self.spawn(IGNORE_TERM)
+        pidfile = ocf.pidfile.PidFile(self.path, exe=PYTHON)
+        pidfile.write(proc.pid)
+
+        assert not pidfile.stop(timeout=0.2)
+        assert ocf.proc.exited(proc.pid)
+        assert not pidfile.exists()
+
+    def test_stop_survivor(self):
+        proc = self.spawn()
+        pidfile = ocf.pidfile.PidFile(self.path, exe=PYTHON)
+        pidfile.write(proc.pid)
+        self.unkillable()
+
+        with self.assertRaises(ocf.pidfile.StillRunning):
+            pidfile.stop(timeout=0.1)
+        assert pidfile.exists()
+
+        agent = ocf.testing.AgentRunner(
+            DaemonAgent, rsctmp=self.tmpdir, reskey={'pidfile': self.path})
+        assert agent.run('stop').code == ocf.OCF_ERR_GENERIC
+        assert pidfile.exists()
+
+    def unkillable(self):
+        # Make every signal sent by PidFile.stop() go unheeded
+        def kill(pid, sig):
+            pass
+
+        def wait_for_process_exit(pid, timeout, max_interval=None):
+            return False
+
+        for obj, name, value in ((os, 'kill', kill),
+                                 (ocf.wait, 'wait_for_process_exit',
+                                  wait_for_process_exit)):
+            self.addCleanup(setattr, obj, name, getattr(obj, name))
+            setattr(obj, name, value)
+
+    def test_mixin(self):
+        agent = ocf.testing.AgentRunner(
+            DaemonAgent, rsctmp=self.tmpdir, reskey={'pidfile': self.path,
+                                                     'CRM_meta_interval': 10})
+        assert agent.run('monitor').code == ocf.OCF_NOT_RUNNING
+
+        proc = self.spawn()
+        ocf.pidfile.PidFile(self.path).write(proc.pid)
+        assert agent.run('monitor').code == ocf.OCF_SUCCESS
+
+        assert agent.run('stop').code == ocf.OCF_SUCCESS
+        assert ocf.proc.exited(proc.pid)
+        assert agent.run('monitor').code == ocf.OCF_NOT_RUNNING
+
+        # A PID file left behind by a process which died is an error, except
+        # during a probe
+        ocf.pidfile.PidFile(self.path).write(proc.pid)
+        proc.wait()
+        assert agent.run('monitor').code == ocf.OCF_ERR_GENERIC
+        assert agent.run('monitor', reskey={
+            'CRM_meta_interval': 0}).code == ocf.OCF_NOT_RUNNING
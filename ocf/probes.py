@@ -0,0 +1,657 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Non-blocking network health checks for ``monitor`` actions.
+
+Monitors for network services usually check that the service answers: that a
+TCP port accepts connections, that a TLS handshake succeeds, that an HTTP
+request returns the right status, and so on. This module provides probes for
+each of these which all run concurrently within a single :mod:`selectors` loop
+by :func:`run`, so checking several endpoints takes as long as the slowest of
+them rather than the sum. All probes share the action's deadline
+(:attr:`ocf.environment.Environment.deadline`), and each result records the
+probe's latency.
+
+Usage::
+
+    results = ocf.probes.run([
+        ocf.probes.TCPProbe('localhost', 5432),
+        ocf.probes.HTTPProbe('localhost', 8080, path='/health'),
+        ocf.probes.UnixProbe('/run/food.sock', request=b'PING\\n',
+                             expect=br'^PONG'),
+    ], timeout=5)
+
+    for r in results:
+        if not r.ok:
+            ocf.log.error("{name} failed: {error}".format(**r._asdict()))
+            return ocf.OCF_ERR_GENERIC
+
+Host names are resolved once per invocation and then reused. Each is resolved
+in a thread of its own, so that a slow name server counts against the probe's
+deadline like anything else.
+
+On Python 2, this module needs the ``selectors34`` backport of
+:mod:`selectors`.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import errno
+import ocf
+import re
+import socket
+import ssl
+import threading
+import types
+
+from ocf.util import monotonic
+
+try:
+    import selectors
+except ImportError:  # Python 2
+    import selectors34 as selectors
+
+#: Result of running a probe, as returned by :func:`run`. ``ok`` is whether
+#: the probe succeeded, ``latency`` how long it took in seconds, ``value`` a
+#: probe-specific result (such as the HTTP status) and ``error`` a description
+#: of why it failed, or ``None``.
+Result = collections.namedtuple(
+    'Result', ('name', 'ok', 'latency', 'value', 'error'))
+
+_READ = selectors.EVENT_READ
+_WRITE = selectors.EVENT_WRITE
+
+# getaddrinfo() results already obtained by this process
+_dns_cache = {}
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    _dns_cache.clear()
+
+
+class ProbeError(Exception):
+    """
+    Raised within a probe to make it fail with the given message.
+    """
+
+
+class Return(object):
+    """
+    Yielded by a probe's generator to finish with ``value``, which is sent to
+    the generator that called it, or becomes the probe's value. This stands
+    in for ``return value``, which Python 2 does not allow in a generator.
+    """
+    def __init__(self, value=None):
+        self.value = value
+
+
+def resolve(host, port, family=socket.AF_UNSPEC):
+    """
+    Resolve ``host`` and ``port`` using :func:`socket.getaddrinfo`.
+
+    Results are remembered for the rest of the invocation.
+    """
+    key = (host, port, family)
+    try:
+        return _dns_cache[key]
+    except KeyError:
+        pass
+
+    result = _dns_cache[key] = socket.getaddrinfo(
+        host, port, family, socket.SOCK_STREAM)
+    return result
+
+
+def _resolve(probe, host, port):
+    """
+    Generator resolving ``host`` and ``port`` with :func:`resolve` in another
+    thread, so that the loop can carry on (and give up) meanwhile.
+    """
+    key = (host, port, socket.AF_UNSPEC)
+    if key in _dns_cache:
+        yield Return(_dns_cache[key])
+        return
+
+    result = {}
+    wake, notify = socket.socketpair()
+    probe.sockets.append(wake)
+
+    def lookup():
+        try:
+            result['addresses'] = resolve(host, port)
+        except Exception as e:
+            result['error'] = e
+        try:
+            notify.send(b'\0')
+        except socket.error:
+            pass  # the probe has given up already
+        finally:
+            notify.close()
+
+    thread = threading.Thread(target=lookup, name="resolve {host}".format(
+        host=host))
+    thread.daemon = True
+    thread.start()
+
+    yield wake, _READ
+    if 'error' in result:
+        raise result['error']
+    yield Return(result['addresses'])
+
+
+def _blocked(e):
+    return e.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+
+
+def _connect(sock, address):
+    err = sock.connect_ex(address)
+    if err in (errno.EINPROGRESS, errno.EAGAIN, errno.EWOULDBLOCK):
+        yield sock, _WRITE
+        err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    if err != 0:
+        raise socket.error(err, errno.errorcode.get(err, str(err)))
+
+
+def _sendall(sock, data):
+    view = memoryview(data)
+    while len(view):
+        try:
+            view = view[sock.send(view):]
+        except ssl.SSLWantWriteError:
+            yield sock, _WRITE
+        except ssl.SSLWantReadError:
+            yield sock, _READ
+        except socket.error as e:
+            if not _blocked(e):
+                raise
+            yield sock, _WRITE
+
+
+def _recv_until(sock, done, max_bytes):
+    data = b''
+    while not done(data) and len(data) < max_bytes:
+        try:
+            chunk = sock.recv(max_bytes - len(data))
+        except ssl.SSLWantReadError:
+            yield sock, _READ
+            continue
+        except ssl.SSLWantWriteError:
+            yield sock, _WRITE
+            continue
+        except socket.error as e:
+            if not _blocked(e):
+                raise
+            yield sock, _READ
+            continue
+
+        if not chunk:
+            break
+        data += chunk
+
+    yield Return(data)
+
+
+class Probe(object):
+    """
+    Base class for probes run by :func:`run`.
+
+    Sub-classes implement :meth:`check` as a generator which yields
+    ``(socket, events)`` pairs whenever it needs to wait for a socket to be
+    ready, and finally yields :class:`Return` with the probe's value. It may
+    also yield another such generator, to run it and be sent its value.
+    Raising an exception fails the probe.
+
+    :param str name: Name of the probe, used in its :data:`Result`. Optional;
+      a description of the probe is used if not given.
+    :param float timeout: Maximum number of seconds the probe may take.
+      Optional; limited only by the deadline given to :func:`run` if not
+      given.
+    """
+    def __init__(self, name=None, timeout=None):
+        self.name = name or self.describe()
+        self.timeout = timeout
+        self.sockets = []
+
+    def describe(self):
+        """
+        Returns a description of the probe, used as its default name.
+        """
+        return self.__class__.__name__
+
+    def socket(self, family, type=socket.SOCK_STREAM):
+        """
+        Creates a non-blocking socket which is closed after the probe.
+        """
+        sock = socket.socket(family, type)
+        sock.setblocking(False)
+        self.sockets.append(sock)
+        return sock
+
+    def close(self):
+        """
+        Closes the sockets created by :meth:`socket`.
+        """
+        for sock in self.sockets:
+            sock.close()
+        self.sockets = []
+
+    def check(self):
+        raise NotImplementedError
+
+
+class TCPProbe(Probe):
+    """
+    Checks that a TCP connection to ``host`` and ``port`` can be established.
+
+    Every address ``host`` resolves to is tried in turn until one succeeds.
+    The value of a successful probe is the connected socket's peer address.
+    """
+    def __init__(self, host, port, name=None, timeout=None):
+        self.host = host
+        self.port = port
+        super(TCPProbe, self).__init__(name, timeout)
+
+    def describe(self):
+        return "tcp://{host}:{port}".format(host=self.host, port=self.port)
+
+    def connect(self):
+        """
+        Generator connecting to the service; gives the connected socket.
+        """
+        addresses = yield _resolve(self, self.host, self.port)
+
+        error = None
+        for family, type, proto, _, address in addresses:
+            sock = self.socket(family, type)
+            try:
+                yield _connect(sock, address)
+            except socket.error as e:
+                error = e
+            else:
+                yield Return(sock)
+                return
+
+        raise error or ProbeError("no addresses for {host}".format(
+            host=self.host))
+
+    def check(self):
+        sock = yield self.connect()
+        yield Return(sock.getpeername())
+
+
+class TLSProbe(TCPProbe):
+    """
+    Checks that a TLS handshake with ``host`` and ``port`` succeeds.
+
+    :param context: The :class:`ssl.SSLContext` to use. Optional; defaults to
+      :func:`ssl.create_default_context`, which verifies the server's
+      certificate.
+    :param str server_hostname: Name to use for SNI and certificate checks.
+      Defaults to ``host``.
+
+    The value of a successful probe is the negotiated TLS version.
+    """
+    def __init__(self, host, port, context=None, server_hostname=None,
+                 name=None, timeout=None):
+        self.context = context
+        self.server_hostname = server_hostname or host
+        super(TLSProbe, self).__init__(host, port, name, timeout)
+
+    def describe(self):
+        return "tls://{host}:{port}".format(host=self.host, port=self.port)
+
+    def connect(self):
+        sock = yield super(TLSProbe, self).connect()
+
+        context = self.context or ssl.create_default_context()
+        sock = context.wrap_socket(
+            sock, server_hostname=self.server_hostname,
+            do_handshake_on_connect=False)
+        self.sockets.append(sock)
+
+        while True:
+            try:
+                sock.do_handshake()
+            except ssl.SSLWantReadError:
+                yield sock, _READ
+            except ssl.SSLWantWriteError:
+                yield sock, _WRITE
+            else:
+                yield Return(sock)
+                return
+
+    def check(self):
+        sock = yield self.connect()
+        yield Return(sock.version())
+
+
+class HTTPProbe(Probe):
+    """
+    Checks that an HTTP request returns an expected status code.
+
+    :param str host: Host to connect to.
+    :param int port: Port to connect to.
+    :param str path: Path to request.
+    :param str method: HTTP method to use.
+    :param expect: Status code, or collection of status codes, that indicate
+      success. Defaults to any ``2xx`` or ``3xx`` status.
+    :param bool tls: Whether to use HTTPS.
+    :param context: :class:`ssl.SSLContext` to use with ``tls``.
+
+    The value of the probe is the status code, even if it is not expected.
+    """
+    def __init__(self, host, port, path='/', method='GET', expect=None,
+                 tls=False, context=None, name=None, timeout=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.method = method
+        self.expect = expect
+        self.tls = tls
+
+        if tls:
+            self.transport = TLSProbe(host, port, context=context)
+        else:
+            self.transport = TCPProbe(host, port)
+
+        super(HTTPProbe, self).__init__(name, timeout)
+
+    def describe(self):
+        return "{scheme}://{host}:{port}{path}".format(
+            scheme='https' if self.tls else 'http', host=self.host,
+            port=self.port, path=self.path)
+
+    def _expected(self, status):
+        if self.expect is None:
+            return 200 <= status < 400
+        elif isinstance(self.expect, int):
+            return status == self.expect
+        else:
+            return status in self.expect
+
+    def check(self):
+        # Share the transport's sockets so that they are closed with us
+        self.transport.sockets = self.sockets
+        sock = yield self.transport.connect()
+
+        request = ("{method} {path} HTTP/1.0\r\nHost: {host}\r\n"
+                   "Connection: close\r\n\r\n").format(
+            method=self.method, path=self.path, host=self.host)
+        yield _sendall(sock, request.encode('ascii'))
+
+        data = yield _recv_until(sock, lambda d: b'\r\n' in d, 4096)
+        line = data.split(b'\r\n', 1)[0].decode('iso-8859-1')
+        match = re.match(r'^HTTP/\d\.\d (\d{3})', line)
+        if not match:
+            raise ProbeError("invalid HTTP response: {line!r}".format(
+                line=line))
+
+        status = int(match.group(1))
+        if not self._expected(status):
+            raise ProbeError("unexpected HTTP status {status}".format(
+                status=status), status)
+        yield Return(status)
+
+
+class _ResponseProbe(Probe):
+    def __init__(self, request, expect, max_bytes, name, timeout):
+        self.request = request
+        self.expect = expect
+        self.max_bytes = max_bytes
+
+        if expect is not None and not hasattr(expect, 'search'):
+            self.expect = re.compile(expect)
+
+        super(_ResponseProbe, self).__init__(name, timeout)
+
+    def connect(self):
+        raise NotImplementedError
+
+    def check(self):
+        sock = yield self.connect()
+
+        if self.request:
+            yield _sendall(sock, self.request)
+
+        if self.expect is None:
+            done = bool
+        else:
+            done = self.expect.search
+
+        data = yield _recv_until(sock, done, self.max_bytes)
+        if self.expect is not None and not self.expect.search(data):
+            raise ProbeError("unexpected response: {data!r}".format(
+                data=data[:80]), data)
+        yield Return(data)
+
+
+class UnixProbe(_ResponseProbe):
+    """
+    Sends a request over a Unix domain socket and checks the response.
+
+    :param str path: Path to the socket.
+    :param bytes request: Data to send once connected. Optional.
+    :param expect: Regular expression (bytes or compiled) which the response
+      must match. Reading stops as soon as it matches. Optional; if not given,
+      the probe succeeds as soon as any data is received (or the connection
+      is closed).
+    :param int max_bytes: Maximum number of bytes of response to read.
+
+    The value of a successful probe is the response received.
+    """
+    def __init__(self, path, request=None, expect=None, max_bytes=4096,
+                 name=None, timeout=None):
+        self.path = path
+        super(UnixProbe, self).__init__(
+            request, expect, max_bytes, name, timeout)
+
+    def describe(self):
+        return "unix://{path}".format(path=self.path)
+
+    def connect(self):
+        sock = self.socket(socket.AF_UNIX)
+        yield _connect(sock, self.path)
+        yield Return(sock)
+
+
+class BannerProbe(_ResponseProbe):
+    """
+    Connects to ``host`` and ``port`` and checks the greeting the server
+    sends (such as an SMTP, FTP or SSH banner).
+
+    :param expect: Regular expression (bytes or compiled) which the banner
+      must match.
+    :param bytes request: Data to send before reading the banner. Optional.
+    :param int max_bytes: Maximum number of bytes of banner to read.
+
+    The value of a successful probe is the banner received.
+    """
+    def __init__(self, host, port, expect, request=None, max_bytes=1024,
+                 name=None, timeout=None):
+        self.transport = TCPProbe(host, port)
+        super(BannerProbe, self).__init__(
+            request, expect, max_bytes, name, timeout)
+
+    def describe(self):
+        return "banner:" + self.transport.describe()
+
+    def connect(self):
+        self.transport.sockets = self.sockets
+        return self.transport.connect()
+
+
+def _error(e):
+    if isinstance(e, ProbeError):
+        return str(e.args[0])
+    if isinstance(e, socket.error) and e.strerror:
+        return e.strerror
+    return str(e) or e.__class__.__name__
+
+
+class _Task(object):
+    """
+    Runs a probe's generator, along with the generators it yields in turn.
+    """
+    def __init__(self, gen):
+        self.stack = [gen]
+
+    def step(self):
+        """
+        Runs the generators until they have to wait, and returns the
+        ``(socket, events)`` to wait for, or the final :class:`Return`. Raises
+        whatever exception the probe fails with.
+        """
+        value, error = None, None
+        while True:
+            gen = self.stack[-1]
+            try:
+                if error is not None:
+                    item = gen.throw(error)
+                else:
+                    item = gen.send(value)
+            except StopIteration as e:
+                # A plain "return value" on Python 3
+                item = Return(getattr(e, 'value', None))
+            except Exception as e:
+                self.stack.pop()
+                if not self.stack:
+                    raise
+                # Pass it on to the generator which called this one
+                value, error = None, e
+                continue
+
+            value, error = None, None
+            if isinstance(item, types.GeneratorType):
+                self.stack.append(item)
+            elif isinstance(item, Return):
+                gen.close()
+                self.stack.pop()
+                if not self.stack:
+                    return item
+                value = item.value
+            else:
+                return item
+
+    def close(self):
+        while self.stack:
+            self.stack.pop().close()
+
+
+def run(probes, timeout=None, margin=1.0):
+    """
+    Runs ``probes`` concurrently and returns a list of their results.
+
+    :param probes: The :class:`Probe` instances to run.
+    :param float timeout: Maximum number of seconds to wait for all the
+      probes. Optional.
+    :param float margin: Number of seconds before the action's deadline
+      (:attr:`ocf.environment.Environment.deadline`) by which the probes must
+      be finished, leaving the agent time to act on the results.
+
+    The results are in the same order as ``probes``. Probes that have not
+    finished when the deadline is reached fail with a timeout error.
+    """
+    start = monotonic()
+    deadline = None if timeout is None else start + timeout
+    if ocf.env.deadline is not None:
+        action_deadline = ocf.env.deadline - margin
+        deadline = action_deadline if deadline is None else \
+            min(deadline, action_deadline)
+
+    results = [None] * len(probes)
+    pending = {}  # index -> (task, deadline)
+    selector = selectors.DefaultSelector()
+
+    def finish(index, ok, value=None, error=None):
+        probe = probes[index]
+        results[index] = Result(probe.name, ok, monotonic() - start, value,
+                                error)
+        pending.pop(index, None)
+        probe.close()
+
+    def advance(index, task):
+        # Run the probe until it has to wait, then wait for its socket
+        try:
+            item = task.step()
+        except Exception as e:
+            value = e.args[1] if isinstance(e, ProbeError) and \
+                len(e.args) > 1 else None
+            finish(index, False, value=value, error=_error(e))
+        else:
+            if isinstance(item, Return):
+                finish(index, True, value=item.value)
+            else:
+                sock, events = item
+                selector.register(sock, events, index)
+
+    try:
+        for index, probe in enumerate(probes):
+            probe_deadline = deadline
+            if probe.timeout is not None:
+                probe_deadline = start + probe.timeout if deadline is None \
+                    else min(deadline, start + probe.timeout)
+
+            task = _Task(probe.check())
+            pending[index] = (task, probe_deadline)
+            advance(index, task)
+
+        while pending:
+            now = monotonic()
+
+            # Fail any probes that have run out of time
+            for index, (task, probe_deadline) in list(pending.items()):
+                if probe_deadline is not None and now >= probe_deadline:
+                    _unregister(selector, probes[index])
+                    task.close()
+                    finish(index, False, error='timed out')
+
+            if not pending:
+                break
+
+            deadlines = [d for _, d in pending.values() if d is not None]
+            wait = max(0, min(deadlines) - now) if deadlines else None
+
+            for key, _ in selector.select(wait):
+                index = key.data
+                selector.unregister(key.fileobj)
+                if index in pending:
+                    advance(index, pending[index][0])
+    finally:
+        for index in list(pending):
+            pending[index][0].close()
+            probes[index].close()
+        selector.close()
+
+    for result in results:
+        ocf.log.debug("Probe {r.name}: {state} in {r.latency:.3f}s".format(
+            r=result, state='ok' if result.ok else result.error))
+
+    return results
+
+
+def _unregister(selector, probe):
+    for sock in probe.sockets:
+        try:
+            selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
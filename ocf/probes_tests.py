@@ -0,0 +1,147 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.probes
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+
+
+class LoopbackServer(object):
+    """
+    Accepts connections in a thread, optionally sends a greeting, then replies
+    to the first chunk of data received with ``reply``.
+    """
+    def __init__(self, family=socket.AF_INET, address=('127.0.0.1', 0),
+                 greeting=None, reply=None):
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.bind(address)
+        self.sock.listen(5)
+        self.address = self.sock.getsockname()
+        self.greeting = greeting
+        self.reply = reply
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except socket.error:
+                return
+            try:
+                if self.greeting:
+                    conn.sendall(self.greeting)
+                if self.reply is not None and conn.recv(4096):
+                    conn.sendall(self.reply)
+            finally:
+                conn.close()
+
+    def close(self):
+        self.sock.close()
+
+
+class ProbesTests(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for server in self.servers:
+            server.close()
+        shutil.rmtree(self.tmpdir)
+
+    def server(self, **kwargs):
+        server = LoopbackServer(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_tcp(self):
+        server = self.server()
+        ok, refused = ocf.probes.run([
+            ocf.probes.TCPProbe('127.0.0.1', server.address[1]),
+            ocf.probes.TCPProbe('127.0.0.1', self.closed_port()),
+        ], timeout=5)
+        assert ok.ok and ok.latency >= 0
+        assert not refused.ok and refused.error
+
+    def test_http(self):
+        server = self.server(reply=b'HTTP/1.0 503 Unavailable\r\n\r\n')
+        port = server.address[1]
+        bad, good = ocf.probes.run([
+            ocf.probes.HTTPProbe('127.0.0.1', port),
+            ocf.probes.HTTPProbe('127.0.0.1', port, expect=503),
+        ], timeout=5)
+        assert not bad.ok and bad.value == 503
+        assert good.ok and good.value == 503
+
+    def test_unix(self):
+        path = os.path.join(self.tmpdir, 'sock')
+        self.server(family=socket.AF_UNIX, address=path, reply=b'PONG\n')
+        result, = ocf.probes.run([
+            ocf.probes.UnixProbe(path, request=b'PING\n', expect=b'^PONG'),
+        ], timeout=5)
+        assert result.ok and result.value == b'PONG\n'
+
+    def test_banner(self):
+        server = self.server(greeting=b'220 smtp.example.com ESMTP\r\n')
+        port = server.address[1]
+        good, bad = ocf.probes.run([
+            ocf.probes.BannerProbe('127.0.0.1', port, expect=b'^220 '),
+            ocf.probes.BannerProbe('127.0.0.1', port, expect=b'^SSH-'),
+        ], timeout=5)
+        assert good.ok
+        assert not bad.ok
+
+    def test_timeout(self):
+        # A server which never replies
+        server = self.server(reply=b'')
+        result, = ocf.probes.run([
+            ocf.probes.BannerProbe('127.0.0.1', server.address[1],
+                                   expect=b'x', timeout=0.1),
+        ], timeout=5)
+        assert not result.ok and result.error == 'timed out'
+
+    def test_slow_resolution(self):
+        # A name server which never answers
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def getaddrinfo(*args):
+            released.wait(5)
+            raise socket.gaierror(socket.EAI_AGAIN, 'no answer')
+
+        real_getaddrinfo = socket.getaddrinfo
+        socket.getaddrinfo = getaddrinfo
+        self.addCleanup(setattr, socket, 'getaddrinfo', real_getaddrinfo)
+
+        result, = ocf.probes.run([
+            ocf.probes.TCPProbe('slow.example.com', 80, timeout=0.1),
+        ], timeout=5)
+        assert not result.ok and result.error == 'timed out'
+        assert result.latency < 1
@@ -0,0 +1,354 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Process discovery by scanning ``/proc``, without running ``ps`` or ``pgrep``.
+
+A :class:`ProcessTable` reads ``/proc`` once and indexes the processes found,
+so that any number of look-ups (by name, executable, command line or parent)
+can be made without further system calls. Only the files needed for the
+requested ``fields`` are read:
+
+=============  ========================================
+Field          Source
+=============  ========================================
+``comm``       ``/proc/<pid>/stat``
+``ppid``       ``/proc/<pid>/stat``
+``starttime``  ``/proc/<pid>/stat``
+``uid``        owner of the ``/proc/<pid>`` directory
+``cmdline``    ``/proc/<pid>/cmdline``
+``exe``        target of the ``/proc/<pid>/exe`` link
+=============  ========================================
+
+The ``pid`` field is always present; fields that were not requested, or could
+not be read, are ``None``.
+
+Usage::
+
+    procs = ocf.proc.scan(fields=('comm', 'cmdline'))
+    for p in procs.by_cmdline(r'^/usr/sbin/nginx: master'):
+        ...
+
+:func:`scan` remembers the table for the rest of the invocation, and can share
+it with concurrently running agents through :mod:`ocf.shared_cache`.
+"""
+
+import collections
+import errno
+import ocf.shared_cache
+import os
+import re
+
+#: All the fields that can be requested from :class:`ProcessTable`.
+FIELDS = ('comm', 'ppid', 'starttime', 'uid', 'cmdline', 'exe')
+
+_STAT_FIELDS = frozenset(['comm', 'ppid', 'starttime'])
+
+#: Details of a single process, as returned by :class:`ProcessTable`.
+Process = collections.namedtuple('Process', ('pid',) + FIELDS)
+
+# Errors that mean a process has gone away (or is hidden from us)
+_GONE = (errno.ENOENT, errno.ESRCH)
+
+
+def parse_stat(data):
+    """
+    Parse the contents of a ``/proc/<pid>/stat`` file.
+
+    Returns a tuple of ``(comm, ppid, starttime)``; ``starttime`` is measured
+    in clock ticks since the system booted.
+    """
+    # The command name is in parentheses and may itself contain spaces or
+    # parentheses, so look for the last closing parenthesis.
+    start = data.index('(')
+    end = data.rindex(')')
+    comm = data[start + 1:end]
+    rest = data[end + 2:].split()
+
+    # rest[0] is field 3 (state) of proc(5)
+    return comm, int(rest[1]), int(rest[19])
+
+
+def read_stat(pid):
+    """
+    Returns the ``(state, starttime)`` of process ``pid``, or ``None`` if the
+    process does not exist.
+    """
+    try:
+        with open('/proc/{pid}/stat'.format(pid=pid), 'rb') as f:
+            data = f.read().decode('utf-8', 'replace')
+    except (IOError, OSError) as e:
+        if e.errno in _GONE:
+            return None
+        raise
+
+    state = data[data.rindex(')') + 2]
+    return state, parse_stat(data)[2]
+
+
+def exited(pid):
+    """
+    Tests whether process ``pid`` has exited. A process which has exited but
+    not yet been reaped by its parent (a zombie) counts as having exited.
+    """
+    stat = read_stat(pid)
+    return stat is None or stat[0] in 'ZX'
+
+
+def read_process(pid, fields=FIELDS, proc='/proc'):
+    """
+    Read the requested ``fields`` for process ``pid``.
+
+    Returns a tuple of the process ID followed by the values of :data:`FIELDS`
+    (with ``None`` for fields that were not requested), or ``None`` if the
+    process does not exist.
+    """
+    base = os.path.join(proc, str(pid))
+    comm = ppid = starttime = uid = cmdline = exe = None
+
+    try:
+        if not _STAT_FIELDS.isdisjoint(fields):
+            with open(os.path.join(base, 'stat'), 'rb') as f:
+                comm, ppid, starttime = parse_stat(
+                    f.read().decode('utf-8', 'replace'))
+
+        if 'uid' in fields:
+            uid = os.stat(base).st_uid
+
+        if 'cmdline' in fields:
+            with open(os.path.join(base, 'cmdline'), 'rb') as f:
+                data = f.read().decode('utf-8', 'replace')
+            cmdline = tuple(data.split('\0')[:-1]) if data else ()
+    except (IOError, OSError) as e:
+        if e.errno in _GONE:
+            return None
+        raise
+
+    if 'exe' in fields:
+        try:
+            exe = os.readlink(os.path.join(base, 'exe'))
+        except OSError as e:
+            if e.errno in _GONE and not os.path.exists(base):
+                return None
+            # Kernel threads have no executable, and we may not be allowed to
+            # look at other users' processes
+            exe = None
+
+    return (pid, comm, ppid, starttime, uid, cmdline, exe)
+
+
+class ProcessTable(object):
+    """
+    An indexed snapshot of the processes running on the system.
+
+    :param fields: The fields to obtain for each process; a sub-set of
+      :data:`FIELDS`. Defaults to ``comm``, ``ppid`` and ``starttime`` which
+      are all read from a single file per process.
+    :param rows: Pre-scanned process tuples as returned by
+      :func:`read_process`. Optional; ``/proc`` is scanned if not given.
+    :param str proc: Where ``/proc`` is mounted.
+    """
+    def __init__(self, fields=('comm', 'ppid', 'starttime'), rows=None,
+                 proc='/proc'):
+        unknown = set(fields) - set(FIELDS)
+        if unknown:
+            raise ValueError("unknown process fields: {f}".format(
+                f=", ".join(sorted(unknown))))
+
+        self.fields = frozenset(fields)
+        self.proc = proc
+
+        if rows is None:
+            rows = self._scan()
+
+        self._procs = collections.OrderedDict(
+            (row[0], Process(*row)) for row in rows)
+        self._indexes = {}
+
+    def _scan(self):
+        rows = []
+        for name in os.listdir(self.proc):
+            if not name.isdigit():
+                continue
+
+            row = read_process(int(name), self.fields, self.proc)
+            if row is not None:
+                rows.append(row)
+
+        return rows
+
+    def rows(self):
+        """
+        Returns the table as a list of plain tuples, suitable for
+        :mod:`marshal` and for passing back to the constructor.
+        """
+        return [tuple(p) for p in self._procs.values()]
+
+    def _require(self, field):
+        if field not in self.fields:
+            raise ValueError("process table was scanned without the {f} "
+                             "field".format(f=field))
+
+    def _index(self, field):
+        try:
+            return self._indexes[field]
+        except KeyError:
+            pass
+
+        self._require(field)
+        index = {}
+        for p in self._procs.values():
+            index.setdefault(getattr(p, field), []).append(p)
+        self._indexes[field] = index
+        return index
+
+    def __len__(self):
+        return len(self._procs)
+
+    def __iter__(self):
+        return iter(self._procs.values())
+
+    def __contains__(self, pid):
+        return pid in self._procs
+
+    def __getitem__(self, pid):
+        return self._procs[pid]
+
+    def get(self, pid, default=None):
+        """
+        Returns the :data:`Process` with the given ``pid``, or ``default``.
+        """
+        return self._procs.get(pid, default)
+
+    def by_name(self, name):
+        """
+        Returns the processes whose command name (``comm``) is ``name``.
+
+        The kernel truncates command names to 15 characters, so ``name`` is
+        truncated in the same way before comparing.
+        """
+        return list(self._index('comm').get(name[:15], ()))
+
+    def by_exe(self, path):
+        """
+        Returns the processes running the executable at ``path``.
+
+        Requires the ``exe`` field.
+        """
+        return list(self._index('exe').get(os.path.realpath(path), ()))
+
+    def by_cmdline(self, pattern):
+        """
+        Returns the processes whose command line matches ``pattern``.
+
+        ``pattern`` is a regular expression (or a compiled pattern) which is
+        searched for in the command line arguments joined by spaces. Requires
+        the ``cmdline`` field.
+        """
+        self._require('cmdline')
+        if not hasattr(pattern, 'search'):
+            pattern = re.compile(pattern)
+
+        return [p for p in self._procs.values()
+                if p.cmdline and pattern.search(' '.join(p.cmdline))]
+
+    def by_uid(self, uid):
+        """
+        Returns the processes owned by user ID ``uid``. Requires the ``uid``
+        field.
+        """
+        return list(self._index('uid').get(uid, ()))
+
+    def children(self, pid):
+        """
+        Returns the immediate children of process ``pid``. Requires the
+        ``ppid`` field.
+        """
+        return list(self._index('ppid').get(pid, ()))
+
+    def descendants(self, pid):
+        """
+        Returns all the descendants of process ``pid``, parents before their
+        children. Requires the ``ppid`` field.
+        """
+        result = []
+        todo = [pid]
+        while todo:
+            children = self.children(todo.pop(0))
+            result.extend(children)
+            todo.extend(p.pid for p in children)
+        return result
+
+
+# Tables already scanned by this process, keyed by their fields
+_tables = {}
+
+# Keys used with ocf.shared_cache by this process
+_shared_keys = set()
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    _tables.clear()
+    _shared_keys.clear()
+
+
+def scan(fields=('comm', 'ppid', 'starttime'), shared_ttl=None):
+    """
+    Returns a :class:`ProcessTable` with at least the requested ``fields``.
+
+    The first call scans ``/proc``; later calls during the same invocation
+    return the same table, provided it has all the requested fields. Call
+    :func:`rescan` to throw the tables away, for example after starting or
+    stopping processes.
+
+    :param fields: The fields required; see :data:`FIELDS`.
+    :param float shared_ttl: If given, the scan is shared with other processes
+      using :func:`ocf.shared_cache.get`, and reused for this many seconds.
+      This is useful during probe storms, where many agents look for their
+      processes at the same time.
+    """
+    fields = frozenset(fields)
+    for have, table in _tables.items():
+        if fields <= have:
+            return table
+
+    if shared_ttl is None:
+        table = ProcessTable(fields)
+    else:
+        key = 'ocf.proc.' + '.'.join(sorted(fields))
+        _shared_keys.add(key)
+        rows = ocf.shared_cache.get(
+            key, lambda: ProcessTable(fields).rows(), ttl=shared_ttl)
+        table = ProcessTable(fields, rows=rows)
+
+    _tables[fields] = table
+    return table
+
+
+def rescan():
+    """
+    Forget the tables remembered by :func:`scan`, including any scans this
+    process shared with others.
+    """
+    _tables.clear()
+
+    for key in _shared_keys:
+        ocf.shared_cache.invalidate(key)
+    _shared_keys.clear()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,47 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.proc
+import os
+import sys
+import unittest
+
+
+class ParseStatTests(unittest.TestCase):
+    def test_comm_with_spaces_and_parentheses(self):
+        data = ('123 (a (b) c) S 1 123 123 0 -1 4194560 0 0 0 0 0 0 0 0 20 0 '
+                '1 0 4242 0 0\n')
+        assert ocf.proc.parse_stat(data) == ('a (b) c', 1, 4242)
+
+
+class ProcessTableTests(unittest.TestCase):
+    def setUp(self):
+        self.table = ocf.proc.ProcessTable(
+            fields=('comm', 'ppid', 'starttime', 'cmdline'))
+
+    def test_finds_self(self):
+        me = self.table[os.getpid()]
+        assert me.ppid == os.getppid()
+        assert me.uid is None
+        assert me in self.table.children(os.getppid())
+
+    def test_by_cmdline(self):
+        pids = [p.pid for p in self.table.by_cmdline(r'python')]
+        assert os.getpid() in pids
+
+    def test_missing_field(self):
+        self.assertRaises(ValueError, self.table.by_exe, sys.executable)
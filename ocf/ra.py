@@ -17,12 +17,24 @@
 
 from __future__ import print_function
 
+import errno
+import functools
+import gc
+import hashlib
+import hmac
 import inspect
 import ocf
+import ocf.lifecycle
+import ocf.state
+import os
+import signal
 import sys
+import tempfile
+import time
 
 from lxml import etree
-from ocf.util import cached_property
+from ocf.util import (cached_property, makedirs, monotonic, semaphore,
+                      LockTimeout)
 
 import six
 
@@ -38,28 +50,43 @@ class ResourceAgentType(type):
     """
     def __new__(cls, name, bases, attrs):
         # Create the class with only the __module__ attribute set; other
-        # attributes will be added back in later
-        module = attrs.pop('__module__')
+        # attributes will be added back in later. Python 3 also requires the
+        # __classcell__ (present if any method uses super()) to be passed to
+        # type.__new__.
+        base_attrs = {'__module__': attrs.pop('__module__')}
+        if '__classcell__' in attrs:
+            base_attrs['__classcell__'] = attrs.pop('__classcell__')
         new_class = super(ResourceAgentType, cls).__new__(
-            cls, name, bases, {'__module__': module})
+            cls, name, bases, base_attrs)
 
-        # Copy the actions and parameters from the parent class, if any. These
-        # can be overridden by child classes if required.
-        try:
-            new_class.add_to_class('_ACTIONS', bases[0]._ACTIONS)
-        except (IndexError, AttributeError):
-            new_class.add_to_class('_ACTIONS', {})
+        # Copy the actions and parameters from the parent classes, if any.
+        # These can be overridden by child classes if required. Earlier bases
+        # take precedence, as they do for attribute look-ups. Each class gets
+        # its own copy so that sub-classes don't add to their parents.
+        actions = {}
+        parameters = {}
+        for base in reversed(bases):
+            actions.update(getattr(base, '_ACTIONS', {}))
+            parameters.update(getattr(base, '_PARAMETERS', {}))
 
-        try:
-            new_class.add_to_class('_PARAMETERS', bases[0]._PARAMETERS)
-        except (IndexError, AttributeError):
-            new_class.add_to_class('_PARAMETERS', {})
+        new_class.add_to_class('_ACTIONS', actions)
+        new_class.add_to_class('_PARAMETERS', parameters)
 
         # Re-add all other attributes to the class, optinally using
         # contribute_to_class() if it's defined
         for name, value in attrs.items():
             new_class.add_to_class(name, value)
 
+        # Catch typos in probe_parameters now, rather than at the first probe
+        for action in six.itervalues(new_class._ACTIONS):
+            unknown = set(action.probe_parameter_names or ()) - \
+                set(new_class._PARAMETERS)
+            if unknown:
+                raise ValueError(
+                    "{cls}.{action}: unknown probe_parameters: {names}".format(
+                        cls=new_class.__name__, action=action.name,
+                        names=", ".join(sorted(unknown))))
+
         return new_class
 
     def add_to_class(cls, name, value):
@@ -107,6 +134,9 @@ class Parameter(object):
       ``integer`` or ``boolean``.
     :param str default: For non-``required`` resources, a default value to use
       if the parameter is not specified in the configuration.
+    :param bool reloadable: Whether a change to the value can be applied by the
+      agent's ``reload`` action, without restarting the resource. See
+      :attr:`ResourceAgent.changed_parameters`.
 
     Usage::
 
@@ -146,13 +176,14 @@ class Parameter(object):
         This class is a data descriptor.
     """
     def __init__(self, shortdesc, longdesc, unique=False, required=False,
-                 content='string', default=None):
+                 content='string', default=None, reloadable=False):
         self.shortdesc = shortdesc
         self.longdesc = longdesc
         self.unique = unique
         self.required = required
         self.content = content
         self.default = default
+        self.reloadable = reloadable
         self.__doc__ = shortdesc
 
         if content not in ['string', 'integer', 'boolean']:
@@ -192,12 +223,15 @@ class Parameter(object):
         if self.required:
             p.set('required', '1')
 
+        if self.reloadable:
+            p.set('reloadable', '1')
+
         etree.SubElement(p, 'longdesc', lang='en').text = self.longdesc
         etree.SubElement(p, 'shortdesc', lang='en').text = self.shortdesc
 
         c = etree.SubElement(p, 'content', type=self.content)
         if self.default is not None and not self.required:
-            c.set('default', self.default)
+            c.set('default', str(self.default))
 
     def _validate_coerce(self, value):
         if self.content == 'string':
@@ -250,6 +284,22 @@ class Parameter(object):
             name=self.name))
 
 
+class SoftTimeout(BaseException):
+    """
+    Raised in an action which has a ``fallback`` (see :class:`Action`) when it
+    runs out of time.
+
+    This derives from :class:`BaseException`, like :class:`KeyboardInterrupt`,
+    so that ``except Exception`` clauses in the action don't swallow it.
+    """
+
+
+# Time (in seconds, and as a fraction of the CRM's timeout) left for the
+# fallback and exit when an action is given up
+_SOFT_MARGIN = 2.0
+_SOFT_MARGIN_FRACTION = 0.1
+
+
 class Action(object):
     """
     Defines an action that a resource agent can be asked to perform.
@@ -278,6 +328,37 @@ class Action(object):
       thorough the check should be. See below. Optional.
     :param str role: For ``monitor`` operations on resource agents that can
       support master/slave operation only. Optional.
+    :param probe: For ``monitor`` operations only: a method, or the name of a
+      method, to call instead of the decorated method when the action is a
+      probe (see :attr:`ocf.environment.Environment.is_probe`). Optional. A
+      function defined elsewhere, such as a lambda, is called with the agent
+      as its only argument, as a method would be.
+    :param probe_parameters: Names of the parameters to validate before
+      calling the ``probe`` method. Optional; if not given, all parameters are
+      validated. Only relevant if ``probe`` is given.
+    :param fallback: What to return if the action runs out of time: the string
+      ``'last-good'`` for the result of the last run which finished in time,
+      an ``OCF_`` exit code, or a method (or the name of a method, or a
+      function as for ``probe``) which returns one. Optional; without it, the
+      action runs until the CRM kills it.
+    :param float soft_timeout: Seconds after which to give up and return the
+      ``fallback`` result. Optional; the action is always given up shortly
+      before the CRM's own timeout. Only relevant if ``fallback`` is given.
+    :param int max_concurrency: Maximum number of invocations of this action
+      to run at once on this node. Optional; unlimited if not given.
+    :param str group: Name of the limit shared by actions with the same
+      ``group``, even across agents. Optional; defaults to the resource type
+      and action name. Only relevant if ``max_concurrency`` is given.
+    :param deep: For ``monitor`` operations only: a method, or the name of a
+      method (or a function as for ``probe``), doing a thorough check, to run
+      after the decorated (cheap) one when needed. See below. Optional.
+    :param int deep_every: Run the ``deep`` check at least once in this many
+      monitors. Optional; if not given, it is only run after an anomaly.
+    :param tuple damping: For ``monitor`` operations only: a pair ``(N, M)``
+      meaning that a failure is only reported once ``N`` of the last ``M``
+      monitors have failed. See below. Optional.
+    :param float recheck: For ``monitor`` operations only: seconds after which
+      to check once more before reporting a failure. Optional.
 
     .. note::
 
@@ -307,15 +388,118 @@ class Action(object):
         <action name="monitor" timeout="20" interval="10" depth="0"
             role="Master"/>
         <action name="start" timeout="40"/>
+
+    When a node joins the cluster, the CRM probes every configured resource on
+    it, so probes should be cheap. A ``probe`` method only has to find out
+    whether the resource is running, and can skip checks that a recurring
+    ``monitor`` would do. Only the parameters it needs have to be validated::
+
+        class MyAgent(ocf.ResourceAgent):
+            def probe(self):
+                if os.path.exists(self.pidfile):
+                    return ocf.OCF_SUCCESS
+                return ocf.OCF_NOT_RUNNING
+
+            @ocf.Action(timeout=20, depth=0, interval=10, probe='probe',
+                        probe_parameters=['pidfile'])
+            def monitor(self):
+                ...
+
+    If an overrunning ``monitor`` is killed by the CRM, the CRM records a
+    failure and recovers the resource, even if only an unimportant check was
+    slow. Given a ``fallback``, :meth:`ResourceAgent.execute` interrupts the
+    action (by raising :class:`SoftTimeout` in it) after ``soft_timeout``
+    seconds or just before the CRM's timeout, whichever is sooner, and exits
+    with the fallback result instead::
+
+        class MyAgent(ocf.ResourceAgent):
+            @ocf.Action(timeout=20, depth=0, interval=10, fallback='last-good',
+                        soft_timeout=15)
+            def monitor(self):
+                ...
+
+    With ``'last-good'``, the result of each run which finishes in time is
+    kept in the instance's state (see :mod:`ocf.state`); if there is none
+    yet, :data:`ocf.OCF_ERR_GENERIC` is returned. Any processes started by the
+    action are left running.
+
+    When many instances are started at once, for example as a node boots,
+    heavy ``start`` actions can overload a disk or a shared back-end. With
+    ``max_concurrency``, invocations beyond the limit wait for a turn (see
+    :func:`ocf.util.semaphore`), and the time spent waiting is logged::
+
+        class MyAgent(ocf.ResourceAgent):
+            @ocf.Action(timeout=120, max_concurrency=4, group='db-load')
+            def start(self):
+                ...
+
+    An invocation still waiting shortly before the CRM's timeout gives up with
+    its ``fallback`` result, or :data:`ocf.OCF_ERR_GENERIC`.
+
+    Rather than configuring a separate recurring operation with a higher
+    ``OCF_CHECK_LEVEL`` for a thorough check, a ``monitor`` can run a cheap
+    check every time and escalate to a ``deep`` check only when needed::
+
+        class MyAgent(ocf.ResourceAgent):
+            def query(self):
+                ...
+
+            @ocf.Action(timeout=20, depth=0, interval=10, deep='query',
+                        deep_every=30)
+            def monitor(self):
+                ...
+
+    The ``deep`` check is run, and its result returned, when the cheap check
+    succeeds and:
+
+    - ``deep_every`` monitors have passed since the last deep check;
+    - the cheap check called :meth:`ResourceAgent.escalate`;
+    - the previous monitor found the resource failed (by either check); or
+    - ``OCF_CHECK_LEVEL`` is greater than zero.
+
+    The counters are kept in the instance's state (see :mod:`ocf.state`).
+    Probes only run the cheap check (or the ``probe`` method).
+
+    A failed ``monitor`` makes the CRM recover the resource, which may be far
+    more disruptive than a momentary problem under load. Failures can be
+    damped, by checking again within the same invocation (``recheck``), by
+    only reporting a failure once it has happened ``N`` times in the last
+    ``M`` monitors (``damping``), or both::
+
+        class MyAgent(ocf.ResourceAgent):
+            @ocf.Action(timeout=20, depth=0, interval=10, recheck=1,
+                        damping=(2, 5))
+            def monitor(self):
+                ...
+
+    Any result other than :data:`ocf.OCF_SUCCESS` and
+    :data:`ocf.OCF_RUNNING_MASTER` counts as a failure. A suppressed failure
+    is logged as a warning, and the last healthy result is returned instead.
+    The results of the last ``M`` monitors are kept in the instance's state,
+    as a bit mask, and forgotten once a failure has been reported. Probes are
+    never damped.
     """
     def __init__(self, name=None, timeout=20, interval=None, start_delay=None,
-                 depth=None, role=None):
+                 depth=None, role=None, probe=None, probe_parameters=None,
+                 fallback=None, soft_timeout=None, max_concurrency=None,
+                 group=None, deep=None, deep_every=None, damping=None,
+                 recheck=None):
         self.name = name
         self.timeout = timeout
         self.interval = interval
         self.start_delay = start_delay
         self.depth = depth
         self.role = role
+        self.probe = probe
+        self.probe_parameters = probe_parameters
+        self.fallback = fallback
+        self.soft_timeout = soft_timeout
+        self.max_concurrency = max_concurrency
+        self.group = group
+        self.deep = deep
+        self.deep_every = deep_every
+        self.damping = damping
+        self.recheck = recheck
 
     @property
     def action_method(self):
@@ -331,6 +515,83 @@ class Action(object):
         else:
             return self.action
 
+    @property
+    def probe_method(self):
+        """
+        Returns the method (or its name) to call for probes, or ``None``. See
+        :meth:`ResourceAgent._bind`.
+
+        If the action has been decorated multiple times, the first ``probe``
+        given is used.
+        """
+        if self.probe is None and isinstance(self.action, Action):
+            return self.action.probe_method
+        return self.probe
+
+    @property
+    def probe_parameter_names(self):
+        """
+        Returns the names of the parameters to validate before a probe.
+
+        Returns ``None`` if all parameters should be validated.
+        """
+        if self.probe_parameters is None and isinstance(self.action, Action):
+            return self.action.probe_parameter_names
+        return self.probe_parameters
+
+    @property
+    def timeout_policy(self):
+        """
+        Returns the ``(fallback, soft_timeout)`` of this action. ``fallback``
+        is ``None`` if the action should not be given up.
+
+        If the action has been decorated multiple times, the first ``fallback``
+        given is used, along with its ``soft_timeout``.
+        """
+        if self.fallback is None and isinstance(self.action, Action):
+            return self.action.timeout_policy
+        return self.fallback, self.soft_timeout
+
+    @property
+    def concurrency(self):
+        """
+        Returns the ``(max_concurrency, group)`` of this action.
+        ``max_concurrency`` is ``None`` if there is no limit.
+
+        If the action has been decorated multiple times, the first
+        ``max_concurrency`` given is used, along with its ``group``.
+        """
+        if self.max_concurrency is None and isinstance(self.action, Action):
+            return self.action.concurrency
+        return self.max_concurrency, self.group
+
+    @property
+    def escalation(self):
+        """
+        Returns the ``(deep, deep_every)`` of this action, with ``deep`` as a
+        method or its name. ``deep`` is ``None`` if there is no deep check.
+
+        If the action has been decorated multiple times, the first ``deep``
+        given is used, along with its ``deep_every``.
+        """
+        if self.deep is None and isinstance(self.action, Action):
+            return self.action.escalation
+        return self.deep, self.deep_every
+
+    @property
+    def damping_policy(self):
+        """
+        Returns the ``(damping, recheck)`` of this action; both are ``None``
+        if failures are not damped.
+
+        If the action has been decorated multiple times, the first to give
+        either is used.
+        """
+        if self.damping is None and self.recheck is None and \
+                isinstance(self.action, Action):
+            return self.action.damping_policy
+        return self.damping, self.recheck
+
     def __call__(self, action):
         self.action = action
 
@@ -382,6 +643,37 @@ class Action(object):
             self.action.append_xml(actions)
 
 
+def _node_key():
+    """
+    Returns this node's random key for keyed digests, creating it if need be.
+    """
+    path = os.path.join(ocf.env.state_dir, 'node.key')
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except (IOError, OSError) as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+    # Write the key in full before it appears, and keep whichever key another
+    # process managed to create first. mkstemp() makes the file mode 0600.
+    makedirs(ocf.env.state_dir)
+    fd, tmp = tempfile.mkstemp(dir=ocf.env.state_dir, prefix='.node.key.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(tmp, path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    finally:
+        os.unlink(tmp)
+
+    with open(path, 'rb') as f:
+        return f.read()
+
+
 @six.add_metaclass(ResourceAgentType)
 class ResourceAgent(object):
     """
@@ -415,6 +707,8 @@ class ResourceAgent(object):
     - Declare one or more class variables of type :class:`Parameter`, which are
       used to declare which parameters the resource agent supports/expects from
       the CRM.
+    - Declare ``FAST_EXIT = True`` to skip the interpreter's clean-up when the
+      agent exits. See :mod:`ocf.lifecycle`.
 
     Usage::
 
@@ -490,10 +784,68 @@ class ResourceAgent(object):
         3. Unless the action is ``meta-data``, validate all passed parameters
            for validity (e.g. that all required parameters have been passed).
            If they are not valid, print a suitable error message and exit.
-        4. Call the requested action method. Its result is passed to
-           :func:`sys.exit` and should be one of the exit codes defined in
-           :mod:`ocf`.
+        4. Call the requested action method. Its result should be one of the
+           exit codes defined in :mod:`ocf`.
+        5. Run the teardown hooks (see :mod:`ocf.lifecycle`) and exit with
+           the action's result.
+
+        If the action is a probe and a ``probe`` method has been declared for
+        it (see :class:`Action`), that method is called instead in step 4, and
+        only the parameters it needs are validated in step 3 using
+        :meth:`_validate_parameters`. Unless an agent has declared its own
+        ``validate-all`` action, :meth:`validate_all` is run through
+        :meth:`validate_cached`, so is skipped if the configuration passed
+        before and has not changed, unless ``--force`` follows the action on
+        the command line.
+
+        All but the exit are carried out by :meth:`dispatch`. If fast exit is
+        enabled, by ``FAST_EXIT`` or
+        :attr:`ocf.environment.Environment.fast_exit`, the garbage collector is
+        disabled while the action runs and the process exits with
+        :func:`os._exit`. If ``HA_WATCHDOG`` is set, a watchdog is armed to
+        record where the action is stuck if it runs slowly (see
+        :mod:`ocf.watchdog`).
+        """
+        fast = getattr(self, 'FAST_EXIT', False) or ocf.env.fast_exit
+        if fast:
+            # Every object is about to be thrown away in one go
+            gc.disable()
+
+        if ocf.env.watchdog is not None:
+            # Only pay for importing threading when it is wanted
+            from ocf.watchdog import arm
+            arm()
+
+        ocf.lifecycle.exit(self.dispatch(), fast=fast)
+
+    def dispatch(self):
+        """
+        Runs the requested action and returns its exit code.
+
+        This does everything :meth:`execute` does apart from exiting: any
+        attempt to exit during the action (for example because the parameters
+        are invalid) is caught, and the exit code returned instead. An action
+        method returning ``None``, as ``meta-data`` does, is taken to mean
+        :data:`ocf.OCF_SUCCESS`, and an action raising an exception is logged
+        and taken to mean :data:`ocf.OCF_ERR_GENERIC`. The teardown hooks are
+        run before returning, whatever happened.
         """
+        try:
+            ret = self._dispatch()
+        except SystemExit as e:
+            ret = e.code
+        except Exception:
+            ocf.log.exception("{action} failed".format(action=ocf.env.action))
+            ret = ocf.OCF_ERR_GENERIC
+
+        if ret is None:
+            ret = ocf.OCF_SUCCESS
+
+        ocf.lifecycle.teardown(ret)
+
+        return ret
+
+    def _dispatch(self):
         # If we were called without any arguments, print usage and exit
         if ocf.env.action is None:
             self._print_usage()
@@ -518,24 +870,463 @@ class ResourceAgent(object):
         action_method = getattr(self, action.action_method.__name__)
 
         # Carry out pre-requisite checks for all actions _except_ meta-data.
-        if ocf.env.action != 'meta-data':
+        # Probes with their own method only check what that method needs.
+        if ocf.env.action == 'meta-data':
+            pass
+        elif ocf.env.is_probe and action.probe_method is not None:
+            action_method = self._bind(action.probe_method)
+            self._validate_parameters(action.probe_parameter_names)
+        else:
             self._validate_parameters()
 
+        if ocf.env.action == 'validate-all' and \
+                action.action_method.__name__ == 'validate_all':
+            action_method = functools.partial(
+                self.validate_cached, force='--force' in sys.argv[2:])
+
+        deep, deep_every = action.escalation
+        if deep is not None and not ocf.env.is_probe:
+            cheap = action_method
+
+            def action_method():
+                return self._escalating(cheap, self._bind(deep), deep_every)
+
+        damping, recheck = action.damping_policy
+        if (damping, recheck) != (None, None) and not ocf.env.is_probe:
+            check = action_method
+
+            def action_method():
+                return self._damped(check, damping, recheck)
+
+        # Refuse to reload changes that need a restart; failing the reload
+        # makes the CRM restart the resource instead
+        if ocf.env.action == 'reload' and self.reloadable_parameters:
+            fixed = self.changed_parameters - self.reloadable_parameters
+            if self._applied_parameters and fixed:
+                ocf.log.error("Cannot reload changes to {params}".format(
+                    params=", ".join(sorted(fixed))))
+                return ocf.OCF_ERR_GENERIC
+
         # Run the requested action
-        ret = action_method()
-        sys.exit(ret)
+        ret = self._run_limited(action, action_method)
+
+        # Remember the parameters now in effect, for the next reload
+        if self.reloadable_parameters and ret in (None, ocf.OCF_SUCCESS):
+            if ocf.env.action in ('start', 'reload', 'migrate_from'):
+                self._record_parameters()
+            elif ocf.env.action == 'stop':
+                self._applied_parameters.remove()
+
+        return ret
+
+    def escalate(self, reason):
+        """
+        Asks for the ``deep`` check (see :class:`Action`) to be run once the
+        cheap check has finished, because it has noticed something odd.
+
+        :param str reason: Why, for the log.
+        """
+        self._escalation = reason
+
+    def _escalating(self, cheap, deep, every):
+        """
+        Runs the ``cheap`` check, followed by the ``deep`` one if needed (see
+        :class:`Action`), and returns the result.
+        """
+        healthy = (ocf.OCF_SUCCESS, ocf.OCF_RUNNING_MASTER)
+        state = ocf.state.State('escalation')
+        runs = state.get('runs', 0) + 1
+
+        self._escalation = None
+        ret = cheap()
+        if ret is None:
+            ret = ocf.OCF_SUCCESS
+
+        # Anomalies are worth logging; routine deep checks are not
+        log = ocf.log.info
+        if ret not in healthy:
+            reason = None
+            state['failed'] = True
+        elif self._escalation is not None:
+            reason = self._escalation
+        elif state.get('failed'):
+            reason = "previous monitor failed"
+        elif ocf.env.check_level > 0:
+            reason = "OCF_CHECK_LEVEL={0}".format(ocf.env.check_level)
+            log = ocf.log.debug
+        elif every is not None and runs >= every:
+            reason = "{0} monitors since the last deep check".format(runs)
+            log = ocf.log.debug
+        else:
+            reason = None
+
+        if reason is not None:
+            log("Running deep check: {0}".format(reason))
+            ret = deep()
+            if ret is None:
+                ret = ocf.OCF_SUCCESS
+            state['failed'] = ret not in healthy
+            runs = 0
+
+        state['runs'] = runs
+        state.save(defer=True)
+        return ret
+
+    def _damped(self, check, damping, recheck):
+        """
+        Runs ``check`` and returns its result, unless it is a failure which
+        ``damping`` or ``recheck`` suppress (see :class:`Action`).
+        """
+        healthy = (ocf.OCF_SUCCESS, ocf.OCF_RUNNING_MASTER)
+
+        ret = check()
+        if ret is None:
+            ret = ocf.OCF_SUCCESS
+
+        if ret not in healthy and recheck is not None:
+            ocf.log.warning("{action} returned {code}; checking again in "
+                            "{t}s".format(action=ocf.env.action, code=ret,
+                                          t=recheck))
+            time.sleep(recheck)
+            first, ret = ret, check()
+            if ret is None:
+                ret = ocf.OCF_SUCCESS
+            if ret in healthy:
+                ocf.log.warning("Suppressed failure {code}: the re-check "
+                                "passed".format(code=first))
+
+        if damping is None:
+            return ret
+
+        needed, window = damping
+        state = ocf.state.State('damping')
+        saved = dict(state)
+        history = (state.get('history', 0) << 1) & ((1 << window) - 1)
+
+        if ret in healthy:
+            state['healthy'] = ret
+        else:
+            history |= 1
+            failures = bin(history).count('1')
+            if failures < needed:
+                ocf.log.warning(
+                    "Suppressed failure {code}: {n} of the last {m} monitors "
+                    "failed, fewer than {needed}".format(
+                        code=ret, n=failures, m=window, needed=needed))
+                ret = state.get('healthy', ocf.OCF_SUCCESS)
+            else:
+                # The CRM is about to recover the resource; start afresh
+                history = 0
+
+        state['history'] = history
+        if state != saved:
+            state.save(defer=True)
+        return ret
+
+    def _soft_limit(self, soft_timeout):
+        """
+        Returns the number of seconds the action may still run before it is
+        given up, or ``None`` if there is no limit.
+        """
+        limits = []
+        elapsed = monotonic() - ocf.env.started
+        if soft_timeout is not None:
+            limits.append(soft_timeout - elapsed)
+        if ocf.env.timeout is not None:
+            margin = min(_SOFT_MARGIN, ocf.env.timeout * _SOFT_MARGIN_FRACTION)
+            limits.append(ocf.env.timeout - margin - elapsed)
+        if not limits:
+            return None
+        # A zero timer would never fire
+        return max(min(limits), 0.001)
+
+    def _run_limited(self, action, action_method):
+        """
+        Calls :meth:`_run_action` once a turn is free, if the action has a
+        ``max_concurrency`` (see :class:`Action`).
+        """
+        limit, group = action.concurrency
+        if limit is None:
+            return self._run_action(action, action_method)
+
+        if group is None:
+            group = "{type}-{action}".format(type=ocf.env.resource_type,
+                                             action=action.name)
+        path = os.path.join(ocf.env.state_dir, 'concurrency', group)
+
+        waiting = monotonic()
+        running = False
+        try:
+            with semaphore(path, limit, timeout=self._soft_limit(None)):
+                running = True
+                waited = monotonic() - waiting
+                log = ocf.log.info if waited >= 0.01 else ocf.log.debug
+                log("Waited {t:.3f}s for one of {n} {group} slots".format(
+                    t=waited, n=limit, group=group))
+                return self._run_action(action, action_method)
+        except LockTimeout:
+            if running:
+                raise
+
+        ocf.log.error("Gave up after waiting {t:.1f}s for one of {n} {group} "
+                      "slots".format(t=monotonic() - waiting, n=limit,
+                                     group=group))
+        fallback, _ = action.timeout_policy
+        if fallback is None:
+            return ocf.OCF_ERR_GENERIC
+        return self._fallback(action.name, fallback)
+
+    def _run_action(self, action, action_method):
+        """
+        Calls ``action_method``, giving it up with the action's ``fallback``
+        result if it runs out of time (see :class:`Action`).
+        """
+        fallback, soft_timeout = action.timeout_policy
+        limit = None if fallback is None else self._soft_limit(soft_timeout)
+        if limit is None:
+            return action_method()
+
+        def expired(signum, frame):
+            raise SoftTimeout()
+
+        try:
+            previous = signal.signal(signal.SIGALRM, expired)
+        except ValueError:
+            # Not in the main thread, so nothing can interrupt the action
+            return action_method()
+
+        try:
+            signal.setitimer(signal.ITIMER_REAL, limit)
+            try:
+                ret = action_method()
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except SoftTimeout:
+            return self._fallback(action.name, fallback)
+        finally:
+            signal.signal(signal.SIGALRM, previous)
+
+        if fallback == 'last-good':
+            self._record_result(action.name, ret)
+        return ret
+
+    def _bind(self, method):
+        """
+        Returns ``method``, given to :class:`Action` as ``probe``, ``deep`` or
+        ``fallback``, bound to this agent.
+
+        A name, or a function defined on the agent's class, is looked up on
+        the agent, so that sub-classes can override the method. Any other
+        function, such as a lambda, is bound to the agent as if it were a
+        method. Anything else callable is returned unchanged.
+        """
+        if isinstance(method, six.string_types):
+            return getattr(self, method)
+
+        name = getattr(method, '__name__', None)
+        for cls in type(self).__mro__:
+            if name in vars(cls) and vars(cls)[name] is method:
+                return getattr(self, name)
+
+        if inspect.isfunction(method):
+            return method.__get__(self, type(self))
+        return method
+
+    def _fallback(self, name, fallback):
+        elapsed = monotonic() - ocf.env.started
+
+        if fallback == 'last-good':
+            last = ocf.state.State('results').get(name)
+            if last is None:
+                ocf.log.error("{action} timed out after {t:.1f}s, with no "
+                              "earlier result to fall back on".format(
+                                  action=name, t=elapsed))
+                return ocf.OCF_ERR_GENERIC
+            ocf.log.warning("{action} timed out after {t:.1f}s; returning "
+                            "the last result, {code}, first seen {age:.0f}s "
+                            "ago".format(action=name, t=elapsed,
+                                         code=last['code'],
+                                         age=time.time() - last['since']))
+            return last['code']
+
+        if isinstance(fallback, six.integer_types):
+            ret = fallback
+        else:
+            ret = self._bind(fallback)()
+
+        ocf.log.warning("{action} timed out after {t:.1f}s; returning "
+                        "{code}".format(action=name, t=elapsed, code=ret))
+        return ret
+
+    def _record_result(self, name, ret):
+        if ret is None:
+            ret = ocf.OCF_SUCCESS
+
+        # Only write when the result changes, not on every monitor
+        results = ocf.state.State('results')
+        last = results.get(name)
+        if last is None or last['code'] != ret:
+            results[name] = {'code': ret, 'since': time.time()}
+            results.save(defer=True)
+
+    def validation_files(self):
+        """
+        Returns the paths of the files which :meth:`validate_all` checks, such
+        as the service's configuration file and binaries.
+
+        Used by :meth:`validate_cached` to tell whether the configuration has
+        changed. Returns an empty list; override this to add files.
+        """
+        return []
+
+    def _configuration_digest(self):
+        # Keyed, as the values may include passwords
+        digest = hmac.new(_node_key(), digestmod=hashlib.sha256)
+        for name, value in sorted(six.iteritems(ocf.env.reskey)):
+            # These describe the operation rather than the configuration
+            if not name.startswith('CRM_meta_'):
+                digest.update(repr((name, value)).encode('utf-8'))
+
+        # The agent's own code is a dependency too
+        paths = [inspect.getfile(type(self))] + list(self.validation_files())
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                stamp = None
+            else:
+                stamp = (st.st_dev, st.st_ino, st.st_size,
+                         getattr(st, 'st_mtime_ns', st.st_mtime))
+            digest.update(repr((path, stamp)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def validate_cached(self, force=False):
+        """
+        Runs :meth:`validate_all` and returns its result, unless it has
+        already passed for the same configuration.
+
+        A passing result is remembered in the instance's state (see
+        :mod:`ocf.state`) along with a digest of the ``OCF_RESKEY_*`` values,
+        excluding ``CRM_meta_*``, and of the size and modification time of
+        the agent's module and the :meth:`validation_files`. Later calls
+        return :data:`ocf.OCF_SUCCESS` straight away while none of those have
+        changed. Agents which validate in ``start`` or ``monitor`` should call
+        this rather than :meth:`validate_all`::
+
+            @ocf.Action(timeout=20, depth=0, interval=10)
+            def monitor(self):
+                ret = self.validate_cached()
+                if ret != ocf.OCF_SUCCESS:
+                    return ret
+                ...
+
+        :param bool force: Run :meth:`validate_all` whatever is remembered.
+        """
+        digest = self._configuration_digest()
+        state = ocf.state.State('validation')
+        if not force and state.get('digest') == digest:
+            ocf.log.debug("Configuration unchanged since it was validated")
+            return ocf.OCF_SUCCESS
+
+        ret = self.validate_all()
+        if ret is None:
+            ret = ocf.OCF_SUCCESS
+
+        if ret == ocf.OCF_SUCCESS:
+            state['digest'] = digest
+            state.save(defer=True)
+        elif state:
+            state.remove()
+        return ret
+
+    @property
+    def reloadable_parameters(self):
+        """
+        The names of the parameters declared with ``reloadable=True``, as a
+        :class:`frozenset`.
+        """
+        return frozenset(name for name, p in six.iteritems(self._PARAMETERS)
+                         if p.reloadable)
+
+    @cached_property
+    def _applied_parameters(self):
+        return ocf.state.State('parameters')
+
+    def _parameter_digests(self):
+        key = _node_key()
+        return dict(
+            (name, hmac.new(key, repr(getattr(self, name)).encode('utf-8'),
+                            hashlib.sha256).hexdigest())
+            for name in self._PARAMETERS)
+
+    def _record_parameters(self):
+        state = self._applied_parameters
+        state.clear()
+        state['parameters'] = self._parameter_digests()
+        state.save()
+
+    @cached_property
+    def changed_parameters(self):
+        """
+        The names of the parameters whose values have changed since the
+        resource was last started or reloaded, as a :class:`frozenset`.
+
+        For agents with ``reloadable`` parameters, the parameters in effect
+        are recorded whenever ``start``, ``reload`` or ``migrate_from``
+        succeeds. A ``reload`` action can use this to apply just what has
+        changed::
+
+            @ocf.Action()
+            def reload(self):
+                if 'log_level' in self.changed_parameters:
+                    self.set_log_level(self.log_level)
+                return ocf.OCF_SUCCESS
+
+        Before calling ``reload``, :meth:`execute` checks that only
+        ``reloadable`` parameters have changed, and returns
+        :data:`ocf.OCF_ERR_GENERIC` otherwise so that the CRM restarts the
+        resource. If nothing has been recorded (for example because the
+        resource was started by an older version of the agent), all the
+        parameters are taken to have changed.
+
+        Only HMACs of the values are recorded, keyed with a random key kept
+        in :attr:`ocf.environment.Environment.state_dir` and readable only by
+        its owner, so that passwords and the like cannot be recovered from
+        them.
+        """
+        applied = self._applied_parameters.get('parameters')
+        if not applied:
+            return frozenset(self._PARAMETERS)
+
+        return frozenset(name for name, digest in
+                         six.iteritems(self._parameter_digests())
+                         if applied.get(name) != digest)
 
     def _print_usage(self):
         print("Usage: {env.script_name} {{{actions}}}".format(
             env=ocf.env, actions="|".join(sorted(self._ACTIONS))),
             file=sys.stderr)
 
-    def _validate_parameters(self):
-        for p in six.itervalues(self._PARAMETERS):
+    def _validate_parameters(self, names=None):
+        """
+        Validates the parameters named in ``names``, or all of them if
+        ``names`` is ``None``, exiting with :data:`ocf.OCF_ERR_CONFIGURED` if
+        any is invalid.
+
+        When dispatching to a ``probe`` method, :meth:`execute` only validates
+        the parameters given as ``probe_parameters`` to :class:`Action`.
+        """
+        if names is None:
+            params = six.itervalues(self._PARAMETERS)
+        else:
+            params = [self._PARAMETERS[name] for name in names]
+
+        for p in params:
             try:
                 p.validate()
             except ValueError as e:
-                ocf.log.error(e.message)
+                ocf.log.error(str(e))
                 sys.exit(ocf.OCF_ERR_CONFIGURED)
 
     @property
@@ -628,7 +1419,9 @@ class ResourceAgent(object):
         This method performs no additional validation above the standard
         parameter validation performed by :meth:`execute`. This method may be
         overridden in order to provide a more thorough validation of the given
-        configuration, if required.
+        configuration, if required; other actions wanting to validate the
+        configuration should call :meth:`validate_cached`, which skips it
+        while the configuration is unchanged.
         """
         # Parameters are validated by _validate_parameters(); we have nothing
         # further to do here. Subclasses may override this method (or the whole
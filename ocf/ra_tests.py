@@ -0,0 +1,579 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import hashlib
+import ocf
+import ocf.testing
+import ocf.util
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class ReloadAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Has a reloadable parameter.
+    """
+    state = ocf.Parameter(
+        shortdesc='State file', longdesc='Path to the state file.',
+        required=True)
+
+    count = ocf.Parameter(
+        shortdesc='Count', longdesc='A number.', content='integer',
+        default=1)
+
+    level = ocf.Parameter(
+        shortdesc='Level', longdesc='Can be reloaded.', default='info',
+        reloadable=True)
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def monitor(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def reload(self):
+        ocf.log.info("changed: " + ",".join(sorted(self.changed_parameters)))
+        return ocf.OCF_SUCCESS
+
+
+class SlowAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Has monitors which can be made to overrun.
+    """
+    delay = ocf.Parameter(
+        shortdesc='Delay', longdesc='Seconds to sleep.', content='integer',
+        default=0)
+
+    @ocf.Action(max_concurrency=2, group='slow-start')
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10, fallback='last-good', soft_timeout=0.2)
+    def monitor(self):
+        time.sleep(self.delay)
+        return ocf.OCF_NOT_RUNNING
+
+    @ocf.Action(fallback='give_up')
+    def status(self):
+        try:
+            time.sleep(self.delay)
+        except Exception:
+            pass
+        return ocf.OCF_SUCCESS
+
+    def give_up(self):
+        return ocf.OCF_ERR_PERM
+
+
+class SoftTimeoutTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(SlowAgent, rsctmp=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_nothing_to_fall_back_on(self):
+        result = self.agent.run('monitor', reskey={'delay': 5})
+        assert result.code == ocf.OCF_ERR_GENERIC
+
+    def test_last_good(self):
+        assert self.agent.run('monitor').code == ocf.OCF_NOT_RUNNING
+        result = self.agent.run('monitor', reskey={'delay': 5})
+        assert result.code == ocf.OCF_NOT_RUNNING
+        assert 'returning the last result, 7' in result.messages[0]
+
+    def test_callback(self):
+        # Given up before the CRM's own timeout of one second
+        started = time.time()
+        result = self.agent.run('status', reskey={'delay': 5,
+                                                  'CRM_meta_timeout': 1000})
+        assert result.code == ocf.OCF_ERR_PERM
+        assert time.time() - started < 1
+
+
+class ConcurrencyTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(SlowAgent, rsctmp=self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'python-ocf', 'concurrency',
+                                 'slow-start')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_free_slot(self):
+        with ocf.util.semaphore(self.path, 2) as slot:
+            assert slot == 0
+            result = self.agent.run('start')
+        assert result.code == ocf.OCF_SUCCESS
+
+    def test_all_slots_taken(self):
+        with ocf.util.semaphore(self.path, 2):
+            with ocf.util.semaphore(self.path, 2) as slot:
+                assert slot == 1
+                result = self.agent.run(
+                    'start', reskey={'CRM_meta_timeout': 1000})
+        assert result.code == ocf.OCF_ERR_GENERIC
+        assert 'Gave up after waiting' in result.messages[0]
+
+
+class EscalatingAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Has a cheap and a deep monitor.
+    """
+    cheap = ocf.Parameter(
+        shortdesc='Cheap', longdesc='Result of the cheap check.',
+        content='integer', default=0)
+
+    deep = ocf.Parameter(
+        shortdesc='Deep', longdesc='Result of the deep check.',
+        content='integer', default=0)
+
+    odd = ocf.Parameter(
+        shortdesc='Odd', longdesc='Whether the cheap check escalates.',
+        content='boolean', default=False)
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10, deep='query', deep_every=3)
+    def monitor(self):
+        if self.odd:
+            self.escalate("odd")
+        return self.cheap
+
+    def query(self):
+        ocf.log.info("deep")
+        return self.deep
+
+
+class EscalationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(
+            EscalatingAgent, rsctmp=self.tmpdir,
+            reskey={'CRM_meta_interval': 10000})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def deep_runs(self, reskey=None):
+        return 'deep' in self.agent.run('monitor', reskey=reskey).messages
+
+    def test_every(self):
+        assert [self.deep_runs() for _ in range(6)] == \
+            [False, False, True, False, False, True]
+
+    def test_escalate(self):
+        assert self.deep_runs({'odd': 'true'})
+        assert not self.deep_runs()
+
+    def test_after_failure(self):
+        result = self.agent.run('monitor', reskey={'cheap': 7})
+        assert result.code == ocf.OCF_NOT_RUNNING
+        assert 'deep' not in result.messages
+
+        # The deep check finds the failure, so is run again next time
+        result = self.agent.run('monitor', reskey={'deep': 1})
+        assert result.code == ocf.OCF_ERR_GENERIC
+        assert self.deep_runs()
+        assert not self.deep_runs()
+
+    def test_probe(self):
+        result = self.agent.run('monitor', reskey={'CRM_meta_interval': 0,
+                                                   'odd': 'true'})
+        assert 'deep' not in result.messages
+
+
+class ProbingAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Has a probe which only needs some of the parameters.
+    """
+    pidfile = ocf.Parameter(
+        shortdesc='PID file', longdesc='Path to the PID file.', required=True)
+
+    config = ocf.Parameter(
+        shortdesc='Configuration', longdesc='Path to the configuration file.',
+        required=True)
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10, probe='probe', probe_parameters=['pidfile'])
+    def monitor(self):
+        return ocf.OCF_SUCCESS
+
+    def probe(self):
+        return ocf.OCF_NOT_RUNNING
+
+
+class ProbeTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(ProbingAgent, rsctmp=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def monitor(self, interval, **reskey):
+        reskey['CRM_meta_interval'] = interval
+        return self.agent.run('monitor', reskey=reskey).code
+
+    def test_probe(self):
+        # Only the pidfile is needed
+        assert self.monitor(0) == ocf.OCF_ERR_CONFIGURED
+        assert self.monitor(0, pidfile='/run/x') == ocf.OCF_NOT_RUNNING
+
+    def test_recurring(self):
+        assert self.monitor(10000, pidfile='/run/x') == \
+            ocf.OCF_ERR_CONFIGURED
+        assert self.monitor(10000, pidfile='/run/x', config='/etc/x') == \
+            ocf.OCF_SUCCESS
+
+    def test_unknown_parameter(self):
+        with self.assertRaises(ValueError):
+            class BrokenAgent(ocf.ResourceAgent):
+                """
+                Test agent
+
+                Names a parameter it doesn't have.
+                """
+                @ocf.Action(probe='monitor', probe_parameters=['missing'])
+                def monitor(self):
+                    return ocf.OCF_SUCCESS
+
+
+def deep_check(agent):
+    ocf.log.info("deep check of {0}".format(type(agent).__name__))
+    return ocf.OCF_ERR_GENERIC
+
+
+class FunctionAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Uses functions which aren't methods for its probe, deep check and
+    fallback.
+    """
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10, probe=lambda self: ocf.OCF_NOT_RUNNING,
+                deep=deep_check, deep_every=1)
+    def monitor(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(fallback=lambda self: ocf.OCF_ERR_PERM, soft_timeout=0.05)
+    def status(self):
+        time.sleep(1)
+        return ocf.OCF_SUCCESS
+
+
+class FunctionTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(FunctionAgent, rsctmp=self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_probe(self):
+        result = self.agent.run('monitor', reskey={'CRM_meta_interval': 0})
+        assert result.code == ocf.OCF_NOT_RUNNING
+
+    def test_deep(self):
+        result = self.agent.run('monitor',
+                                reskey={'CRM_meta_interval': 10000})
+        assert result.code == ocf.OCF_ERR_GENERIC
+        assert 'deep check of FunctionAgent' in result.messages
+
+    def test_fallback(self):
+        assert self.agent.run('status').code == ocf.OCF_ERR_PERM
+
+
+class FlappingAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Has damped monitors.
+    """
+    result = ocf.Parameter(
+        shortdesc='Result', longdesc='Result of the check.',
+        content='integer', default=0)
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10, damping=(2, 3))
+    def monitor(self):
+        return self.result
+
+    @ocf.Action(recheck=0.01)
+    def status(self):
+        # Fails the first time
+        if not hasattr(self, 'checked'):
+            self.checked = True
+            return ocf.OCF_ERR_GENERIC
+        return self.result
+
+
+class DampingTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(
+            FlappingAgent, rsctmp=self.tmpdir,
+            reskey={'CRM_meta_interval': 10000})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def monitor(self, result):
+        return self.agent.run('monitor', reskey={'result': result}).code
+
+    def test_n_of_m(self):
+        assert self.monitor(ocf.OCF_RUNNING_MASTER) == ocf.OCF_RUNNING_MASTER
+        assert self.monitor(ocf.OCF_ERR_GENERIC) == ocf.OCF_RUNNING_MASTER
+        assert self.monitor(ocf.OCF_SUCCESS) == ocf.OCF_SUCCESS
+        assert self.monitor(ocf.OCF_ERR_GENERIC) == ocf.OCF_ERR_GENERIC
+
+        # Reporting the failure starts afresh
+        assert self.monitor(ocf.OCF_NOT_RUNNING) == ocf.OCF_SUCCESS
+
+    def test_window(self):
+        assert self.monitor(ocf.OCF_ERR_GENERIC) == ocf.OCF_SUCCESS
+        assert self.monitor(ocf.OCF_SUCCESS) == ocf.OCF_SUCCESS
+        assert self.monitor(ocf.OCF_SUCCESS) == ocf.OCF_SUCCESS
+        assert self.monitor(ocf.OCF_ERR_GENERIC) == ocf.OCF_SUCCESS
+
+    def test_recheck(self):
+        result = self.agent.run('status')
+        assert result.code == ocf.OCF_SUCCESS
+        assert 'Suppressed failure 1: the re-check passed' in result.messages
+
+        result = self.agent.run('status', reskey={'result': 7})
+        assert result.code == ocf.OCF_NOT_RUNNING
+
+
+class ValidatingAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Validates its configuration file on every monitor.
+    """
+    config = ocf.Parameter(
+        shortdesc='Config', longdesc='Path to the configuration file.',
+        required=True)
+
+    validations = 0
+
+    @ocf.Action()
+    def start(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10)
+    def monitor(self):
+        return self.validate_cached()
+
+    def validation_files(self):
+        return [self.config]
+
+    def validate_all(self):
+        ValidatingAgent.validations += 1
+        if not os.path.exists(self.config):
+            return ocf.OCF_ERR_INSTALLED
+        return ocf.OCF_SUCCESS
+
+
+class ValidationTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.config = os.path.join(self.tmpdir, 'config')
+        self.touch(100)
+        self.agent = ocf.testing.AgentRunner(
+            ValidatingAgent, rsctmp=self.tmpdir,
+            reskey={'config': self.config, 'CRM_meta_interval': 10000})
+        ValidatingAgent.validations = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def touch(self, age):
+        with open(self.config, 'a'):
+            pass
+        then = time.time() - age
+        os.utime(self.config, (then, then))
+
+    def test_unchanged(self):
+        for _ in range(3):
+            assert self.agent.run('monitor').code == ocf.OCF_SUCCESS
+        assert ValidatingAgent.validations == 1
+
+        # Not part of the configuration
+        self.agent.run('monitor', reskey={'CRM_meta_timeout': 5000})
+        assert ValidatingAgent.validations == 1
+
+    def test_changed(self):
+        self.agent.run('monitor')
+        self.agent.run('monitor', reskey={'other': 'value'})
+        assert ValidatingAgent.validations == 2
+
+        self.touch(50)
+        self.agent.run('monitor', reskey={'other': 'value'})
+        assert ValidatingAgent.validations == 3
+
+    def test_failure_is_not_remembered(self):
+        os.unlink(self.config)
+        assert self.agent.run('monitor').code == ocf.OCF_ERR_INSTALLED
+        assert self.agent.run('monitor').code == ocf.OCF_ERR_INSTALLED
+        assert ValidatingAgent.validations == 2
+
+    def test_force(self):
+        self.agent.run('validate-all')
+        self.agent.run('validate-all')
+        assert ValidatingAgent.validations == 1
+        self.agent.run('validate-all', argv=['--force'])
+        assert ValidatingAgent.validations == 2
+
+    def test_own_action(self):
+        class CustomAgent(ValidatingAgent):
+            """
+            Test agent
+
+            Has its own validate-all action.
+            """
+            @ocf.Action(name='validate-all')
+            def check_config(self):
+                return ocf.OCF_ERR_CONFIGURED
+
+        result = ocf.testing.run(CustomAgent, 'validate-all',
+                                 reskey={'config': self.config},
+                                 rsctmp=self.tmpdir)
+        assert result.code == ocf.OCF_ERR_CONFIGURED
+
+    def test_validate_helper(self):
+        class HelperAgent(ValidatingAgent):
+            """
+            Test agent
+
+            Has an unrelated validate() helper.
+            """
+            def validate(self):
+                return ocf.OCF_ERR_ARGS
+
+        result = ocf.testing.run(HelperAgent, 'validate-all',
+                                 reskey={'config': self.config},
+                                 rsctmp=self.tmpdir)
+        assert result.code == ocf.OCF_SUCCESS
+        assert ValidatingAgent.validations == 1
+
+
+class ReloadTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.agent = ocf.testing.AgentRunner(
+            ReloadAgent, rsctmp=self.tmpdir,
+            reskey={'state': os.path.join(self.tmpdir, 'state')})
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_meta_data(self):
+        result = self.agent.run('meta-data')
+        assert '<parameter name="level" unique="0" reloadable="1">' in \
+            result.stdout
+
+    def test_changed_parameters(self):
+        assert self.agent.run('start').code == ocf.OCF_SUCCESS
+
+        result = self.agent.run('reload', reskey={'level': 'debug'})
+        assert result.code == ocf.OCF_SUCCESS
+        assert 'changed: level' in result.messages
+
+        # The reload was recorded
+        result = self.agent.run('reload', reskey={'level': 'debug'})
+        assert 'changed: ' in result.messages
+
+    def test_unreloadable_change(self):
+        self.agent.run('start')
+        result = self.agent.run('reload', reskey={'count': 2})
+        assert result.code == ocf.OCF_ERR_GENERIC
+
+    def test_values_not_recoverable(self):
+        self.agent.run('start', reskey={'level': 'hunter2'})
+        directory = os.path.join(self.tmpdir, 'python-ocf')
+        key = os.path.join(directory, 'node.key')
+        assert os.stat(key).st_mode & 0o777 == 0o600
+
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            assert b'hunter2' not in data
+            assert hashlib.sha1(b"'hunter2'").hexdigest().encode() not in data
+            assert hashlib.sha256(b"'hunter2'").hexdigest().encode() \
+                not in data
+
+    def test_nothing_recorded(self):
+        result = self.agent.run('reload', reskey={'count': 2})
+        assert result.code == ocf.OCF_SUCCESS
+        assert 'changed: count,level,state' in result.messages
@@ -0,0 +1,350 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Background health sampling, so that ``monitor`` only has to read a result.
+
+Some services can only be checked thoroughly by a health check that takes
+several seconds. Running it in every ``monitor`` eats into the operation's
+timeout and burns CPU on every node. Instead, ``start`` can launch a
+:class:`Sampler`: a small background process that runs the agent's health
+check over and over at its own pace and publishes each result, with a
+timestamp, in a memory-mapped file under
+:attr:`ocf.environment.Environment.state_dir`. ``monitor`` then just reads the
+latest result, checks that the sampler is still alive and the result is
+recent, and returns straight away.
+
+Usage::
+
+    class FooAgent(ocf.ResourceAgent):
+        @property
+        def sampler(self):
+            return ocf.sampler.Sampler('health', self.health_check,
+                                       interval=10, max_age=30)
+
+        def health_check(self):
+            # May take a while
+            ...
+            return ocf.OCF_SUCCESS
+
+        @ocf.Action(timeout=20)
+        def start(self):
+            ...
+            self.sampler.start()
+            return ocf.OCF_SUCCESS
+
+        @ocf.Action(timeout=20)
+        def stop(self):
+            self.sampler.stop()
+            ...
+
+        @ocf.Action(timeout=20, depth=0, interval=10)
+        def monitor(self):
+            return self.sampler.status()
+
+The health check function is called with no arguments and should return one
+of the ``OCF_`` exit codes, optionally as a tuple with a message. Any
+exception it raises is recorded as :data:`ocf.OCF_ERR_GENERIC`.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import errno
+import logging
+import mmap
+import ocf
+import ocf.logging
+import ocf.pidfile
+import os
+import signal
+import struct
+import time
+
+from ocf.util import makedirs, monotonic
+
+# Layout of the snapshot file: magic, sequence number, sampler PID, status,
+# time of the sample (ocf.util.monotonic), duration of the check, length of
+# the message; followed by the message itself. The sampler's PID and start
+# time are also recorded in a PID file next to it, written as it is forked.
+_HEADER = struct.Struct('=4sIiiddH')
+_MAGIC = b'OCFS'
+_MAX_MESSAGE = 256
+_SIZE = _HEADER.size + _MAX_MESSAGE
+
+#: A sample read by :meth:`Sampler.read`. ``age`` is the number of seconds
+#: since the sample was taken, and ``duration`` the number of seconds the
+#: health check took.
+Snapshot = collections.namedtuple(
+    'Snapshot', ('status', 'message', 'age', 'duration', 'pid'))
+
+
+def _normalise(result):
+    if isinstance(result, tuple):
+        status, message = result
+    else:
+        status, message = result, ''
+    return int(status), str(message or '')
+
+
+class Sampler(object):
+    """
+    Runs a health check in a background process and publishes its results.
+
+    :param str name: Name of the sampler, used in the file name of the
+      snapshot. Must be unique within the resource instance.
+    :param func: Health check function. See above.
+    :param float interval: Number of seconds between the start of one health
+      check and the start of the next.
+    :param float max_age: Maximum age in seconds of a sample for it to be
+      considered fresh by :meth:`status`. Defaults to three times
+      ``interval``.
+    """
+    def __init__(self, name, func, interval=10, max_age=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.max_age = max_age if max_age is not None else 3 * interval
+        self.path = os.path.join(
+            ocf.env.state_dir, "{type}-{instance}.sampler.{name}".format(
+                type=ocf.env.resource_type,
+                instance=ocf.env.resource_instance, name=name))
+        self.pid_file = ocf.pidfile.PidFile(self.path + '.pid')
+
+    def read(self):
+        """
+        Returns the latest :data:`Snapshot`, or ``None`` if there is none.
+
+        This opens and maps the snapshot file and copies out the sample; it
+        does not check whether the sampler is still running.
+        """
+        try:
+            fd = os.open(self.path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+        try:
+            m = mmap.mmap(fd, _SIZE, mmap.MAP_SHARED, mmap.PROT_READ)
+        except (ValueError, EnvironmentError):
+            # The file is too short: the sampler has only just created it
+            return None
+        finally:
+            os.close(fd)
+
+        try:
+            # The sampler increments the sequence number before and after
+            # updating the sample, so an odd or changed number means we caught
+            # it in the middle of an update.
+            for _ in range(100):
+                header = _HEADER.unpack_from(m)
+                magic, seq, pid, status, stamp, duration, length = header
+                message = m[_HEADER.size:_HEADER.size + length]
+                if seq % 2 == 0 and _HEADER.unpack_from(m)[1] == seq:
+                    break
+            else:
+                return None
+        finally:
+            m.close()
+
+        if magic != _MAGIC or seq == 0:
+            return None
+
+        return Snapshot(status, message.decode('utf-8', 'replace'),
+                        monotonic() - stamp, duration, pid)
+
+    def is_running(self):
+        """
+        Tests whether the sampler process is running, even if it has not yet
+        published a sample.
+
+        The process's start time is checked as well as its PID (see
+        :class:`ocf.pidfile.PidFile`), so an unrelated process which has been
+        given the same PID does not count.
+        """
+        return self.pid_file.is_running()
+
+    def status(self):
+        """
+        Returns the health check's latest result as an ``OCF_`` exit code.
+
+        Returns :data:`ocf.OCF_NOT_RUNNING` if the sampler was never started,
+        and :data:`ocf.OCF_ERR_GENERIC` if it has died or its latest sample is
+        older than ``max_age``. While the first sample is being taken,
+        returns :data:`ocf.OCF_SUCCESS` for up to ``max_age`` seconds.
+        """
+        running = self.is_running()
+        snapshot = self.read()
+
+        if snapshot is None:
+            if not running:
+                return ocf.OCF_NOT_RUNNING
+            try:
+                age = time.time() - os.stat(self.pid_file.path).st_mtime
+            except OSError:
+                age = 0
+            if age > self.max_age:
+                ocf.log.error("Health sampler {name} has published nothing "
+                              "in {age:.0f}s".format(name=self.name, age=age))
+                return ocf.OCF_ERR_GENERIC
+            ocf.log.debug("Health sampler {name} has no sample yet".format(
+                name=self.name))
+            return ocf.OCF_SUCCESS
+
+        if not running:
+            ocf.log.error("Health sampler {name} (PID {pid}) has died".format(
+                name=self.name, pid=snapshot.pid))
+            return ocf.OCF_ERR_GENERIC
+
+        if snapshot.age > self.max_age:
+            ocf.log.error("Health sample {name} is {age:.0f}s old".format(
+                name=self.name, age=snapshot.age))
+            return ocf.OCF_ERR_GENERIC
+
+        if snapshot.status != ocf.OCF_SUCCESS and snapshot.message:
+            ocf.log.error(snapshot.message)
+
+        return snapshot.status
+
+    def start(self, wait=True, timeout=None):
+        """
+        Starts the sampler process, unless it is already running.
+
+        :param bool wait: Wait until the first sample has been published, so
+          that a ``monitor`` straight after ``start`` sees it.
+        :param float timeout: Maximum number of seconds to wait. Defaults to
+          the time left until the action's deadline.
+
+        Returns ``True`` if the sampler is running (and, if ``wait`` was
+        given, has published a sample).
+        """
+        if self.is_running():
+            return True
+
+        makedirs(os.path.dirname(self.path))
+
+        # Prepare an empty snapshot file and swap it into place
+        tmp = "{path}.{pid}".format(path=self.path, pid=os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(b'\0' * _SIZE)
+        os.rename(tmp, self.path)
+
+        pid = os.fork()
+        if pid == 0:
+            # Daemonise, so that we are neither waited for by the CRM nor
+            # killed along with the agent
+            try:
+                os.setsid()
+                child = os.fork()
+                if child != 0:
+                    # Record who the sampler is before the agent carries on
+                    self.pid_file.write(child)
+                    os._exit(0)
+                self._run()
+            finally:
+                os._exit(0)
+
+        os.waitpid(pid, 0)
+
+        if not wait:
+            return True
+
+        if timeout is None:
+            timeout = ocf.env.time_left
+        deadline = None if timeout is None else monotonic() + timeout
+
+        while deadline is None or monotonic() < deadline:
+            if self.read() is not None:
+                return True
+            time.sleep(0.05)
+
+        return False
+
+    def stop(self, timeout=5):
+        """
+        Stops the sampler process, if it is running, and removes its files.
+        The process is sent ``SIGKILL`` if it hasn't exited after ``timeout``
+        seconds.
+
+        :raises ocf.pidfile.StillRunning: if it survives even that.
+        """
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        self.pid_file.stop(timeout=timeout)
+
+    def _run(self):
+        # Let go of everything inherited from the agent, such as locks held
+        # on its behalf (see ocf.util.semaphore) and its log files
+        try:
+            maxfd = os.sysconf('SC_OPEN_MAX')
+        except (AttributeError, ValueError, OSError):
+            maxfd = 1024
+        os.closerange(3, maxfd)
+
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+            os.dup2(devnull, fd)
+        if devnull > 2:
+            os.close(devnull)
+        os.chdir('/')
+
+        # The log handlers' files have just been closed; open them afresh
+        logging.getLogger().handlers = []
+        ocf.logging._setup_logging()
+        signal.signal(signal.SIGTERM, lambda signum, frame: os._exit(0))
+
+        fd = os.open(self.path, os.O_RDWR)
+        inode = os.fstat(fd).st_ino
+        m = mmap.mmap(fd, _SIZE, mmap.MAP_SHARED,
+                      mmap.PROT_READ | mmap.PROT_WRITE)
+        os.close(fd)
+
+        seq = 0
+        pid = os.getpid()
+
+        while True:
+            started = monotonic()
+            try:
+                status, message = _normalise(self.func())
+            except Exception as e:
+                status, message = ocf.OCF_ERR_GENERIC, "{cls}: {e}".format(
+                    cls=e.__class__.__name__, e=e)
+            finished = monotonic()
+
+            # Stop if the sampler has been stopped or restarted
+            try:
+                if os.stat(self.path).st_ino != inode:
+                    return
+            except OSError:
+                return
+
+            data = message.encode('utf-8')[:_MAX_MESSAGE]
+            _HEADER.pack_into(m, 0, _MAGIC, seq + 1, pid, status, finished,
+                              finished - started, len(data))
+            m[_HEADER.size:_HEADER.size + len(data)] = data
+            seq += 2
+            _HEADER.pack_into(m, 0, _MAGIC, seq, pid, status, finished,
+                              finished - started, len(data))
+
+            time.sleep(max(0, self.interval - (monotonic() - started)))
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,89 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf
+import ocf.pidfile
+import ocf.proc
+import ocf.sampler
+import ocf.testing
+import ocf.util
+import os
+import time
+
+
+class SamplerTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(SamplerTests, self).setUp()
+        self.delay = 0
+        self.result = ocf.OCF_SUCCESS
+        self.sampler = ocf.sampler.Sampler('health', self.check, interval=0.1,
+                                           max_age=10)
+
+    def tearDown(self):
+        self.sampler.stop(timeout=1)
+
+    def check(self):
+        time.sleep(self.delay)
+        return self.result
+
+    def test_status(self):
+        assert self.sampler.status() == ocf.OCF_NOT_RUNNING
+
+        self.result = (ocf.OCF_ERR_GENERIC, 'unhealthy')
+        assert self.sampler.start(timeout=5)
+        assert self.sampler.is_running()
+        assert self.sampler.status() == ocf.OCF_ERR_GENERIC
+        assert self.sampler.read().message == 'unhealthy'
+
+        self.sampler.stop(timeout=1)
+        assert not self.sampler.is_running()
+        assert self.sampler.status() == ocf.OCF_NOT_RUNNING
+
+    def test_before_first_sample(self):
+        self.delay = 30
+        assert self.sampler.start(wait=False)
+        assert self.sampler.read() is None
+        assert self.sampler.is_running()
+        assert self.sampler.status() == ocf.OCF_SUCCESS
+
+        pid = self.sampler.pid_file.read_pid()
+        self.sampler.stop(timeout=1)
+        assert not self.sampler.is_running()
+        assert not ocf.pidfile.pid_exists(pid) or \
+            ocf.proc.read_stat(pid)[0] in 'ZX'
+
+    def test_reused_pid(self):
+        assert self.sampler.start(timeout=5)
+        ident = self.sampler.pid_file.read_ident()
+
+        # Pretend the sampler died and its PID went to another process
+        with open(self.sampler.pid_file.ident_path, 'w') as f:
+            f.write("{0}\n{1}\n".format(ident[0], ident[1] + 1))
+        assert not self.sampler.is_running()
+        assert self.sampler.status() == ocf.OCF_ERR_GENERIC
+
+        # Put it back so that it can be stopped
+        self.sampler.pid_file.record(ident[0])
+
+    def test_fds_not_inherited(self):
+        lock = os.path.join(self.tmpdir, 'lock')
+        with ocf.util.semaphore(lock, 1, timeout=1):
+            assert self.sampler.start(timeout=5)
+
+        # The sampler must not be holding the agent's slot
+        with ocf.util.semaphore(lock, 1, timeout=1):
+            pass
@@ -0,0 +1,215 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Node-wide cache of expensive computations, shared between processes.
+
+When a node joins the cluster, the CRM probes every resource on it at more or
+less the same time. If each agent process then lists processes, mounts or
+listening sockets, the same work is done dozens of times over. This module
+lets the first process that needs such a value compute it while holding a lock,
+and publish the result in :attr:`ocf.environment.Environment.state_dir` for a
+limited time. Processes arriving while the value is being computed wait for it
+instead of computing it themselves, and later processes simply read it.
+
+Values are stored using :mod:`marshal`, so they must be made up only of the
+core Python types (``None``, numbers, strings, bytes, tuples, lists, sets and
+dictionaries). Cache keys are node-wide, so should be specific enough not to
+clash with keys used by unrelated agents.
+
+Usage::
+
+    @ocf.shared_cache.cached('mounts', ttl=5)
+    def mounts():
+        with open('/proc/self/mounts') as f:
+            return [line.split()[:3] for line in f]
+
+    def monitor(self):
+        if self.directory not in [m[1] for m in mounts()]:
+            return ocf.OCF_NOT_RUNNING
+        ...
+
+Expired entries are removed automatically by any process that needs to
+compute a new value.
+"""
+
+import errno
+import functools
+import marshal
+import ocf
+import os
+import re
+import time
+
+from ocf.util import atomic_write, locked, LockTimeout
+
+#: Entries whose expiry lies further than this many seconds in the past are
+#: removed from the cache directory.
+GRACE = 60
+
+_valid_key = re.compile(r'^[A-Za-z0-9_.:-]+$')
+
+# Values already obtained by this process, to save re-reading them
+_memo = {}
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    _memo.clear()
+
+
+def _cache_dir():
+    return os.path.join(ocf.env.state_dir, 'cache')
+
+
+def _read(path, now):
+    try:
+        with open(path, 'rb') as f:
+            expires, value = marshal.loads(f.read())
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return None
+
+    if expires <= now:
+        return None
+
+    return expires, value
+
+
+def _sweep(directory, now):
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+
+    for name in names:
+        if not name.endswith('.cache'):
+            continue
+
+        path = os.path.join(directory, name)
+        if _read(path, now - GRACE) is None:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def get(key, func, ttl=5, timeout=10):
+    """
+    Obtain the value of ``func()`` for ``key``, sharing it between processes.
+
+    If a value for ``key`` that is less than ``ttl`` seconds old is available,
+    it is returned without calling ``func``. Otherwise, an exclusive lock is
+    taken for ``key``, ``func`` is called, and its result is published for
+    other processes to use before the lock is released. Processes that want
+    the same key while the lock is held wait for the result.
+
+    :param str key: Name of the cached value. May contain only letters,
+      digits, and the characters ``_``, ``.``, ``:`` and ``-``.
+    :param func: Function taking no arguments which computes the value.
+    :param float ttl: Number of seconds for which the value may be reused.
+    :param float timeout: Maximum number of seconds to wait for another
+      process to compute the value. If this elapses, ``func`` is called
+      without the result being cached.
+    """
+    if not _valid_key.match(key):
+        raise ValueError("invalid shared cache key: {key!r}".format(key=key))
+
+    now = time.time()
+
+    # Fast path: we already know the value
+    entry = _memo.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    directory = _cache_dir()
+    path = os.path.join(directory, key + '.cache')
+
+    # Another process may already have published it
+    entry = _read(path, now)
+    if entry is not None:
+        _memo[key] = entry
+        return entry[1]
+
+    computing = False
+    try:
+        with locked(os.path.join(directory, key + '.lock'), timeout=timeout):
+            # Somebody may have computed the value while we were waiting
+            now = time.time()
+            entry = _read(path, now)
+            if entry is not None:
+                _memo[key] = entry
+                return entry[1]
+
+            computing = True
+            value = func()
+            entry = (time.time() + ttl, value)
+
+            try:
+                atomic_write(path, marshal.dumps(entry))
+            except (IOError, OSError) as e:
+                ocf.log.debug("Unable to write shared cache {p}: {e}".format(
+                    p=path, e=e))
+            _memo[key] = entry
+
+        _sweep(directory, now)
+        return value
+    except LockTimeout:
+        ocf.log.warning("Timed out waiting for shared cache {key}".format(
+            key=key))
+        return func()
+    except (IOError, OSError) as e:
+        # Not being able to create the lock file must not stop the agent, but
+        # errors raised by func() itself are none of our business
+        if computing or e.errno not in (errno.EACCES, errno.EPERM,
+                                        errno.ENOENT, errno.EROFS):
+            raise
+        return func()
+
+
+def invalidate(key):
+    """
+    Discard the cached value for ``key``, if any.
+
+    The next call to :func:`get` for ``key``, in any process, computes the
+    value afresh.
+    """
+    _memo.pop(key, None)
+
+    try:
+        os.unlink(os.path.join(_cache_dir(), key + '.cache'))
+    except OSError:
+        pass
+
+
+def cached(key, ttl=5, timeout=10):
+    """
+    Decorator for functions whose result should be shared using :func:`get`.
+
+    The decorated function must take no arguments. See :func:`get` for the
+    meaning of the arguments.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper():
+            return get(key, func, ttl=ttl, timeout=timeout)
+
+        wrapper.invalidate = functools.partial(invalidate, key)
+        return wrapper
+
+    return decorator
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,80 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.shared_cache
+import ocf.testing
+import os
+import time
+
+
+class SharedCacheTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(SharedCacheTests, self).setUp()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return {'calls': self.calls}
+
+    def test_value_is_shared(self):
+        assert ocf.shared_cache.get('test', self.compute) == {'calls': 1}
+
+        # Forget the in-process copy, as if we were another process
+        ocf.shared_cache._reset()
+        assert ocf.shared_cache.get('test', self.compute) == {'calls': 1}
+        assert self.calls == 1
+
+    def test_single_flight(self):
+        counter = os.path.join(self.tmpdir, 'counter')
+
+        def produce():
+            with open(counter, 'a') as f:
+                f.write('x')
+            time.sleep(0.5)
+            return 'value'
+
+        pids = []
+        for i in range(2):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    if ocf.shared_cache.get('test', produce) == 'value':
+                        status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+
+        for pid in pids:
+            assert os.waitpid(pid, 0)[1] == 0
+        with open(counter) as f:
+            assert len(f.read()) == 1
+
+    def test_expired_value_is_recomputed(self):
+        ocf.shared_cache.get('test', self.compute, ttl=0)
+        assert ocf.shared_cache.get('test', self.compute, ttl=0) == \
+            {'calls': 2}
+
+    def test_invalidate(self):
+        cached = ocf.shared_cache.cached('test')(self.compute)
+        cached()
+        cached.invalidate()
+        assert cached() == {'calls': 2}
+
+    def test_invalid_key(self):
+        self.assertRaises(ValueError, ocf.shared_cache.get, '../x',
+                          self.compute)
@@ -0,0 +1,133 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import json
+import ocf
+import ocf.lifecycle
+import os
+
+from ocf.util import atomic_write
+
+# States waiting to be saved at the end of the action
+_deferred = []
+
+
+def _reset():
+    # Called by ocf.testing.reset() between in-process invocations
+    del _deferred[:]
+
+
+class State(dict):
+    """
+    A small dictionary persisted across resource agent invocations.
+
+    Every invocation of a resource agent is a separate process, so anything an
+    agent wishes to remember from one action to the next must be stored on
+    disk. This class provides a simple dictionary whose contents are loaded
+    from a file under :attr:`ocf.environment.Environment.state_dir` when it is
+    created, and written back to that file by :meth:`save`.
+
+    The file is specific to the resource type and instance, so each resource
+    instance has its own separate ``State`` for a given ``name``. Keys should
+    be strings, and values must be serialisable as JSON.
+
+    :param str name: Name of this piece of state, such as ``logdedup``. Used to
+      construct the file name.
+    :param str instance: The resource instance to which the state belongs.
+      Optional; defaults to
+      :attr:`ocf.environment.Environment.resource_instance`.
+
+    Usage::
+
+        state = ocf.state.State('counters')
+        state['runs'] = state.get('runs', 0) + 1
+        state.save()
+
+    State that changes several times during an action can be saved with
+    ``defer=True``, in which case it is written only once, by a teardown hook
+    (see :mod:`ocf.lifecycle`) at the end of the action.
+
+    .. note::
+
+       The file is replaced atomically when saved, so a reader never sees a
+       partially-written file. Concurrent invocations for the *same* resource
+       instance are unusual (the CRM serialises them), so no locking is
+       performed: if two processes save the same state, the last one wins.
+    """
+    def __init__(self, name, instance=None):
+        super(State, self).__init__()
+
+        if instance is None:
+            instance = ocf.env.resource_instance
+
+        self.name = name
+        self.path = os.path.join(
+            ocf.env.state_dir, "{type}-{instance}.{name}".format(
+                type=ocf.env.resource_type, instance=instance, name=name))
+
+        self.load()
+
+    def load(self):
+        """
+        (Re-)load the state from disk, discarding any unsaved changes.
+
+        A missing or corrupt state file results in an empty dictionary.
+        """
+        self.clear()
+
+        try:
+            with open(self.path, 'rb') as f:
+                data = json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError, ValueError):
+            return
+
+        if isinstance(data, dict):
+            self.update(data)
+
+    def save(self, defer=False):
+        """
+        Write the state to disk.
+
+        :param bool defer: Write the state at the end of the action instead of
+          now.
+        """
+        if defer:
+            if not any(state is self for state in _deferred):
+                _deferred.append(self)
+            return
+
+        data = json.dumps(self, sort_keys=True, separators=(',', ':'))
+        atomic_write(self.path, data.encode('utf-8'))
+
+    def remove(self):
+        """
+        Forget the state, both in memory and on disk.
+        """
+        self.clear()
+
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+@ocf.lifecycle.on_teardown
+def _save_deferred(ret):
+    while _deferred:
+        _deferred.pop(0).save()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,298 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Stopping a set of processes all at once, escalating to ``SIGKILL``.
+
+Services with many worker processes are usually stopped with a loop which
+signals one process, sleeps, checks whether it has gone, and moves on to the
+next. :func:`terminate` instead signals every process in the set at the same
+time and then waits for all of them together, on one ``pidfd`` each in a
+single ``epoll`` set, so that it returns as soon as the last one has exited.
+Whatever is left when the timeout expires is sent ``SIGKILL``.
+
+The set of processes can be given as any combination of:
+
+* one or more PIDs, optionally with all their descendants (``tree=True``);
+* a process group (``pgid``);
+* a cgroup directory (``cgroup``), including its sub-groups.
+
+Usage::
+
+    @ocf.Action(timeout=60)
+    def stop(self):
+        summary = ocf.terminate.terminate(pgid=self.pid_file.running_pid())
+        if summary.survivors:
+            return ocf.OCF_ERR_GENERIC
+        return ocf.OCF_SUCCESS
+
+Where ``pidfd`` is not available (before Linux 5.3 or Python 3.9), the
+processes are checked in ``/proc`` with exponential back-off instead.
+"""
+
+from __future__ import absolute_import
+
+import collections
+import errno
+import ocf
+import ocf.proc
+import ocf.wait
+import os
+import select
+import signal
+import time
+
+#: The outcome of :func:`terminate`: lists of the PIDs which exited after the
+#: first signal (``graceful``), which had to be sent ``SIGKILL`` (``forced``),
+#: and which were still there after that (``survivors``).
+Summary = collections.namedtuple('Summary', ('graceful', 'forced',
+                                             'survivors'))
+
+
+def group_members(pgid):
+    """
+    Returns the PIDs of the processes in process group ``pgid``.
+    """
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            if os.getpgid(int(name)) == pgid:
+                pids.append(int(name))
+        except OSError:
+            pass
+    return pids
+
+
+def cgroup_members(path):
+    """
+    Returns the PIDs of the processes in the cgroup at ``path`` (such as
+    ``/sys/fs/cgroup/system.slice/foo.service``) and its sub-groups.
+    """
+    pids = []
+    for directory, _, files in os.walk(path):
+        if 'cgroup.procs' not in files:
+            continue
+        try:
+            with open(os.path.join(directory, 'cgroup.procs')) as f:
+                pids.extend(int(line) for line in f if line.strip())
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+    return pids
+
+
+class _Processes(object):
+    """
+    The set of processes being terminated, each with a ``pidfd`` if possible.
+    """
+    def __init__(self):
+        self.fds = {}
+
+    def add(self, pid):
+        """
+        Starts tracking ``pid``. Returns ``False`` if it has already gone.
+        """
+        if pid in self.fds:
+            return True
+
+        fd = None
+        pidfd_open = getattr(os, 'pidfd_open', None)
+        if pidfd_open is not None:
+            try:
+                fd = pidfd_open(pid)
+            except OSError as e:
+                if e.errno == errno.ESRCH:
+                    return False
+                # Not supported by the kernel; fall back to polling
+
+        if fd is None and ocf.proc.exited(pid):
+            return False
+
+        self.fds[pid] = fd
+        return True
+
+    def signal(self, pids, sig):
+        send = getattr(signal, 'pidfd_send_signal', None)
+        for pid in pids:
+            fd = self.fds[pid]
+            try:
+                # Signalling through the pidfd can't hit an unrelated
+                # process which has since been given the same PID
+                if fd is not None and send is not None:
+                    send(fd, sig)
+                else:
+                    os.kill(pid, sig)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def wait(self, pids, deadline):
+        """
+        Waits until all of ``pids`` have exited or ``deadline`` has passed.
+        Returns the set of those which have exited.
+        """
+        exited = set()
+        polled = set(pid for pid in pids if self.fds[pid] is None)
+        ep = select.epoll() if len(polled) < len(pids) else None
+        by_fd = {}
+        for pid in pids:
+            if pid not in polled:
+                ep.register(self.fds[pid], select.EPOLLIN)
+                by_fd[self.fds[pid]] = pid
+
+        interval = ocf.wait.FIRST_INTERVAL
+        try:
+            while len(exited) < len(pids):
+                timeout = ocf.wait.time_until(deadline)
+                if polled:
+                    timeout = interval if timeout is None else \
+                        min(interval, timeout)
+                    interval = min(interval * ocf.wait.BACKOFF,
+                                   ocf.wait.MAX_INTERVAL)
+
+                if ep is not None and by_fd:
+                    events = ep.poll(-1 if timeout is None else timeout)
+                    for fd, _ in events:
+                        ep.unregister(fd)
+                        exited.add(by_fd.pop(fd))
+                elif timeout:
+                    time.sleep(timeout)
+
+                for pid in list(polled):
+                    if ocf.proc.exited(pid):
+                        polled.discard(pid)
+                        exited.add(pid)
+
+                if ocf.wait.time_until(deadline) == 0:
+                    break
+        finally:
+            if ep is not None:
+                ep.close()
+
+        return exited
+
+    def close(self):
+        for fd in self.fds.values():
+            if fd is not None:
+                os.close(fd)
+        self.fds.clear()
+
+
+def terminate(pids=(), pgid=None, cgroup=None, tree=False,
+              sig=signal.SIGTERM, timeout=None, kill_timeout=5):
+    """
+    Sends ``sig`` to a set of processes, waits for them to exit, and sends
+    ``SIGKILL`` to any that don't. Returns a :data:`Summary`.
+
+    :param pids: A PID or a list of PIDs.
+    :param bool tree: Include all descendants of ``pids``.
+    :param int pgid: A process group; every process in it is included.
+    :param str cgroup: Path to a cgroup directory; every process in it and its
+      sub-groups is included.
+    :param int sig: The signal to send first.
+    :param float timeout: Seconds to wait before sending ``SIGKILL``. Defaults
+      to 80% of the action's timeout
+      (:attr:`ocf.environment.Environment.timeout`), or 10 seconds.
+    :param float kill_timeout: Seconds to wait for processes to die after
+      ``SIGKILL``.
+
+    Neither wait extends beyond the action's deadline. Processes which join
+    the process group or cgroup while waiting are killed too. The calling
+    process itself is never included.
+    """
+    if isinstance(pids, int):
+        pids = [pids]
+
+    if pgid is not None and pgid == os.getpgid(0):
+        raise ValueError("refusing to terminate our own process group")
+
+    if timeout is None:
+        timeout = (ocf.env.timeout or 12.5) * 0.8
+
+    def members():
+        found = set(pids)
+        if tree and pids:
+            table = ocf.proc.ProcessTable(('ppid',))
+            for pid in pids:
+                found.update(p.pid for p in table.descendants(pid))
+        if pgid is not None:
+            found.update(group_members(pgid))
+        if cgroup is not None:
+            found.update(cgroup_members(cgroup))
+        found.discard(os.getpid())
+        return found
+
+    procs = _Processes()
+    try:
+        # Open the pidfds before signalling, so that no PID can be reused
+        targets = [pid for pid in members() if procs.add(pid)]
+        # Each process is signalled through its pidfd rather than with
+        # killpg(), so that none is signalled twice
+        procs.signal(targets, sig)
+
+        exited = procs.wait(targets, ocf.wait.deadline_after(timeout))
+        graceful = set(exited)
+
+        # Anything still running, or which has appeared since, gets SIGKILL
+        forced = [pid for pid in targets if pid not in exited]
+        forced.extend(pid for pid in members()
+                      if pid not in procs.fds and procs.add(pid))
+        if forced:
+            ocf.log.warning("{n} process(es) did not exit after {t:.1f}s; "
+                            "killing them".format(n=len(forced), t=timeout))
+            # Whatever cgroup.kill killed needn't be killed again
+            killed = _kill_cgroup(cgroup)
+            procs.signal([pid for pid in forced if pid not in killed],
+                         signal.SIGKILL)
+            exited.update(procs.wait(forced,
+                                     ocf.wait.deadline_after(kill_timeout)))
+
+        survivors = [pid for pid in forced if pid not in exited]
+        survivors.extend(pid for pid in members()
+                         if pid not in procs.fds and not ocf.proc.exited(pid))
+        if survivors:
+            ocf.log.error("Processes still running after SIGKILL: {pids}"
+                          .format(pids=", ".join(map(str, survivors))))
+
+        return Summary(sorted(graceful), sorted(forced), sorted(survivors))
+    finally:
+        procs.close()
+
+
+def _kill_cgroup(cgroup):
+    """
+    Kills everything in ``cgroup`` atomically, using ``cgroup.kill`` (cgroup
+    v2 and Linux 5.14 or later), if possible. Returns the set of PIDs killed.
+    """
+    if cgroup is None:
+        return set()
+    path = os.path.join(cgroup, 'cgroup.kill')
+    if not os.path.exists(path):
+        return set()
+
+    # cgroup.kill covers sub-groups too
+    members = set(cgroup_members(cgroup))
+    try:
+        with open(path, 'w') as f:
+            f.write('1')
+    except (IOError, OSError):
+        return set()
+    return members
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,81 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.proc
+import ocf.terminate
+import os
+import subprocess
+import time
+import unittest
+
+from ocf.util import monotonic
+
+
+class TerminateTests(unittest.TestCase):
+    def setUp(self):
+        self.procs = []
+
+    def tearDown(self):
+        for proc in self.procs:
+            proc.kill()
+            proc.wait()
+
+    def spawn(self, script):
+        proc = subprocess.Popen(['sh', '-c', script], start_new_session=True)
+        self.procs.append(proc)
+        return proc
+
+    def wait_for_children(self, pid, count):
+        for _ in range(200):
+            pids = ocf.terminate.group_members(pid)
+            if len(pids) >= count:
+                return pids
+            time.sleep(0.01)
+        self.fail("children did not start")
+
+    def test_graceful(self):
+        proc = self.spawn('exec sleep 30')
+        started = monotonic()
+        summary = ocf.terminate.terminate(proc.pid, timeout=10)
+        assert summary == ([proc.pid], [], [])
+        assert monotonic() - started < 5
+
+    def test_forced(self):
+        proc = self.spawn('trap "" TERM; sleep 30 & wait; wait')
+        self.wait_for_children(proc.pid, 2)
+        summary = ocf.terminate.terminate(proc.pid, timeout=0.2)
+        assert summary.forced == [proc.pid]
+        assert summary.survivors == []
+
+    def test_process_group(self):
+        proc = self.spawn('sleep 30 & sleep 30 & wait')
+        pids = self.wait_for_children(proc.pid, 3)
+        summary = ocf.terminate.terminate(pgid=proc.pid, timeout=10)
+        assert sorted(summary.graceful) == sorted(pids)
+        # Only zombies remain, until they are reaped
+        assert all(ocf.proc.exited(pid)
+                   for pid in ocf.terminate.group_members(proc.pid))
+
+    def test_tree(self):
+        proc = self.spawn('sleep 30 & sleep 30 & wait')
+        pids = self.wait_for_children(proc.pid, 3)
+        summary = ocf.terminate.terminate(proc.pid, tree=True, timeout=10)
+        assert sorted(summary.graceful) == sorted(pids)
+
+    def test_own_group_refused(self):
+        with self.assertRaises(ValueError):
+            ocf.terminate.terminate(pgid=os.getpgid(0))
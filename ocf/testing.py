@@ -0,0 +1,277 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Run resource agent actions in-process, for unit and load testing.
+
+A resource agent normally runs once per process: it reads its configuration
+from the environment and command line through :data:`ocf.env`, logs through the
+handlers set up when :mod:`ocf` is imported, and exits with the action's
+result. :func:`run` instead runs an action of a :class:`ocf.ra.ResourceAgent`
+sub-class within the calling process, against an injected environment and
+command line. It captures the exit code, the log records and anything written
+to ``stdout`` and ``stderr``, and then puts everything back as it was. All the
+state that is cached for the duration of an invocation (:data:`ocf.env`
+properties, parameter values, deferred :mod:`ocf.state` saves, and the caches
+of :mod:`ocf.agents`, :mod:`ocf.shared_cache`, :mod:`ocf.proc`,
+:mod:`ocf.probes` and :mod:`ocf.filecache`) is reset before each call, so calls
+are independent of each other.
+
+Usage::
+
+    import ocf.testing
+
+    def test_start_then_monitor(self):
+        agent = ocf.testing.AgentRunner(
+            DummyAgent, rsctmp=self.tmpdir,
+            reskey={'state': os.path.join(self.tmpdir, 'state')})
+
+        assert agent.run('start').code == ocf.OCF_SUCCESS
+
+        result = agent.run('monitor', reskey={'CRM_meta_interval': '10000'})
+        assert result.code == ocf.OCF_SUCCESS
+        assert 'Monitoring...' in result.messages
+"""
+
+from __future__ import absolute_import
+
+import logging
+import ocf
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import six
+
+# Prefixes of environment variables that influence resource agents; these are
+# not inherited from the calling process's environment.
+_ENV_PREFIXES = ('OCF_', 'HA_', 'CRM_')
+
+# Modules with a _reset() function forgetting what they have cached
+_RESETTABLE = ('ocf.state', 'ocf.agents', 'ocf.shared_cache', 'ocf.proc',
+               'ocf.probes', 'ocf.filecache')
+
+
+class Result(object):
+    """
+    The outcome of an action run by :func:`run`.
+
+    .. attribute:: code
+
+       The exit code of the action.
+
+    .. attribute:: records
+
+       The :class:`logging.LogRecord` instances logged during the action.
+
+    .. attribute:: stdout
+
+       Everything written to :data:`sys.stdout` during the action.
+
+    .. attribute:: stderr
+
+       Everything written to :data:`sys.stderr` during the action.
+    """
+    def __init__(self, code, records, stdout, stderr):
+        self.code = code
+        self.records = records
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def messages(self):
+        """
+        The messages of all the :attr:`records`, as strings.
+        """
+        return [r.getMessage() for r in self.records]
+
+    def __repr__(self):
+        return "<Result code={code} records={n}>".format(
+            code=self.code, n=len(self.records))
+
+
+class _CaptureHandler(logging.Handler):
+    def __init__(self):
+        super(_CaptureHandler, self).__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def reset(agent_class=None):
+    """
+    Forget all the state cached during an invocation.
+
+    Called by :func:`run` before and after each action. This resets
+    :data:`ocf.env` (including its action start time), the values of
+    ``agent_class``'s parameters, the state saves deferred by
+    :mod:`ocf.state`, and the per-invocation caches of :mod:`ocf.agents`,
+    :mod:`ocf.shared_cache`, :mod:`ocf.proc`, :mod:`ocf.probes` and
+    :mod:`ocf.filecache`.
+    """
+    ocf.env.__dict__.clear()
+    ocf.env.__init__()
+
+    if agent_class is not None:
+        for param in agent_class._PARAMETERS.values():
+            param.__dict__.pop('_value', None)
+
+    # Only reset modules that have been imported, rather than importing them
+    for name in _RESETTABLE:
+        module = sys.modules.get(name)
+        if module is not None:
+            module._reset()
+
+
+def _environ(env, reskey, rsctmp, instance):
+    environ = dict((k, v) for k, v in os.environ.items()
+                   if not k.startswith(_ENV_PREFIXES))
+    environ['OCF_RESOURCE_INSTANCE'] = instance
+
+    # Keep debug logging on so that debug messages can be checked
+    environ['HA_debug'] = '1'
+
+    if rsctmp is not None:
+        environ['HA_RSCTMP'] = rsctmp
+
+    for name, value in (reskey or {}).items():
+        environ['OCF_RESKEY_' + name] = str(value)
+
+    environ.update(env or {})
+    return environ
+
+
+def _replace_environ(environ):
+    # Only touch the variables that differ; os.environ.clear() is slow
+    for name in [k for k in os.environ if k not in environ]:
+        del os.environ[name]
+
+    for name, value in environ.items():
+        if os.environ.get(name) != value:
+            os.environ[name] = value
+
+
+def run(agent_class, action, env=None, reskey=None, argv=None, rsctmp=None,
+        instance='test'):
+    """
+    Runs ``action`` of ``agent_class`` within this process.
+
+    :param agent_class: The :class:`ocf.ra.ResourceAgent` sub-class.
+    :param str action: The action to run, such as ``monitor``. May be
+      ``None`` to run the agent without an action.
+    :param dict env: Environment variables to set for the action. Variables
+      whose names start with ``OCF_``, ``HA_`` or ``CRM_`` are not inherited
+      from this process's environment.
+    :param dict reskey: Resource parameters, set as ``OCF_RESKEY_<name>``
+      environment variables.
+    :param list argv: Command line arguments after the action. Optional.
+    :param str rsctmp: Value for ``HA_RSCTMP``. Optional, but tests should
+      normally give a temporary directory here.
+    :param str instance: Value for ``OCF_RESOURCE_INSTANCE``.
+
+    Returns a :class:`Result`. No :exc:`SystemExit` is raised.
+    """
+    saved_environ = dict(os.environ)
+    saved_argv = sys.argv
+    saved_stdout, saved_stderr = sys.stdout, sys.stderr
+
+    root = logging.getLogger()
+    saved_handlers = root.handlers[:]
+    saved_level = root.level
+    capture = _CaptureHandler()
+
+    stdout, stderr = six.StringIO(), six.StringIO()
+
+    try:
+        _replace_environ(_environ(env, reskey, rsctmp, instance))
+        sys.argv = [agent_class.__name__] + \
+            ([action] if action is not None else []) + list(argv or [])
+        reset(agent_class)
+
+        root.handlers = [capture]
+        root.setLevel(logging.DEBUG)
+        sys.stdout, sys.stderr = stdout, stderr
+
+        code = agent_class().dispatch()
+    finally:
+        sys.stdout, sys.stderr = saved_stdout, saved_stderr
+        root.handlers = saved_handlers
+        root.setLevel(saved_level)
+        sys.argv = saved_argv
+        # Resetting ocf.env changes the environment, so restore it last
+        reset(agent_class)
+        _replace_environ(saved_environ)
+
+    return Result(code, capture.records, stdout.getvalue(), stderr.getvalue())
+
+
+class AgentRunner(object):
+    """
+    Runs actions of an agent repeatedly with common settings.
+
+    The arguments are defaults for the corresponding arguments of :func:`run`;
+    ``env`` and ``reskey`` given to :meth:`run` are merged with them.
+    """
+    def __init__(self, agent_class, env=None, reskey=None, rsctmp=None,
+                 instance='test'):
+        self.agent_class = agent_class
+        self.env = dict(env or {})
+        self.reskey = dict(reskey or {})
+        self.rsctmp = rsctmp
+        self.instance = instance
+
+    def run(self, action, env=None, reskey=None, argv=None):
+        """
+        Runs ``action`` and returns a :class:`Result`.
+        """
+        merged_env = dict(self.env)
+        merged_env.update(env or {})
+        merged_reskey = dict(self.reskey)
+        merged_reskey.update(reskey or {})
+
+        return run(self.agent_class, action, env=merged_env,
+                   reskey=merged_reskey, argv=argv, rsctmp=self.rsctmp,
+                   instance=self.instance)
+
+
+class TestCase(unittest.TestCase):
+    """
+    Base class for tests of code which uses :data:`ocf.env` outside an agent,
+    such as :mod:`ocf.state` or :mod:`ocf.shared_cache`.
+
+    Each test gets a temporary directory, :attr:`tmpdir`, which is used as
+    ``HA_RSCTMP``, and an environment prepared as for :func:`run` (with
+    ``OCF_RESOURCE_INSTANCE`` set to ``test``). Everything is :func:`reset`
+    before the test, and the environment is restored and the directory
+    removed after it.
+    """
+    def setUp(self):
+        super(TestCase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        # Cleanups run last first: reset, then restore the environment
+        self.addCleanup(_replace_environ, dict(os.environ))
+        self.addCleanup(reset)
+
+        _replace_environ(_environ(None, None, self.tmpdir, 'test'))
+        reset()
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
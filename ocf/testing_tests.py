@@ -0,0 +1,107 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf
+import ocf.state
+import ocf.testing
+import os
+
+
+class StateAgent(ocf.ResourceAgent):
+    """
+    Test agent
+
+    Keeps track of whether it is running in a state file.
+    """
+    state = ocf.Parameter(
+        shortdesc='State file', longdesc='Path to the state file.',
+        required=True)
+
+    count = ocf.Parameter(
+        shortdesc='Count', longdesc='A number.', content='integer',
+        default=1)
+
+    @ocf.Action()
+    def start(self):
+        open(self.state, 'w').close()
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action()
+    def stop(self):
+        if os.path.exists(self.state):
+            os.remove(self.state)
+        return ocf.OCF_SUCCESS
+
+    @ocf.Action(interval=10)
+    def monitor(self):
+        ocf.log.debug("count is %d", self.count)
+        if os.path.exists(self.state):
+            return ocf.OCF_SUCCESS
+        return ocf.OCF_NOT_RUNNING
+
+
+class AgentRunnerTests(ocf.testing.TestCase):
+    def setUp(self):
+        super(AgentRunnerTests, self).setUp()
+        self.agent = ocf.testing.AgentRunner(
+            StateAgent, rsctmp=self.tmpdir,
+            reskey={'state': os.path.join(self.tmpdir, 'state')})
+
+    def test_lifecycle(self):
+        assert self.agent.run('monitor').code == ocf.OCF_NOT_RUNNING
+        assert self.agent.run('start').code == ocf.OCF_SUCCESS
+        assert self.agent.run('monitor').code == ocf.OCF_SUCCESS
+        assert self.agent.run('stop').code == ocf.OCF_SUCCESS
+        assert self.agent.run('monitor').code == ocf.OCF_NOT_RUNNING
+
+    def test_parameters_are_not_cached_between_calls(self):
+        result = self.agent.run('monitor', reskey={'count': 5})
+        assert 'count is 5' in result.messages
+        result = self.agent.run('monitor')
+        assert 'count is 1' in result.messages
+
+    def test_invalid_parameters(self):
+        result = self.agent.run('monitor', reskey={'count': 'x'})
+        assert result.code == ocf.OCF_ERR_CONFIGURED
+
+    def test_unknown_action(self):
+        result = self.agent.run('frobnicate')
+        assert result.code == ocf.OCF_ERR_UNIMPLEMENTED
+        assert 'Usage:' in result.stderr
+
+    def test_meta_data(self):
+        result = self.agent.run('meta-data')
+        assert result.code == ocf.OCF_SUCCESS
+        assert '<parameter name="state"' in result.stdout
+
+    def test_environment_is_restored(self):
+        # Set by ocf.env, so make sure it isn't there already
+        lc_all = os.environ.pop('LC_ALL', None)
+        if lc_all is not None:
+            self.addCleanup(os.environ.__setitem__, 'LC_ALL', lc_all)
+
+        before = dict(os.environ)
+        self.agent.run('monitor', env={'HA_FOO': 'bar'})
+        assert dict(os.environ) == before
+
+    def test_deferred_saves_are_forgotten(self):
+        state = ocf.state.State('leftover')
+        state['x'] = 1
+        state.save(defer=True)
+
+        self.agent.run('monitor')
+        assert not os.path.exists(state.path)
@@ -15,6 +15,16 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import contextlib
+import errno
+import fcntl
+import os
+import tempfile
+import time
+
+#: Monotonic clock, falling back to the wall clock on old Pythons.
+monotonic = getattr(time, 'monotonic', time.time)
+
 
 class cached_property(object):
     """
@@ -38,4 +48,161 @@ class cached_property(object):
         res = instance.__dict__[self.name] = self.func(instance)
         return res
 
+
+def makedirs(path, mode=0o755):
+    """
+    Recursively create the directory ``path``, like :func:`os.makedirs`.
+
+    Unlike :func:`os.makedirs`, no error is raised if the directory already
+    exists.
+    """
+    try:
+        os.makedirs(path, mode)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+def atomic_write(path, data):
+    """
+    Atomically replace the contents of ``path`` with the bytes in ``data``.
+
+    The data is written to a temporary file in the same directory which is
+    then renamed over ``path``, so concurrent readers see either the old or the
+    new contents but never a partially-written file. The directory containing
+    ``path`` is created if necessary.
+    """
+    directory = os.path.dirname(path)
+    makedirs(directory)
+
+    fd, tmp = tempfile.mkstemp(
+        dir=directory, prefix='.{0}.'.format(os.path.basename(path)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def _open_lock(path):
+    # Keep the lock file from being inherited by processes the agent starts,
+    # which would otherwise hold the lock for as long as they run: Python 2
+    # makes file descriptors inheritable, and its subprocess doesn't close
+    # them by default
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_CLOEXEC', 0),
+                 0o644)
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+    return fd
+
+
+@contextlib.contextmanager
+def locked(path, shared=False, timeout=None, interval=0.01):
+    """
+    Context manager holding a :func:`fcntl.flock` lock on the file ``path``.
+
+    The file (and its directory) is created if necessary. The lock is released,
+    and the file closed, when the context is exited. Lock files are never
+    removed, as doing so would allow two processes to hold "the" lock at the
+    same time.
+
+    :param str path: Path to the lock file.
+    :param bool shared: Take a shared rather than an exclusive lock.
+    :param float timeout: Maximum number of seconds to wait for the lock.
+      Optional; waits forever if not given.
+    :param float interval: Number of seconds to wait between attempts to take
+      the lock when a ``timeout`` is given.
+    :raises LockTimeout: if the lock could not be taken within ``timeout``
+      seconds.
+
+    Usage::
+
+        with ocf.util.locked('/var/run/resource-agents/foo.lock', timeout=5):
+            ...
+    """
+    makedirs(os.path.dirname(path))
+    fd = _open_lock(path)
+    try:
+        op = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+
+        if timeout is None:
+            fcntl.flock(fd, op)
+        else:
+            deadline = time.time() + timeout
+            while True:
+                try:
+                    fcntl.flock(fd, op | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if time.time() >= deadline:
+                    raise LockTimeout(path)
+                time.sleep(interval)
+
+        yield fd
+    finally:
+        os.close(fd)
+
+
+@contextlib.contextmanager
+def semaphore(path, count, timeout=None, interval=0.01, max_interval=0.5):
+    """
+    Context manager holding one of ``count`` slots, shared between processes.
+
+    Each slot is a lock file, ``path`` followed by ``.0``, ``.1`` and so on,
+    and is held with an exclusive :func:`fcntl.flock` lock, so a slot is freed
+    even if its holder is killed. While every slot is taken, the free slots are
+    looked for again after ``interval`` seconds, backing off to at most
+    ``max_interval``. The index of the slot is given to the ``with`` block.
+
+    :param str path: Path prefix for the lock files.
+    :param int count: Number of slots.
+    :param float timeout: Maximum number of seconds to wait for a slot.
+      Optional; waits forever if not given.
+    :raises LockTimeout: if no slot could be taken within ``timeout`` seconds.
+
+    Usage::
+
+        with ocf.util.semaphore('/var/run/resource-agents/foo', 4, timeout=5):
+            ...
+    """
+    makedirs(os.path.dirname(path))
+    fds = [_open_lock("{0}.{1}".format(path, i)) for i in range(count)]
+    try:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            for slot, fd in enumerate(fds):
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except (IOError, OSError) as e:
+                    if e.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+            else:
+                delay = interval
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise LockTimeout(path)
+                    delay = min(delay, remaining)
+                time.sleep(delay)
+                interval = min(interval * 1.5, max_interval)
+                continue
+            break
+
+        yield slot
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+class LockTimeout(Exception):
+    """
+    Raised by :func:`locked` and :func:`semaphore` when a lock cannot be taken
+    in time.
+    """
+
 # vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,50 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import fcntl
+import ocf.util
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+class LockTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'lock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_locked_not_inherited(self):
+        with ocf.util.locked(self.path) as fd:
+            assert fcntl.fcntl(fd, fcntl.F_GETFD) & fcntl.FD_CLOEXEC
+
+    def test_semaphore_not_inherited(self):
+        with ocf.util.semaphore(self.path, 1, timeout=1):
+            # Started by the action, and still running after it
+            proc = subprocess.Popen(
+                [sys.executable, '-c', 'import time; time.sleep(30)'],
+                close_fds=False)
+        self.addCleanup(proc.wait)
+        self.addCleanup(proc.kill)
+
+        with ocf.util.semaphore(self.path, 1, timeout=1):
+            pass
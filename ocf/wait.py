@@ -0,0 +1,307 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+Waiting for things to happen, without sleeping in a loop.
+
+``start`` and ``stop`` actions spend much of their time waiting: for a daemon
+to write its PID file, to start listening, or to exit. Checking in a
+:func:`time.sleep` loop adds up to a whole sleep interval to every transition.
+The functions in this module are woken by the kernel instead, where it can tell
+us:
+
+* :func:`wait_for_file` watches the file's directory with ``inotify``.
+* :func:`wait_for_process_exit` waits on a ``pidfd`` (Linux 5.3 and Python 3.9
+  or later).
+
+When these are not available, and for conditions the kernel can't report
+(:func:`wait_for_listen` and :func:`wait_until`), the condition is checked
+with an exponential back-off, starting at 10ms, so that quick transitions are
+still noticed quickly.
+
+Every function takes a ``timeout`` in seconds, and never waits beyond the
+action's deadline (:attr:`ocf.environment.Environment.deadline`) whatever the
+``timeout``. Each returns a true value if the condition was met, and a false
+value if time ran out.
+
+Usage::
+
+    @ocf.Action(timeout=20)
+    def start(self):
+        subprocess.check_call(['/usr/sbin/food', '--pidfile', self.pidfile])
+        if not ocf.wait.wait_for_file(self.pidfile, timeout=10):
+            return ocf.OCF_ERR_GENERIC
+        if not ocf.wait.wait_for_listen(('127.0.0.1', 8080)):
+            return ocf.OCF_ERR_GENERIC
+        return ocf.OCF_SUCCESS
+"""
+
+from __future__ import absolute_import
+
+import ctypes
+import errno
+import ocf
+import ocf.proc
+import os
+import select
+import socket
+import time
+
+from ocf.util import monotonic
+
+# inotify(7) constants
+_IN_MODIFY = 0x002
+_IN_ATTRIB = 0x004
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO |
+               _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+
+#: Seconds to wait after the first check when polling with back-off.
+FIRST_INTERVAL = 0.01
+
+#: Factor by which the polling interval grows after each check.
+BACKOFF = 1.5
+
+#: Default maximum number of seconds between checks when polling.
+MAX_INTERVAL = 0.5
+
+_libc = []
+
+
+def deadline_after(timeout):
+    """
+    Returns the time (:func:`ocf.util.monotonic`) at which to give up waiting
+    ``timeout`` seconds (forever if ``None``), taking the action's deadline
+    into account. Returns ``None`` to wait forever.
+    """
+    deadline = ocf.env.deadline
+    if timeout is not None:
+        own = monotonic() + timeout
+        deadline = own if deadline is None else min(deadline, own)
+    return deadline
+
+
+def time_until(deadline):
+    """
+    Returns the number of seconds left before ``deadline`` (as returned by
+    :func:`deadline_after`), or ``None`` if there is no deadline. Never
+    negative.
+    """
+    if deadline is None:
+        return None
+    return max(0, deadline - monotonic())
+
+
+def _wait_readable(fd, timeout):
+    """
+    Waits up to ``timeout`` seconds (forever if ``None``) for ``fd`` to become
+    readable. Returns ``True`` if it did.
+    """
+    if hasattr(select, 'epoll'):
+        ep = select.epoll()
+        try:
+            ep.register(fd, select.EPOLLIN)
+            while True:
+                try:
+                    return bool(ep.poll(-1 if timeout is None else timeout))
+                except (IOError, OSError) as e:
+                    if e.errno != errno.EINTR:
+                        raise
+        finally:
+            ep.close()
+
+    readable, _, _ = select.select([fd], [], [], timeout)
+    return bool(readable)
+
+
+def wait_until(predicate, timeout=None, interval=FIRST_INTERVAL,
+               max_interval=MAX_INTERVAL):
+    """
+    Calls ``predicate`` until it returns a true value, with exponential
+    back-off between calls.
+
+    :param predicate: Function taking no arguments.
+    :param float timeout: Maximum number of seconds to wait.
+    :param float interval: Seconds to wait after the first call.
+    :param float max_interval: Maximum seconds to wait between calls.
+
+    Returns the first true value returned by ``predicate``, or the false value
+    returned by its last call if time ran out. ``predicate`` is always called
+    at least once, and once more at the deadline.
+    """
+    deadline = deadline_after(timeout)
+
+    while True:
+        result = predicate()
+        if result:
+            return result
+
+        remaining = time_until(deadline)
+        if remaining == 0:
+            return result
+
+        time.sleep(interval if remaining is None else min(interval, remaining))
+        interval = min(interval * BACKOFF, max_interval)
+
+
+def _inotify(directory):
+    """
+    Returns an ``inotify`` file descriptor watching ``directory``, or ``None``
+    if ``inotify`` is not available.
+    """
+    if not _libc:
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            libc.inotify_init1, libc.inotify_add_watch
+        except (OSError, AttributeError):
+            libc = None
+        _libc.append(libc)
+
+    libc = _libc[0]
+    if libc is None:
+        return None
+
+    fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+        return None
+
+    path = directory.encode('utf-8') if not isinstance(directory, bytes) \
+        else directory
+    if libc.inotify_add_watch(fd, path, _WATCH_MASK) < 0:
+        os.close(fd)
+        return None
+
+    return fd
+
+
+def _drain(fd):
+    try:
+        while os.read(fd, 4096):
+            pass
+    except OSError as e:
+        if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+
+
+def wait_for_file(path, timeout=None, exists=True):
+    """
+    Waits for ``path`` to exist (or, if ``exists`` is false, to no longer
+    exist). Returns ``True`` if it does.
+
+    The directory containing ``path`` is watched with ``inotify``, so the
+    change is noticed as soon as it happens. If the directory itself does not
+    exist yet, or ``inotify`` is unavailable, this falls back to polling.
+    """
+    def check():
+        return os.path.exists(path) == exists
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd = _inotify(directory)
+    if fd is None:
+        return wait_until(check, timeout)
+
+    try:
+        deadline = deadline_after(timeout)
+        # Check after adding the watch, so no change can be missed
+        while not check():
+            remaining = time_until(deadline)
+            if remaining == 0:
+                return False
+            if _wait_readable(fd, remaining):
+                _drain(fd)
+        return True
+    finally:
+        os.close(fd)
+
+
+def wait_for_process_exit(pid, timeout=None, max_interval=MAX_INTERVAL):
+    """
+    Waits for process ``pid`` to exit. Returns ``True`` if it has.
+
+    A process which has exited but not yet been reaped by its parent (a
+    zombie) counts as having exited. This waits on a ``pidfd`` where possible,
+    and otherwise polls ``/proc``, waiting at most ``max_interval`` seconds
+    between checks.
+    """
+    def poll():
+        return wait_until(lambda: ocf.proc.exited(pid), timeout,
+                          max_interval=max_interval)
+
+    pidfd_open = getattr(os, 'pidfd_open', None)
+    if pidfd_open is None:
+        return poll()
+
+    try:
+        fd = pidfd_open(pid)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return True
+        # Probably not supported by the kernel
+        return poll()
+
+    try:
+        return _wait_readable(fd, time_until(deadline_after(timeout)))
+    finally:
+        os.close(fd)
+
+
+def _connects(address, timeout):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    if family == socket.AF_INET and ':' in address[0]:
+        family = socket.AF_INET6
+
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(address)
+        return True
+    except (socket.error, socket.timeout):
+        return False
+    finally:
+        sock.close()
+
+
+def wait_for_listen(address, timeout=None):
+    """
+    Waits until a connection can be made to ``address``. Returns ``True`` if
+    it can.
+
+    :param address: A ``(host, port)`` tuple for TCP, or the path to a Unix
+      socket.
+
+    The kernel can't tell us when somebody starts listening, so this tries to
+    connect with exponential back-off. No attempt lasts longer than a second,
+    or beyond the deadline.
+    """
+    deadline = deadline_after(timeout)
+
+    def connects():
+        remaining = time_until(deadline)
+        return _connects(address, 1 if remaining is None else
+                         max(min(remaining, 1), 0.001))
+
+    return wait_until(connects, timeout)
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,102 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf
+import ocf.wait
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from ocf.util import monotonic
+
+
+def later(delay, func, *args):
+    timer = threading.Timer(delay, func, args)
+    timer.start()
+    return timer
+
+
+class WaitTests(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        ocf.env.__dict__.pop('deadline', None)
+
+    def test_wait_until(self):
+        calls = []
+
+        def predicate():
+            calls.append(1)
+            return len(calls) >= 3 and 'done'
+
+        assert ocf.wait.wait_until(predicate, timeout=5) == 'done'
+        assert not ocf.wait.wait_until(lambda: 0, timeout=0.05)
+
+    def test_wait_for_file(self):
+        path = os.path.join(self.tmpdir, 'pid')
+        later(0.1, lambda: open(path, 'w').close())
+        started = monotonic()
+        assert ocf.wait.wait_for_file(path, timeout=5)
+        assert monotonic() - started < 2
+
+        later(0.1, os.unlink, path)
+        assert ocf.wait.wait_for_file(path, timeout=5, exists=False)
+
+    def test_wait_for_file_timeout(self):
+        path = os.path.join(self.tmpdir, 'never')
+        assert not ocf.wait.wait_for_file(path, timeout=0.1)
+
+    def test_wait_for_file_missing_directory(self):
+        path = os.path.join(self.tmpdir, 'sub', 'pid')
+        later(0.1, lambda: os.mkdir(os.path.dirname(path)) or
+              open(path, 'w').close())
+        assert ocf.wait.wait_for_file(path, timeout=5)
+
+    def test_deadline(self):
+        ocf.env.__dict__['deadline'] = monotonic() + 0.1
+        started = monotonic()
+        assert not ocf.wait.wait_for_file(
+            os.path.join(self.tmpdir, 'never'), timeout=30)
+        assert monotonic() - started < 5
+
+    def test_wait_for_process_exit(self):
+        proc = subprocess.Popen(['sleep', '30'])
+        try:
+            assert not ocf.wait.wait_for_process_exit(proc.pid, timeout=0.1)
+            later(0.1, proc.kill)
+            # Not reaped yet, so this sees a zombie
+            assert ocf.wait.wait_for_process_exit(proc.pid, timeout=5)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_wait_for_listen(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        address = sock.getsockname()
+        try:
+            assert not ocf.wait.wait_for_listen(address, timeout=0.1)
+            later(0.1, sock.listen, 1)
+            assert ocf.wait.wait_for_listen(address, timeout=5)
+        finally:
+            sock.close()
@@ -0,0 +1,199 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+"""
+A watchdog which records where a slow action is stuck.
+
+When an action overruns its timeout, the CRM kills the agent and all evidence
+of what it was doing is lost. With ``HA_WATCHDOG`` set to a fraction such as
+``0.8`` (:attr:`ocf.environment.Environment.watchdog`),
+:meth:`ocf.ra.ResourceAgent.execute` arms a watchdog which, once that fraction
+of the action's timeout has passed:
+
+* logs a warning naming the action, how long it has been running, and the
+  agent's child processes with their command lines;
+* writes the stack of every thread to ``HA_DEBUGLOG`` (or to standard error
+  if there is no debug log). Like :class:`ocf.logging.AppendFileHandler`, the
+  file is opened with ``O_APPEND`` and each dump is written with a single
+  :func:`os.write`, so that it isn't interleaved with other agents' output;
+* repeats the stack dump every ``HA_WATCHDOG_INTERVAL`` seconds
+  (:attr:`ocf.environment.Environment.watchdog_interval`), if set.
+
+As a last resort, in case the interpreter itself is stuck and the watchdog
+thread can't run, :func:`faulthandler.dump_traceback_later` writes the stacks
+once more just before the action's deadline. That dump is written a line at a
+time.
+
+The watchdog is disarmed by a teardown hook (see :mod:`ocf.lifecycle`) as
+soon as the action finishes.
+"""
+
+from __future__ import absolute_import
+
+import ocf
+import ocf.lifecycle
+import ocf.proc
+import os
+import sys
+import threading
+import traceback
+
+from ocf.util import monotonic
+
+try:
+    import faulthandler
+except ImportError:
+    faulthandler = None
+
+# Seconds before the deadline at which the last-resort dump is written
+_LAST_RESORT = 1.0
+
+_STDERR = 2
+
+
+def _children():
+    try:
+        table = ocf.proc.ProcessTable(('ppid', 'cmdline'))
+    except (IOError, OSError):
+        return []
+
+    return ["{pid} ({cmd})".format(pid=p.pid, cmd=" ".join(p.cmdline or ()))
+            for p in table.descendants(os.getpid())]
+
+
+class Watchdog(object):
+    """
+    Dumps the stacks of all threads to ``fd`` if still armed after ``delay``
+    seconds, and then every ``interval`` seconds.
+
+    :param float delay: Seconds after arming at which to fire.
+    :param int fd: File descriptor to which to write the stacks.
+    :param float interval: Seconds between repeated dumps, or ``None`` to dump
+      only once.
+    :param float deadline: Time (:func:`ocf.util.monotonic`) at which the
+      action will be killed; the last-resort dump is written just before.
+    """
+    def __init__(self, delay, fd, interval=None, deadline=None):
+        self.delay = delay
+        self.fd = fd
+        self.interval = interval
+        self.deadline = deadline
+        self.armed = monotonic()
+        self.dumps = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='ocf.watchdog')
+        self._thread.daemon = True
+        self._last_resort = False
+
+    def start(self):
+        """
+        Arms the watchdog.
+        """
+        self._thread.start()
+
+        if faulthandler is not None and self.deadline is not None:
+            last = self.deadline - monotonic() - _LAST_RESORT
+            if last > self.delay:
+                faulthandler.dump_traceback_later(last, file=self.fd)
+                self._last_resort = True
+
+    def cancel(self):
+        """
+        Disarms the watchdog.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            # Let a dump in progress finish
+            self._thread.join(1)
+        if self._last_resort:
+            faulthandler.cancel_dump_traceback_later()
+            self._last_resort = False
+
+    def _run(self):
+        if self._stop.wait(self.delay):
+            return
+
+        ocf.log.warning(
+            "{action} still running after {t:.1f}s; dumping stacks. Child "
+            "processes: {children}".format(
+                action=ocf.env.action, t=monotonic() - self.armed,
+                children=", ".join(_children()) or "none"))
+
+        while True:
+            self.dump()
+            if self.interval is None or self._stop.wait(self.interval):
+                return
+
+    def dump(self):
+        """
+        Writes the stacks of all threads, other than the watchdog's own, to the
+        file descriptor in a single :func:`os.write`.
+        """
+        self.dumps += 1
+        lines = ["{tag}: stacks after {t:.1f}s:\n".format(
+            tag=ocf.env.logtag, t=monotonic() - self.armed)]
+
+        me = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident != me:
+                lines.append("Thread {0}:\n".format(ident))
+                lines.extend(traceback.format_stack(frame))
+
+        os.write(self.fd, "".join(lines).encode('utf-8', 'replace'))
+
+
+_watchdog = []
+
+
+def arm():
+    """
+    Arms the watchdog for the current action, if ``HA_WATCHDOG`` is set and
+    the action has a timeout. Returns the :class:`Watchdog`, or ``None``.
+
+    Called by :meth:`ocf.ra.ResourceAgent.execute`.
+    """
+    fraction = ocf.env.watchdog
+    if fraction is None or ocf.env.timeout is None:
+        return None
+
+    if ocf.env.debuglog:
+        fd = os.open(ocf.env.debuglog,
+                     os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    else:
+        fd = _STDERR
+
+    watchdog = Watchdog(
+        ocf.env.timeout * fraction - (monotonic() - ocf.env.started), fd,
+        interval=ocf.env.watchdog_interval, deadline=ocf.env.deadline)
+    watchdog.start()
+    _watchdog.append(watchdog)
+    return watchdog
+
+
+@ocf.lifecycle.on_teardown
+def disarm(ret=None):
+    """
+    Disarms the watchdog armed by :func:`arm`, if any.
+    """
+    while _watchdog:
+        watchdog = _watchdog.pop()
+        watchdog.cancel()
+        if watchdog.fd != _STDERR:
+            os.close(watchdog.fd)
+
+# vi:tw=0:wm=0:nowrap:ai:et:ts=8:softtabstop=4:shiftwidth=4
@@ -0,0 +1,67 @@
+# This file is part of python-ocf.
+# Copyright (C) 2015  Tiger Computing Ltd. <info@tiger-computing.co.uk>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import ocf.watchdog
+import os
+import tempfile
+import time
+import unittest
+
+
+class WatchdogTests(unittest.TestCase):
+    def setUp(self):
+        self.stream = tempfile.TemporaryFile('w+')
+
+    def tearDown(self):
+        self.stream.close()
+
+    def output(self):
+        self.stream.seek(0)
+        return self.stream.read()
+
+    def test_dumps_stacks(self):
+        watchdog = ocf.watchdog.Watchdog(0.05, self.stream.fileno(),
+                                         interval=0.05)
+        watchdog.start()
+        time.sleep(0.3)
+        watchdog.cancel()
+
+        assert watchdog.dumps >= 2
+        output = self.output()
+        assert 'stacks after' in output
+        assert 'test_dumps_stacks' in output
+
+    def test_cancelled_in_time(self):
+        watchdog = ocf.watchdog.Watchdog(5, self.stream.fileno())
+        watchdog.start()
+        watchdog.cancel()
+        assert watchdog.dumps == 0
+        assert self.output() == ''
+
+    def test_appends(self):
+        self.stream.write('before\n')
+        self.stream.flush()
+        fd = os.open('/proc/self/fd/{0}'.format(self.stream.fileno()),
+                     os.O_WRONLY | os.O_APPEND)
+        self.addCleanup(os.close, fd)
+
+        watchdog = ocf.watchdog.Watchdog(5, fd)
+        watchdog.dump()
+        watchdog.dump()
+        output = self.output()
+        assert output.startswith('before\n')
+        assert output.count('stacks after') == 2
@@ -37,6 +37,7 @@ setup(
     url='https://github.com/tigercomputing/python-ocf/',
     install_requires=[
         'lxml',
+        'selectors34; python_version < "3.4"',
         'six',
     ],
     classifiers=[
@@ -50,4 +51,9 @@ setup(
         'Topic :: System :: Systems Administration',
     ],
     packages=find_packages(),
+    entry_points={
+        'console_scripts': [
+            'ocf-agent = ocf.agents:main',
+        ],
+    },
 )